@@ -1,69 +1,65 @@
-from openpyxl import Workbook
+import tempfile
+import time
+
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
-from datetime import datetime, date
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.html import format_html
 from .export_excel import ExportExcelAction
-from openpyxl.styles import Font
+from .exports import enqueue_export
+from .metrics import EXPORT_BYTES, EXPORT_DURATION, EXPORT_ROWS
 from unidecode import unidecode
 from .models import KipReport
 from django.contrib import messages
 from django.db.models import Q
 
 
-def style_output_file(file):
-    black_font = Font(color='000000', bold=True)
-    for cell in file["1:1"]:
-        cell.font = black_font
-
-    for column_cells in file.columns:
-        length = max(len((cell.value)) for cell in column_cells)
-        length += 10
-        file.column_dimensions[column_cells[0].column_letter].width = length
-
-    return file
-
-
-def convert_data_date(value):
-    return value.strftime('%d/%m/%Y')
+def export_as_xls(self, request, queryset):
+    if not request.user.is_staff:
+        raise PermissionDenied
+    file_name = unidecode(self.model._meta.verbose_name)
 
+    if queryset.count() > settings.EXPORT_INLINE_LIMIT:
+        job, reused = enqueue_export(self, queryset, request.user)
+        self.message_user(
+            request,
+            format_html(
+                '{} <a href="{}">{}</a>',
+                "Такая выгрузка уже запрошена." if reused else "Выгрузка поставлена в очередь.",
+                reverse("admin:ARM_exportjob_changelist"),
+                "Перейти к выгрузкам",
+            ),
+            messages.INFO,
+        )
+        return
 
-def convert_boolean_field(value):
-    if value:
-        return 'Yes'
-    return 'No'
+    started = time.perf_counter()
+    output = tempfile.TemporaryFile()
+    rows = ExportExcelAction.write_xlsx(self, queryset, self.list_display, output)
+    EXPORT_DURATION.observe(time.perf_counter() - started)
+    EXPORT_BYTES.observe(output.tell())
+    EXPORT_ROWS.observe(rows)
+    output.seek(0)
+
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=f"{file_name}.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
 
 
-def export_as_xls(self, request, queryset):
+def export_as_csv(self, request, queryset):
     if not request.user.is_staff:
         raise PermissionDenied
-    opts = self.model._meta
-    field_names = self.list_display
-    file_name = unidecode(opts.verbose_name)
-    blank_line = []
-    wb = Workbook()
-
-    ws = wb.active
-    ws.append(ExportExcelAction.generate_header(self, self.model, field_names))
-
-    for obj in queryset:
-        row = []
-        for field in field_names:
-            is_admin_field = hasattr(self, field)
-            if is_admin_field:
-                value = getattr(self, field)(obj)
-            else:
-                value = getattr(obj, field)
-                if isinstance(value, datetime) or isinstance(value, date):
-                    value = convert_data_date(value)
-                elif isinstance(value, bool):
-                    value = convert_boolean_field(value)
-            row.append(str(value) if value is not None else "--")
-        ws.append(row)
-
-    ws = style_output_file(ws)
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename={file_name}.xlsx'
-    wb.save(response)
+    file_name = unidecode(self.model._meta.verbose_name)
+
+    response = StreamingHttpResponse(
+        ExportExcelAction.generate_csv(self, queryset, self.list_display),
+        content_type="text/csv; charset=utf-8",
+    )
+    response['Content-Disposition'] = f'attachment; filename={file_name}.csv'
     return response
 
 
@@ -85,7 +81,7 @@ def add_to_kipreport(self, request, queryset):
             device.pk for device in queryset if device.status in (
                 device.send,
                 device.in_progress,
-            ) or (device.stock is None or device.station)
+            ) or (device.stock_id is None or device.station_id)
         ]
     )
 
@@ -124,4 +120,5 @@ def add_to_kipreport(self, request, queryset):
 
 
 export_as_xls.short_description = "Экспортировать в Excel"
+export_as_csv.short_description = "Экспортировать в CSV"
 add_to_kipreport.short_description = "Добавить в отчет КИП"
\ No newline at end of file
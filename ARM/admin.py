@@ -1,13 +1,16 @@
+import logging
 import re
 
-from functools import reduce
-from operator import or_, and_
 from typing import Optional
 
 from django.contrib import messages
 from django.contrib.admin import AdminSite
-from django.db.models import Q
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
 from django.contrib import admin
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django import forms
 from django.forms import TextInput, Textarea, models, widgets, HiddenInput
@@ -30,16 +33,36 @@ from .models import (Station,
                      Tipe,
                      Comment,
                      KipReport,
-                     DeviceKipReport)
-
-from ARM.actions import export_as_xls, add_to_kipreport
+                     DeviceKipReport,
+                     ExportJob,
+                     PlaceOccupancy,
+                     ReplacementCalendar,
+                     RequestProfile,
+                     RequestQueryLog)
+
+from ARM.actions import export_as_xls, export_as_csv, add_to_kipreport
+from ARM.planner import DEVICE_LABEL_RELATED
+from ARM.profiling import read_profile_file
+from ARM.search import search_devices
+from ARM.stock import allocate_stock
+from ARM.topology import get_topology
 from ARM import filters
 
 
+logger = logging.getLogger(__name__)
+
+
 AdminSite.site_url = ''
 AdminSite.empty_value_display = '--'
 
 
+def user_in_group(user, group_name: str) -> bool:
+    """Проверка группы по user.groups.all(), чтобы использовать
+    prefetch_related("groups"), если он был сделан"""
+
+    return user is not None and any(group.name == group_name for group in user.groups.all())
+
+
 @admin.register(Rack)
 class RackAdmin(admin.ModelAdmin):
     list_filter = ["station"]
@@ -58,21 +81,36 @@ class DeviceForm(forms.ModelForm):
         return inventory_number
 
 
+def is_autocomplete(request) -> bool:
+    match = getattr(request, "resolver_match", None)
+    return match is not None and match.url_name == "autocomplete"
+
+
+class DeviceChangeList(ChangeList):
+    """Страница списка загружает только колонки списка и подписи
+    приборов; get_queryset (и действия над выбранными) не меняется"""
+
+    def get_results(self, request):
+        self.queryset = self.queryset.for_listing()
+        super().get_results(request)
+
+
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
     form = DeviceForm
     readonly_fields = ("next_check_date",)
-    actions = [export_as_xls, add_to_kipreport]
+    actions = [export_as_xls, export_as_csv, add_to_kipreport]
     list_filter = [
         "station",
         "stock",
-        "avz",
+        ("avz", filters.AVZListFilter),
         "status",
         "contact_type",
         "device_type",
         "next_check_date",
         filters.YearFilter,
-        filters.MonthFilter
+        filters.MonthFilter,
+        filters.LiveStatusFilter,
     ]
     list_display = [
         "station",
@@ -84,6 +122,12 @@ class DeviceAdmin(admin.ModelAdmin):
         "next_check_date",
         "status",
     ]
+    list_select_related = (
+        "station",
+        "device_type",
+        "mounting_address__rack__station",
+        "avz__station",
+    )
     autocomplete_fields = ("mounting_address", "device_type")
     list_display_links = list_display
     search_fields = ("name", "inventory_number", "device_type__name")
@@ -96,22 +140,27 @@ class DeviceAdmin(admin.ModelAdmin):
             year = check_date.year + obj.frequency_of_check
             obj.next_check_date = date(year=year, month=check_date.month, day=check_date.day)
             obj.status = obj.get_status()
-            print(obj.status, obj.get_status(), obj.next_check_date)
+            logger.debug("device_id=%s status=%s next_check_date=%s", obj.pk, obj.status, obj.next_check_date)
         change = True
         return super().save_model(request, obj, form, change)
 
     def get_search_results(self, request, queryset, search_term):
-        queryset, distinct = super().get_search_results(
-            request, queryset, search_term
-        )
-
-        if search_term:
-            queryset &= self.model.objects.filter(
-                Q(name__iregex=search_term) | Q(inventory_number__iregex=search_term) | Q(device_type__name__iregex=search_term)
-            )
-        
+        # поиск по индексу (ARM.search) вместо icontains и iregex по таблице
+        queryset, distinct = search_devices(queryset, search_term), False
+
+        # автодополнению нужны лишь подписи приборов; список приборов
+        # ограничивает колонки в DeviceChangeList, а действия над
+        # выбранными приборами получают полные объекты
+        if is_autocomplete(request):
+            queryset = queryset.for_listing()
         return queryset, distinct
 
+    def get_changelist(self, request, **kwargs):
+        return DeviceChangeList
+
+    def get_export_queryset(self, queryset):
+        return queryset.for_listing()
+
 
 class AVZInlineAdmin(admin.StackedInline):
     model = AVZ
@@ -175,30 +224,16 @@ class PlaceAdmin(admin.ModelAdmin):
     list_filter = ("rack__station",)
 
     def get_search_results(self, request, queryset, search_term):
-        orig_queryset = queryset
-        queryset, use_distinct = super().get_search_results(
-            request, queryset, search_term
-        )
-        search_words = search_term.split("-")
-        if search_words:
-            if len(search_words) == 2:
-                q_objects = [
-                    Q(**{field + "__exact": word})
-                    for field, word in {self.search_fields[0]: search_words[0],
-                                        self.search_fields[1]: search_words[1]}.items()
-                ]
-                queryset |= self.model.objects.filter(reduce(and_, q_objects))
-            else:
-                q_objects = [
-                    Q(**{field + "__icontains": word})
-                    for field in self.search_fields
-                    for word in search_words
-                ]
-                queryset |= self.model.objects.filter(reduce(or_, q_objects))
-
-        queryset = queryset & orig_queryset
-
-        return queryset, use_distinct
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        # "27-7", "тоннель-стр" или начало номера статива "27" - диапазон
+        # по индексу address_key; номер места без статива - точное совпадение
+        matches = queryset.address_prefix(search_term)
+        if "-" not in search_term:
+            matches |= queryset.filter(number=search_term)
+        return matches, False
 
 
 @admin.register(Station)
@@ -282,10 +317,13 @@ class ReportCommentInline(admin.StackedInline):
         })
     }
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("author")
+
     def published_but(self, obj):
         if obj.id:
             return obj.author.username.upper()
-        mech_report_id = obj.mech_report.id
+        mech_report_id = obj.mech_report_id
         return mark_safe(
             f'<button id="comment-button" class="button" onclick="create_comment_ajax({mech_report_id})">'
             '<a href="javascript://" class="button" '
@@ -329,52 +367,53 @@ class DevicesReportInline(admin.TabularInline):
     verbose_name_plural = "Приборы в отчете"
     verbose_name = "Прибор"
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            *(f"device__{field}" for field in DEVICE_LABEL_RELATED),
+            "mechanicreport__user",
+        ).prefetch_related("mechanicreport__user__groups")
+
     def button(self, obj):
-        device = Device.objects.get(id=obj.device_id)
-        mechanic_report = MechanicReport.objects.get(id=obj.mechanicreport_id)
+        device = obj.device
 
-        if mechanic_report.user.groups.filter(name="электромеханики"):
-            print(mechanic_report.user.groups.all())
+        if user_in_group(obj.mechanicreport.user, "электромеханики"):
             return "--"
 
-        if (device.station or device.avz) and device.status not in (Device.send, ):
+        if (device.station_id or device.avz_id) and device.status not in (Device.send, ):
             return mark_safe(
                 f'<a class="button" href="javascript://" '
-                f'onclick="update_device_ajax({device.id})">Прибор заменен</a>'
+                f'onclick="update_device_ajax({device.id}, {device.version})">Прибор заменен</a>'
             )
         elif device.status == Device.send:
             return mark_safe(
                 f'<a class="button" href="javascript://" '
-                f'onclick="update_device_ajax({device.id})">Прибор установлен</a>'
+                f'onclick="update_device_ajax({device.id}, {device.version})">Прибор установлен</a>'
             )
-        elif device.stock and not device.station:
+        elif device.stock_id and not device.station_id:
             return "Прибор на складе"
-        elif device.stock is None:
+        elif device.stock_id is None:
             return f"{device.status}"
 
     @admin.display(description="Отметить дефекты")
     def defect_button(self, obj):
-        device = Device.objects.get(id=obj.device_id)
-        mechanic_report = MechanicReport.objects.get(id=obj.mechanicreport_id)
-        
-        if mechanic_report.user.groups.filter(name="электромеханики"):
+        if user_in_group(obj.mechanicreport.user, "электромеханики"):
             return "--"
 
         return mark_safe(
             f'<a class="button" href="javascript://" '
-            f'onclick="mark_defect_device_ajax({device.id})">Есть дефекты</a>'
+            f'onclick="mark_defect_device_ajax({obj.device_id}, {obj.device.version})">Есть дефекты</a>'
         )
 
     def get_current_date(self, obj):
-        date = Device.objects.get(id=obj.device_id).current_check_date.strftime("%d.%m.%Y")
+        date = obj.device.current_check_date.strftime("%d.%m.%Y")
         return date
 
     def get_next_date(self, obj):
-        date = Device.objects.get(id=obj.device_id).next_check_date.strftime("%d.%m.%Y")
+        date = obj.device.next_check_date.strftime("%d.%m.%Y")
         return date
 
     def get_status(self, obj):
-        status = Device.objects.get(id=obj.device_id).status
+        status = obj.device.status
         if status:
             return status
         return AdminSite.empty_value_display
@@ -398,6 +437,40 @@ class DevicesReportInline(admin.TabularInline):
               "admin/js/mark_defect_device_ajax.js"]
 
 
+class MechanicReportChangeList(ChangeList):
+    """Подгружает превью приборов для всех отчетов страницы одним запросом"""
+
+    def get_results(self, request):
+        super().get_results(request)
+
+        reports = {report.pk: report for report in self.result_list}
+        for report in reports.values():
+            report.device_preview = []
+        if not reports:
+            return
+
+        # номер строки в отчете считается окном за один проход; Django 4.1
+        # не фильтрует по Window, поэтому отбор идет во внешнем запросе
+        through = MechanicReport.devices.through
+        numbered, params = through.objects.filter(
+            mechanicreport_id__in=reports,
+        ).annotate(
+            position=Window(RowNumber(), partition_by=F("mechanicreport_id"), order_by=F("pk").asc()),
+        ).values("pk", "position").query.sql_with_params()
+
+        rows = through.objects.filter(
+            pk__in=RawSQL(
+                f'SELECT "{through._meta.pk.column}" FROM ({numbered}) AS "numbered" WHERE "position" <= %s',
+                (*params, self.model_admin.PREVIEW_SIZE),
+            ),
+        ).select_related(
+            *(f"device__{field}" for field in DEVICE_LABEL_RELATED),
+        ).order_by("pk")
+
+        for row in rows:
+            reports[row.mechanicreport_id].device_preview.append(row.device)
+
+
 @admin.register(MechanicReport)
 class MechanicReportAdmin(admin.ModelAdmin):
     inlines = [DevicesReportInline, ReportCommentInline]
@@ -409,24 +482,61 @@ class MechanicReportAdmin(admin.ModelAdmin):
     list_filter = ["user", "station", "created"]
     search_fields = ("user__username", "station__name")
     search_help_text = ("Введите имя пользователя или станцию для поиска")
+    PREVIEW_SIZE = 7
+
+    def get_queryset(self, request):
+        through = MechanicReport.devices.through
+        device_count = through.objects.filter(
+            mechanicreport_id=OuterRef("pk"),
+        ).values("mechanicreport_id").annotate(count=Count("pk")).values("count")
+
+        return super().get_queryset(request).select_related("station", "user").annotate(
+            device_count=Coalesce(Subquery(device_count), 0),
+            author_is_kip=Exists(User.groups.through.objects.filter(
+                user_id=OuterRef("user_id"),
+                group__name="КИП",
+            )),
+        )
+
+    def get_changelist(self, request, **kwargs):
+        return MechanicReportChangeList
 
     def devices_l(self, obj):
         device_changelist_url = reverse("admin:ARM_device_changelist")
-        all_devices = obj.devices.all()
-        device_links = [f'<a href="{device_changelist_url}?id={d.id}">{d}</a>' for d in all_devices[:7]]
-        counter = all_devices.count()
+        preview = getattr(obj, "device_preview", None)
+        if preview is None:
+            preview = obj.devices.all()[:self.PREVIEW_SIZE]
+        device_links = [f'<a href="{device_changelist_url}?id={d.id}">{d}</a>' for d in preview]
+        counter = self.get_device_count(obj)
 
         if counter > 5:
             device_links[-1] = f"...еще {counter - 5} приборов"
 
         return format_html(f' {chr(9679)} '.join(device_links))
 
+    @staticmethod
+    def get_device_count(obj):
+        if hasattr(obj, "device_count"):
+            return obj.device_count
+        return obj.devices.count()
+
     @admin.display(description="Количество")
-    def count(seelf, obj):
-        return f"{obj.devices.all().count()} приборов"
+    def count(self, obj):
+        return f"{self.get_device_count(obj)} приборов"
 
     devices_l.short_description = "Приборы в отчете"
 
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and obj.user_id:
+            obj.user = User.objects.prefetch_related("groups").get(pk=obj.user_id)
+        return obj
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == "devices":
+            kwargs["queryset"] = Device.objects.select_related(*DEVICE_LABEL_RELATED)
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
     def save_model(self, request, obj, form, change):
         if change:
             return super().save_model(request, obj, form, change)
@@ -435,7 +545,9 @@ class MechanicReportAdmin(admin.ModelAdmin):
 
     def has_change_permission(self, request: HttpRequest, obj=None) -> bool:
         if obj is not None:
-            return not bool(obj.user.groups.filter(name="КИП"))
+            if hasattr(obj, "author_is_kip"):
+                return not obj.author_is_kip
+            return not user_in_group(obj.user, "КИП")
 
 
 @admin.register(Tipe)
@@ -496,23 +608,21 @@ class DeviceKipReportForm(forms.ModelForm):
         )) and self.has_changed:
             raise ValidationError("Не все обязательные поля заполнены")
         
-        other_places = Place.objects.filter(
-            Q(rack__number="релейная") | Q(rack__number="тоннель") | Q(rack__number="поле"),
-            number="остальное",
-        )
-        
+        topology = get_topology()
+
         device = self.cleaned_data.get("device")
         station = self.cleaned_data.get("station")
         mounting_address = self.cleaned_data.get("mounting_address")
         kip_report = self.cleaned_data["kip_report"]
-        
+        place = topology.resolve(station.pk, mounting_address)
+
         if all((
             (duplicate_devices := DeviceKipReport.objects.filter(
                 ~Q(device=device),
                 station=station,
                 mounting_address=mounting_address,
             )).count() >= 1,
-            mounting_address not in (f"{place.rack.number}-{place.number}" for place in other_places),
+            not (place and place.is_other),
             mounting_address.lower() != "авз",
         )):
             raise ValidationError(f"На это место уже готовится прибор "
@@ -536,37 +646,32 @@ class DeviceKipReportForm(forms.ModelForm):
             elif re.fullmatch(r"(\d+)-(\d+)", mounting_address):
                 rack, number = mounting_address.strip().split("-")
 
-                try:
-                    existing_rack = Rack.objects.get(station=station, number=rack)
-                except Rack.DoesNotExist:
+                existing_rack = topology.rack(station.pk, rack)
+                if existing_rack is None:
                     raise ValidationError(f"Статива {rack} нет на станции {station}. "
                                           f"Возможные стативы "
-                                          f"{sorted([rack.number for rack in station.rack_set.all()])}")
+                                          f"{topology.rack_numbers(station.pk)}")
                 else:
-                    try:
-                        existing_place = Place.objects.get(rack=existing_rack, number=number)
-                    except Place.DoesNotExist:
+                    existing_place = place
+                    if existing_place is None:
                         raise ValidationError(f"Места {number} нет на стативе {rack} станции {station}\n."
                                               f" Возможные места "
-                                              f"{sorted([obj.number for obj in list(existing_rack.place_set.all())])}")
+                                              f"{sorted([obj.number for obj in existing_rack.places])}")
                     else:
-                        try:
-                            device_on_this_place = Device.objects.get(mounting_address=existing_place)
-                        except Device.DoesNotExist:
-                            pass
-                        except Device.MultipleObjectsReturned:
-                            if existing_place in other_places:
-                                pass
-                            else:
+                        occupancy = PlaceOccupancy.of(existing_place.pk)
+                        if occupancy.count > 1:
+                            if not existing_place.is_other:
                                 raise ValidationError(f"К месту {existing_place} "
                                                       f"станции {station} "
                                                       f" уже относятся 2 прибора")
-                        else:
-                            if device.device_type != device_on_this_place.device_type:
-                                raise ValidationError(f"Прибор на месте {existing_place.__str__()} "
-                                                      f"{device_on_this_place.name} имеет тип " 
-                                                      f"{device_on_this_place.device_type}. "
-                                                      f"Прибор в ящике - {device.device_type}")
+                        elif occupancy.count == 1 and not occupancy.has_device_type(device.device_type_id):
+                            device_on_this_place = Device.objects.select_related(
+                                "device_type",
+                            ).get(mounting_address=existing_place)
+                            raise ValidationError(f"Прибор на месте {existing_place.__str__()} "
+                                                  f"{device_on_this_place.name} имеет тип "
+                                                  f"{device_on_this_place.device_type}. "
+                                                  f"Прибор в ящике - {device.device_type}")
         return super().clean()
 
 
@@ -580,9 +685,18 @@ class DeviceKipReportInline(admin.StackedInline):
     verbose_name = "прибор в ящик"
     verbose_name_plural = "Собрать виртуальный ящик"
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            "device__device_type",
+            "device__mounting_address__rack__station",
+            "station",
+            "who_prepared",
+            "who_checked",
+        )
+
     @admin.display(description="Статус")
     def get_status(self, obj):
-        status = Device.objects.get(id=obj.device_id).status
+        status = obj.device.status
         if status:
             return status
         return AdminSite.empty_value_display
@@ -600,15 +714,13 @@ class KipReportAdmin(admin.ModelAdmin):
 
     @admin.display(description="Действия")
     def button(self, obj):
-        kip_report = KipReport.objects.get(id=obj.id)
-        if all([device.status == Device.in_progress for device in kip_report.devices.all()]):
+        statuses = set(obj.devices.values_list("status", flat=True))
+        if statuses <= {Device.in_progress}:
             return mark_safe(
                 f'<a class="button" href="javascript://" '
-                f'onclick="send_devices_ajax({kip_report.id})">Отправить приборы</a>'
+                f'onclick="send_devices_ajax({obj.id})">Отправить приборы</a>'
             )
-        elif all(
-            [device.status == Device.send for device in kip_report.devices.all()]
-        ) or not obj.editable:
+        elif statuses <= {Device.send} or not obj.editable:
             return "Приборы отправлены"
         else:
             return "Приборы еще не подготовлены к отправке"
@@ -623,14 +735,14 @@ class KipReportAdmin(admin.ModelAdmin):
         return super().save_model(request, obj, form, change)
 
     def save_formset(self, request, form, formset, change):
-        other_places = Place.objects.filter(
-            Q(rack__number="релейная") | Q(rack__number="тоннель") | Q(rack__number="поле"),
-            number="остальное",
-        )
         instances = formset.save(commit=False)
         kip_report = form.instance
+        # строки формы сохраняются после распределения со склада,
+        # поэтому их приборы исключаются из него явно
+        form_device_ids = {instance.device_id for instance in instances}
         for instance in instances:
-            print(instance.mounting_address)
+            logger.debug("kip_report_id=%s device_id=%s mounting_address=%s",
+                         kip_report.pk, instance.device_id, instance.mounting_address)
             form_device = Device.objects.get(pk=instance.device.pk)
             avz = AVZ.objects.get(station=instance.station)
             avz_true = False
@@ -640,7 +752,7 @@ class KipReportAdmin(admin.ModelAdmin):
                 form_device.avz = avz
                 form_device.status = form_device.in_progress
                 form_device.station = instance.station
-                print(form_device.name, form_device.avz)
+                logger.debug("device_id=%s avz_id=%s", form_device.pk, form_device.avz_id)
 
             elif "шт" in instance.mounting_address.lower():
                 devices_number = int(
@@ -650,44 +762,37 @@ class KipReportAdmin(admin.ModelAdmin):
                     ).group()
                 )
 
-                this_type_devices = Device.objects.filter(
-                    ~Q(pk=form_device.pk),
-                    device_type=form_device.device_type,
-                    stock__id=1,
-                )[:devices_number - 1]
-
-                update_devices = Device.objects.filter(pk__in=[device.pk for device in this_type_devices]).update(
-                        station=form_device.station,
-                        avz=form_device.avz,
-                        current_check_date=instance.check_date,
-                        who_prepared=instance.who_prepared,
-                        who_checked=instance.who_checked,
-                    )
-                print(update_devices)
-                if update_devices.__class__ is not int:
-                    update_devices.save()
-                for device in this_type_devices:
-                    kip_report.devices.add(
-                        device.id,
-                        through_defaults={"station": instance.station,
-                                        "mounting_address": '',
-                                        "check_date": instance.check_date,
-                                        "who_prepared": instance.who_prepared,
-                                        "who_checked": instance.who_checked}
+                _, shortfall = allocate_stock(
+                    kip_report,
+                    form_device.device_type,
+                    devices_number - 1,
+                    exclude=form_device_ids,
+                    device_fields={"station": form_device.station,
+                                   "avz": form_device.avz,
+                                   "current_check_date": instance.check_date,
+                                   "who_prepared": instance.who_prepared,
+                                   "who_checked": instance.who_checked},
+                    station=instance.station,
+                    mounting_address="",
+                    check_date=instance.check_date,
+                    who_prepared=instance.who_prepared,
+                    who_checked=instance.who_checked,
+                )
+                if shortfall:
+                    self.message_user(
+                        request,
+                        f"На складе не хватило {shortfall} шт. приборов типа "
+                        f"{form_device.device_type}, добавлено {devices_number - shortfall} шт.",
+                        messages.WARNING,
                     )
 
                 instance.mounting_address = ""
 
             elif re.fullmatch(r"((\w+)|(релейная)|(тоннель)|(поле))-((\w+)|(остальное))", instance.mounting_address):
                 rack, number = instance.mounting_address.strip().split("-")
-                try:
-                    place = Place.objects.get(
-                        rack__station=instance.station,
-                        rack__number=rack,
-                        number=number,
-                    )
-                except Place.DoesNotExist:
-                    print(rack, "-", number, " Не существует")
+                place = get_topology().resolve(instance.station_id, instance.mounting_address)
+                if place is None:
+                    logger.info("нет места %s-%s, station_id=%s", rack, number, instance.station_id)
                     self.message_user(
                         request,
                         f"На станции {instance.station} нет монтажного адреса "
@@ -703,7 +808,7 @@ class KipReportAdmin(admin.ModelAdmin):
                         form_device.station = instance.station
 
                         if place:
-                            form_device.mounting_address = place
+                            form_device.mounting_address_id = place.pk
                             form_device.name = "Без названия"
 
                         for avz_device in list(avz.device_set.all()):
@@ -724,7 +829,7 @@ class KipReportAdmin(admin.ModelAdmin):
                         form_device.station = instance.station
 
                         if place:
-                            form_device.mounting_address = place
+                            form_device.mounting_address_id = place.pk
                             form_device.name = "Без названия"
 
                         for avz_device in list(avz.device_set.all()):
@@ -732,7 +837,9 @@ class KipReportAdmin(admin.ModelAdmin):
                                 form_device.frequency_of_check = avz_device.frequency_of_check
                                 break
                         else:
-                            print(f"Вот тут почему NoneType, а прибор {form_device}")
+                            logger.warning("в АВЗ нет прибора такого типа, периодичность проверки 1 год: "
+                                           "device_id=%s device_type_id=%s station_id=%s",
+                                           form_device.pk, form_device.device_type_id, instance.station_id)
                             form_device.frequency_of_check = 1
                     
                     else:
@@ -745,3 +852,121 @@ class KipReportAdmin(admin.ModelAdmin):
             form_device.save()
         formset.save()
         return super().save_formset(request, form, formset, change)
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "user", "model_label", "status", "progress", "created", "finished", "download")
+    list_filter = ("status", "user")
+    readonly_fields = ("user", "model_label", "fields", "status", "total", "processed",
+                       "progress", "download", "error", "created", "finished")
+    exclude = ("file_name",)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(user=request.user)
+
+    @admin.display(description="Прогресс")
+    def progress(self, obj):
+        return f"{obj.get_progress()}%"
+
+    @admin.display(description="Файл")
+    def download(self, obj):
+        if obj.status != ExportJob.done:
+            return "--"
+        return format_html('<a href="{0}">{1}</a>',
+                           reverse("download_export", args=(obj.pk,)),
+                           "Скачать")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestQueryLog)
+class RequestQueryLogAdmin(admin.ModelAdmin):
+    list_display = ("created", "method", "path", "view_name", "status_code", "user",
+                    "queries", "budget_status", "duplicates", "sql_ms", "duration_ms")
+    list_filter = ("view_name", "method", "status_code")
+    list_select_related = ("user",)
+    date_hierarchy = "created"
+    search_fields = ("path", "view_name")
+    ordering = ("-created",)
+    readonly_fields = ("created", "method", "path", "view_name", "status_code", "user", "queries",
+                       "budget", "duplicates", "sql_ms", "duration_ms", "slowest_queries")
+    exclude = ("slowest",)
+
+    @admin.display(description="Бюджет")
+    def budget_status(self, obj):
+        if obj.budget is None:
+            return "--"
+        if obj.over_budget:
+            return format_html('<b style="color: #ba2121">{} (превышен)</b>', obj.budget)
+        return obj.budget
+
+    @admin.display(description="Самые долгие запросы")
+    def slowest_queries(self, obj):
+        return format_html(
+            "<pre style='white-space: pre-wrap'>{}</pre>",
+            "\n\n".join(f"{query['ms']} мс, повторов {query['repeats']}:\n{query['sql']}" for query in obj.slowest),
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "created", "view_name", "status_code", "user",
+                    "duration_ms", "queries", "sql_ms", "memory_peak_kb", "download")
+    list_filter = ("view_name", "user")
+    list_select_related = ("user",)
+    ordering = ("-created",)
+    readonly_fields = ("created", "method", "path", "view_name", "status_code", "user", "duration_ms",
+                       "queries", "sql_ms", "memory_peak_kb", "download", "cpu_report", "memory_report")
+    exclude = ("file_name",)
+
+    @admin.display(description="Файл")
+    def download(self, obj):
+        return format_html('<a href="{0}">{1}</a>', reverse("download_profile", args=(obj.pk,)), "Скачать")
+
+    @admin.display(description="Процессор")
+    def cpu_report(self, obj):
+        return format_html("<pre>{}</pre>", read_profile_file(obj, "cpu.txt") or "Файл профиля удален")
+
+    @admin.display(description="Память")
+    def memory_report(self, obj):
+        return format_html("<pre>{}</pre>", read_profile_file(obj, "memory.txt") or "Файл профиля удален")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ReplacementCalendar)
+class ReplacementCalendarAdmin(admin.ModelAdmin):
+    list_display = ("year", "month", "station", "device_type", "count")
+    list_filter = ("year", "month", "station", "device_type")
+    list_select_related = ("station", "device_type")
+    ordering = ("year", "month", "station", "device_type")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(count__gt=0)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
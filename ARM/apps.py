@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ArmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ARM'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .db import apply_sqlite_pragmas
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="arm_sqlite_pragmas")
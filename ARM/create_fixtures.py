@@ -1,10 +1,7 @@
-import re
-
 from pathlib import Path
 import sys
 import os
 
-import pymysql
 import json
 
 import django
@@ -21,121 +18,81 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'ARM_SHN.settings'
 django.setup()
 
 from ARM_SHN.settings import BASE_DIR
-
-
-station_id_decode = {
-    1: 1,
-    2: 2,
-    4: 3,
-    5: 4,
-    6: 5,
-    8: 7,
-    9: 8,
-    10: 9,
-    11: 10,
-    12: 6,
-    21: 11,
-}
+from ARM.legacy import STATION_ID_DECODE, dump_legacy_rows, stream_legacy_rows
+
+# Типы и стативы собираются за один проход по таблице glav: из файла
+# mysqldump, если он передан аргументом (python create_fixtures.py glav.sql.gz),
+# иначе из базы MySQL settings.LEGACY_DB
+FIXTURE_COLUMNS = ("Stan_Id", "Stativ", "Tipe_Id", "Tip_N")
+
+FIELD_RACKS = ("зап",
+               "АВЗ",
+               "стр",
+               "Ш-Т",
+               "ш-т",
+               "СТР",
+               "тон",
+               "АВМ",
+               "БВС",
+               "ш-ф",
+               "кор",
+               "Стр",
+               "лам",
+               "стp")
+
+if len(sys.argv) > 1:
+    rows = dump_legacy_rows(sys.argv[1], columns=FIXTURE_COLUMNS)
+else:
+    rows = stream_legacy_rows(columns=FIXTURE_COLUMNS)
+
+type_names = {}
+rack_numbers = {station_id: {} for station_id in STATION_ID_DECODE}
+
+for station_id, rack_number, type_id, type_name in rows:
+    if type_name is not None:
+        type_names.setdefault(type_id, type_name)
+    if station_id in rack_numbers and rack_number is not None:
+        # GROUP BY в MySQL не различал регистр номеров стативов
+        rack_number = rack_number.strip()
+        rack_numbers[station_id].setdefault(rack_number.casefold(), rack_number)
 
 tipes_fixture = []
-devices_fixture = []
 racks_fixture = []
-places_fixture = []
-
-counter = 1
 
-visited_station_ids = set()
-
-with pymysql.connect(host='localhost', port='', user='test_user', passwd='1234', db='test_bd') as db:
-    cursor = db.cursor()
-
-    cursor.execute("""
-        SELECT DISTINCT Tip_N, Tipe_Id FROM glav;
-    """)
-    data = cursor.fetchall()
-    for type_, type_id in data:
-        print(type_, type_id)
-        if type_ != 'null':
-            tipes_fixture.append({
-                "model": "ARM.Tipe",
-                "pk": type_id,
+for type_id, type_ in sorted(type_names.items()):
+    if type_ != 'null':
+        tipes_fixture.append({
+            "model": "ARM.Tipe",
+            "pk": type_id,
+            "fields": {
+                "name": f"{type_}"
+            }
+        })
+
+for station_id, numbers in rack_numbers.items():
+    station = STATION_ID_DECODE[station_id]
+    field_rack_added = False
+
+    for rack_number in sorted(numbers.values()):
+        if rack_number in FIELD_RACKS:
+            # все полевые устройства станции - на одном стативе
+            if field_rack_added:
+                continue
+            rack_number = "поле" if station == 10 else "тоннель"
+            field_rack_added = True
+
+        racks_fixture.append(
+            {
+                "model": "ARM.Rack",
+                "pk": len(racks_fixture) + 1,
                 "fields": {
-                    "name": f"{type_}"
+                    "station": station,
+                    "number": rack_number,
                 }
-            })
-            print(f"****{type_}-----{type_id}****")
-
-    for _id in station_id_decode.keys():
-        cursor.execute(f"""
-            SELECT Stan_id, Stativ FROM glav
-            WHERE Stan_Id = {_id}
-            GROUP BY Stativ;
-        """)
-        data = cursor.fetchall()
-
-        print(data)
-        
-        for station_id, rack_number in data:
-            station = station_id_decode.get(station_id)
-            rack_number = rack_number.strip()
-
-            if rack_number in ("зап",
-                               "АВЗ",
-                               "стр",
-                               "Ш-Т",
-                               "ш-т",
-                               "СТР",
-                               "тон",
-                               "АВМ",
-                               "БВС",
-                               "ш-ф",
-                               "кор",
-                               "Стр",
-                               "лам",
-                               "стp"):
-                if station == 10:
-                    if station in visited_station_ids:
-                        continue
-                    racks_fixture.append(
-                        {
-                            "model": "ARM.Rack",
-                            "pk": counter,
-                            "fields": {
-                                "station": station,
-                                "number": "поле",
-                            }
-                        }
-                    )
-                    visited_station_ids.add(station)
-                else:
-                    if station in visited_station_ids:
-                        continue
-                    racks_fixture.append(
-                        {
-                            "model": "ARM.Rack",
-                            "pk": counter,
-                            "fields": {
-                                "station": station,
-                                "number": "тоннель",
-                            }
-                        }
-                    )
-                    visited_station_ids.add(station)
-            else:
-                racks_fixture.append(
-                    {
-                        "model": "ARM.Rack",
-                        "pk": counter,
-                        "fields": {
-                            "station": station,
-                            "number": rack_number,
-                        }
-                    }
-                )
-
-            counter += 1
-    else:
-        counter = 1
+            }
+        )
+
+sys.stdout.write(f"Типов: {len(tipes_fixture)}, стативов: {len(racks_fixture)}\n")
 
 with open(BASE_DIR / "ARM" / "fixtures" / "types.json", "w", encoding='utf-8') as types:
     json.dump(tipes_fixture, types, indent=2, ensure_ascii=False)
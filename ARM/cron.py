@@ -1,25 +1,58 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from django_cron import CronJobBase, Schedule
-from django.db.models import Q
-from .models import Device
+from .db import retry_on_locked
+from .models import ReplacementCalendar, RequestQueryLog
+from .statuses import refresh_device_statuses
 
 
 class UpdateDeviceStatuses(CronJobBase):
-    devices = []
-
     RUN_EVERY_MINS = 1
 
     schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
     code = 'ARM.update_device_statuses'
 
     def do(self):
-        devices = Device.objects.filter(
-            ~(Q(status=Device.send) | Q(status=Device.in_progress)),
-            stock__isnull=True,
-            next_check_date__isnull=False,
-        )
+        return f"Обновлено статусов: {retry_on_locked(refresh_device_statuses)()}"
+
+
+class ReconcileDeviceStatuses(CronJobBase):
+    """UpdateDeviceStatuses проверяет только приборы, пересекшие границу
+    дат с прошлого запуска; раз в сутки статусы сверяются по всей таблице,
+    чтобы исправить расхождения после изменений в обход save()"""
+
+    RUN_EVERY_MINS = 24 * 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'ARM.reconcile_device_statuses'
+
+    def do(self):
+        return f"Исправлено статусов: {retry_on_locked(refresh_device_statuses)(full=True)}"
+
+
+class PurgeRequestQueryLogs(CronJobBase):
+    RUN_EVERY_MINS = 24 * 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'ARM.purge_request_query_logs'
+
+    def do(self):
+        cutoff = timezone.now() - timedelta(days=settings.QUERY_LOG_KEEP_DAYS)
+        deleted, _ = RequestQueryLog.objects.filter(created__lt=cutoff).delete()
+        return f"Удалено записей статистики запросов: {deleted}"
 
-        for device in devices:
-            if device.next_check_date:
-                device.status = device.get_status()
 
-        Device.objects.bulk_update(devices, fields=["status"])
\ No newline at end of file
+class RebuildReplacementCalendar(CronJobBase):
+    """Календарь замен ведется сигналами; раз в сутки он пересчитывается
+    целиком на случай массовых изменений приборов в обход сигналов"""
+
+    RUN_EVERY_MINS = 24 * 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'ARM.rebuild_replacement_calendar'
+
+    def do(self):
+        retry_on_locked(ReplacementCalendar.rebuild)()
+        return f"Ячеек календаря замен: {ReplacementCalendar.objects.count()}"
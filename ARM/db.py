@@ -0,0 +1,73 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+LOCKED_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Настраивает каждое новое подключение к SQLite
+    по settings.SQLITE_PRAGMAS (WAL, busy_timeout и т.д.)"""
+
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+def is_locked_error(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and any(
+        message in str(error).lower() for message in LOCKED_MESSAGES
+    )
+
+
+@contextmanager
+def serialized_write(using: str = DEFAULT_DB_ALIAS):
+    """Транзакция для записи. На SQLite первым запросом идет запись,
+    поэтому блокировка на запись берется сразу (с ожиданием по
+    busy_timeout), а не при попытке повысить блокировку после чтения,
+    когда SQLite сразу отвечает 'database is locked'"""
+
+    with transaction.atomic(using=using):
+        connection = connections[using]
+        if connection.vendor == "sqlite":
+            from .models import SyncMarker
+
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE "{SyncMarker._meta.db_table}" SET "value" = "value" WHERE 0')
+        yield
+
+
+def retry_on_locked(func=None, *, attempts: int = None, delay: float = None, using: str = DEFAULT_DB_ALIAS):
+    """Повторяет функцию с экспоненциальной паузой, если база занята.
+    Внутри уже открытой транзакции не повторяет: откатить и повторить
+    можно только транзакцию целиком"""
+
+    if func is None:
+        return lambda f: retry_on_locked(f, attempts=attempts, delay=delay, using=using)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = attempts or settings.DB_RETRY_ATTEMPTS
+        pause = delay or settings.DB_RETRY_DELAY
+
+        for attempt in range(1, retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if (not is_locked_error(e)
+                        or connections[using].in_atomic_block
+                        or attempt == retries):
+                    raise
+                logger.warning("%s: база занята, попытка %s из %s", func.__qualname__, attempt, retries)
+                time.sleep(pause * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+    return wrapper
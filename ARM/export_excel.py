@@ -1,4 +1,33 @@
+import csv
+from datetime import datetime, date
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+
+def convert_data_date(value):
+    return value.strftime('%d/%m/%Y')
+
+
+def convert_boolean_field(value):
+    if value:
+        return 'Yes'
+    return 'No'
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer, отдающий строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
 class ExportExcelAction:
+    CHUNK_SIZE = 2000
+    WIDTH_SAMPLE_ROWS = 200
+
     @classmethod
     def generate_header(cls, admin, model, list_display):
         def default_format(value):
@@ -18,4 +47,92 @@ class ExportExcelAction:
                 header.append(default_format(field_name))
             else:
                 header.append(default_format(field_display))
-        return header
\ No newline at end of file
+        return header
+
+    @classmethod
+    def get_queryset(cls, admin, queryset, list_display):
+        """Подтягивает связанные объекты, нужные колонкам выгрузки,
+        одним JOIN вместо запроса на каждую строку"""
+
+        if hasattr(admin, "get_export_queryset"):
+            return admin.get_export_queryset(queryset)
+        if admin.list_select_related is True:
+            return queryset.select_related()
+        if admin.list_select_related:
+            return queryset.select_related(*admin.list_select_related)
+
+        relations = [
+            field.name
+            for field in admin.model._meta.fields
+            if field.name in list_display and field.is_relation
+        ]
+        return queryset.select_related(*relations) if relations else queryset
+
+    @classmethod
+    def generate_rows(cls, admin, queryset, list_display, progress=None):
+        queryset = cls.get_queryset(admin, queryset, list_display)
+        for number, obj in enumerate(queryset.iterator(chunk_size=cls.CHUNK_SIZE), start=1):
+            if progress and number % cls.CHUNK_SIZE == 0:
+                progress(number)
+            row = []
+            for field in list_display:
+                is_admin_field = hasattr(admin, field)
+                if is_admin_field:
+                    value = getattr(admin, field)(obj)
+                else:
+                    value = getattr(obj, field)
+                    if isinstance(value, datetime) or isinstance(value, date):
+                        value = convert_data_date(value)
+                    elif isinstance(value, bool):
+                        value = convert_boolean_field(value)
+                row.append(str(value) if value is not None else "--")
+            yield row
+
+    @classmethod
+    def write_xlsx(cls, admin, queryset, list_display, output, progress=None):
+        """Пишет выгрузку построчно в write-only книгу. Ширина колонок
+        считается по заголовку и первым WIDTH_SAMPLE_ROWS строкам,
+        поэтому в памяти держится не больше этого числа строк.
+        Возвращает число записанных строк"""
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        header = cls.generate_header(admin, admin.model, list_display)
+        rows = cls.generate_rows(admin, queryset, list_display, progress)
+
+        sample = []
+        widths = [len(value) for value in header]
+        for row in rows:
+            sample.append(row)
+            widths = [max(width, len(value)) for width, value in zip(widths, row)]
+            if len(sample) >= cls.WIDTH_SAMPLE_ROWS:
+                break
+
+        for index, width in enumerate(widths, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width + 10
+
+        black_font = Font(color='000000', bold=True)
+        header_cells = []
+        for value in header:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = black_font
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        for row in sample:
+            ws.append(row)
+        written = len(sample)
+        for row in rows:
+            ws.append(row)
+            written += 1
+
+        wb.save(output)
+        return written
+
+    @classmethod
+    def generate_csv(cls, admin, queryset, list_display):
+        writer = csv.writer(Echo(), delimiter=";")
+        yield "\ufeff"
+        yield writer.writerow(cls.generate_header(admin, admin.model, list_display))
+        for row in cls.generate_rows(admin, queryset, list_display):
+            yield writer.writerow(row)
@@ -0,0 +1,118 @@
+import hashlib
+import pickle
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q
+from django.utils import timezone
+from unidecode import unidecode
+
+from .export_excel import ExportExcelAction
+from .models import ExportJob
+
+
+def export_root():
+    root = settings.EXPORT_ROOT
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def get_cache_key(model_admin, queryset) -> str:
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        sql, params = "", ()
+    source = f"{model_admin.model._meta.label}|{sql}|{params}|{list(model_admin.list_display)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def enqueue_export(model_admin, queryset, user) -> tuple[ExportJob, bool]:
+    """Ставит выгрузку в очередь. Если такая же выгрузка уже была
+    запрошена в пределах EXPORT_CACHE_SECONDS, возвращает ее.
+    Второе значение показывает, что задача была переиспользована"""
+
+    cache_key = get_cache_key(model_admin, queryset)
+    cached_job = ExportJob.objects.filter(
+        cache_key=cache_key,
+        created__gte=timezone.now() - timedelta(seconds=settings.EXPORT_CACHE_SECONDS),
+    ).exclude(status=ExportJob.failed).order_by("-created").first()
+
+    if cached_job and (cached_job.status != ExportJob.done or job_path(cached_job).is_file()):
+        return cached_job, True
+
+    job = ExportJob.objects.create(
+        user=user,
+        model_label=model_admin.model._meta.label,
+        query=pickle.dumps(queryset.query),
+        fields=list(model_admin.list_display),
+        cache_key=cache_key,
+    )
+    return job, False
+
+
+def job_path(job: ExportJob):
+    return settings.EXPORT_ROOT / job.file_name
+
+
+def claim_next_job() -> ExportJob | None:
+    for job in ExportJob.objects.filter(status=ExportJob.pending).order_by("created")[:5]:
+        started = timezone.now()
+        if ExportJob.objects.filter(pk=job.pk, status=ExportJob.pending).update(
+            status=ExportJob.running, started=started,
+        ):
+            job.status, job.started = ExportJob.running, started
+            return job
+    return None
+
+
+def run_job(job: ExportJob):
+    def progress(processed):
+        ExportJob.objects.filter(pk=job.pk).update(processed=processed)
+
+    try:
+        model = apps.get_model(job.model_label)
+        model_admin = admin.site._registry[model]
+        queryset = model._default_manager.all()
+        queryset.query = pickle.loads(job.query)
+
+        job.total = queryset.count()
+        job.file_name = f"{job.pk}-{unidecode(str(model._meta.verbose_name))}.xlsx"
+        ExportJob.objects.filter(pk=job.pk).update(total=job.total, file_name=job.file_name)
+
+        with open(export_root() / job.file_name, "wb") as output:
+            ExportExcelAction.write_xlsx(model_admin, queryset, job.fields, output, progress)
+    except Exception as e:
+        job.status = ExportJob.failed
+        job.error = repr(e)
+    else:
+        job.status = ExportJob.done
+        job.processed = job.total
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "error", "total", "processed", "file_name", "finished"])
+    return job
+
+
+def fail_stale_jobs() -> int:
+    """Помечает ошибкой выгрузки, которые выполняются дольше
+    EXPORT_STALE_SECONDS: их воркер остановился, не дописав файл"""
+
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.EXPORT_STALE_SECONDS)
+    return ExportJob.objects.filter(
+        Q(started__lt=cutoff) | Q(started__isnull=True, created__lt=cutoff),
+        status=ExportJob.running,
+    ).update(status=ExportJob.failed, error="Выгрузка прервана: воркер остановлен", finished=now)
+
+
+def purge_expired_jobs() -> int:
+    expired = ExportJob.objects.filter(
+        created__lt=timezone.now() - timedelta(seconds=settings.EXPORT_KEEP_SECONDS),
+    ).exclude(status__in=[ExportJob.pending, ExportJob.running])
+
+    for job in expired:
+        if job.file_name:
+            job_path(job).unlink(missing_ok=True)
+    return expired.delete()[0]
@@ -1,103 +1,143 @@
 from django.contrib import admin
+from django.db.models import Sum
 from django.http import HttpRequest
 from django.utils import timezone
 from datetime import date
-import calendar
-import re
+
+from .models import Device, ReplacementCalendar, next_month_start
+
+
+MONTHS = ("январь", "февраль", "март", "апрель", "май", "июнь",
+          "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь")
+
+YEAR_PARAMETER = "next_check_date__year"
+MONTH_PARAMETER = "next_check_date__month"
+
+# фильтры списка приборов, которые учитываются в числах календаря замен
+CALENDAR_PARAMETERS = {
+    "station__id__exact": "station_id",
+    "device_type__id__exact": "device_type_id",
+}
+
+
+def parse_int(value) -> int | None:
+    try:
+        return int(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def selected_year(request: HttpRequest) -> int:
+    return parse_int(request.GET.get(YEAR_PARAMETER)) or timezone.localdate().year
+
+
+def calendar_cells(request: HttpRequest):
+    """Ячейки календаря замен (ARM.models.ReplacementCalendar) с учетом
+    выбранных в списке станции и типа прибора"""
+
+    cells = ReplacementCalendar.objects.filter(count__gt=0)
+    for parameter, field in CALENDAR_PARAMETERS.items():
+        if (value := parse_int(request.GET.get(parameter))) is not None:
+            cells = cells.filter(**{field: value})
+    return cells
+
+
+def with_count(label: str, count) -> str:
+    return f"{label} ({count or 0})"
 
 
 class BaseMonthFilter(admin.SimpleListFilter):
-    # template = 'admin/input_filter.html'
+    """Месяцы выбранного в YearFilter (или текущего) года с числом
+    приборов на замену из календаря замен"""
 
     def lookups(self, request, model_admin):
-        return (
-            ("1", "январь"),
-            ("2", "февраль"),
-            ("3", "март"),
-            ("4", "апрель"),
-            ("5", "май"),
-            ("6", "июнь"),
-            ("7", "июль"),
-            ("8", "август"),
-            ("9", "сентябрь"),
-            ("10", "октябрь"),
-            ("11", "ноябрь"),
-            ("12", "декабрь"),
+        counts = dict(
+            calendar_cells(request).filter(year=selected_year(request)).values_list(
+                "month",
+            ).annotate(total=Sum("count")).order_by()
+        )
+        return tuple(
+            (str(number), with_count(name, counts.get(number)))
+            for number, name in enumerate(MONTHS, start=1)
         )
 
     def has_output(self):
         return True
 
-    # def choices(self, changelist):
-    #     return list(range(0, 13))
-
 
 class MonthFilter(BaseMonthFilter):
-    parameter_name = 'next_check_date__month'
+    parameter_name = MONTH_PARAMETER
     title = 'Фильтр по выбранному месяцу'
     field_name = "next_check_date"
 
     def queryset(self, request: HttpRequest, queryset):
-        value = self.value()
-        get_params = request.META.get("HTTP_REFERER")
-
-        if value is not None:
-            try:
-                user_month = int(value.strip())
-            except ValueError:
-                return
-
-            if user_month not in range(1, 13):
-                return
-
-            if "year" in get_params:
-                date_pattern = re.compile(r'next_check_date__year=(\d{4})')
-                data = re.findall(date_pattern, get_params)
-                if data:
-                    year = int(data[0])
-            else:
-                year = date.today().year
-
-            end_day = calendar.monthrange(year, user_month)[1]
-            start_day = 1
-            last_date = date(year, user_month, end_day)
-            start_date = last_date.replace(day=start_day)
-
-            first_param, second_param = (
-                self.field_name + "__gte",
-                self.field_name + "__lte",
-            )
-
-            return queryset.filter(**{first_param: start_date,
-                                      second_param: last_date})
+        month = parse_int(self.value())
+        if month not in range(1, 13):
+            return queryset
 
-        return queryset
+        # год берется из параметров этого же запроса, а не из HTTP_REFERER
+        start_date = date(selected_year(request), month, 1)
+        return queryset.filter(**{self.field_name + "__gte": start_date,
+                                  self.field_name + "__lt": next_month_start(start_date)})
 
 
 class BaseYearFilter(admin.SimpleListFilter):
+    """Ближайшие 10 лет и годы из календаря замен (в том числе
+    прошедшие, с просроченными приборами) с числом приборов"""
+
     def lookups(self, request, model_admin):
-        today = timezone.now().replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0).date()
-        return tuple(
-            (
-                year := str(today.replace(year=today.year + number).year),
-                year
-            )
-            for number in range(0, 11)
+        counts = dict(
+            calendar_cells(request).values_list("year").annotate(total=Sum("count")).order_by()
         )
+        this_year = timezone.localdate().year
+        years = sorted({*range(this_year, this_year + 11), *counts})
+        return tuple((str(year), with_count(str(year), counts.get(year))) for year in years)
 
     def has_output(self):
         return True
 
+
 class YearFilter(BaseYearFilter):
-    parameter_name = "next_check_date__year"
+    parameter_name = YEAR_PARAMETER
     title = "Фильтр по году"
     field_name = "next_check_date"
 
     def queryset(self, request, queryset):
-       if (year := self.value()) is not None:
-            return queryset.filter(
-                next_check_date__gte=date(year=int(year), month=1, day=1),
-                next_check_date__lt=date(year=int(year) + 1, month=1, day=1)
-            )
+        if (year := parse_int(self.value())) is not None:
+            return queryset.filter(**{self.field_name + "__gte": date(year, 1, 1),
+                                      self.field_name + "__lt": date(year + 1, 1, 1)})
+
+        return queryset
+
+
+class LiveStatusFilter(admin.SimpleListFilter):
+    parameter_name = "live_status"
+    title = "Фактический статус"
+
+    def lookups(self, request, model_admin):
+        return tuple(
+            (status, label)
+            for status, label in Device.CHOICES
+            if status in (Device.normal, Device.ready, Device.overdue)
+        )
+
+    def queryset(self, request, queryset):
+        if (status := self.value()) is not None:
+            return queryset.with_live_status().filter(
+                live_status=status,
+                stock__isnull=True,
+            ).exclude(status__in=[Device.send, Device.in_progress])
+
+        return queryset
+
+
+class AVZListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по АВЗ: название АВЗ берется из станции, поэтому
+    станции загружаются одним запросом вместе со списком АВЗ"""
 
-       return queryset
+    def field_choices(self, field, request, model_admin):
+        queryset = field.related_model._default_manager.select_related("station")
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return [(avz.pk, str(avz)) for avz in queryset]
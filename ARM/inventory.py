@@ -0,0 +1,201 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import (AVZ,
+                     Device,
+                     DeviceKipReport,
+                     KipReport,
+                     Place,
+                     PlaceOccupancy,
+                     Rack,
+                     ReplacementCalendar,
+                     Station,
+                     Stock,
+                     Tipe)
+from .planner import MechReportPlanner
+from .topology import invalidate_topology
+
+
+BATCH_SIZE = 1_000
+
+# периодичность проверки, лет -> доля приборов
+FREQUENCIES = {3: 40, 5: 30, 10: 20, 15: 10}
+
+
+def add_years(day: date, years: int) -> date:
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, day=28)
+
+
+class InventoryGenerator:
+    """Заполняет базу синтетическими данными в пропорциях рабочей базы:
+    стативы с местами, 'релейная-остальное' с группой приборов, стрелки
+    в тоннеле, резерв в АВЗ, склад, ящики КИП и отчеты механиков.
+    Пишет пакетами (bulk_create), без сигналов, занятость мест
+    и календарь замен пересчитываются в конце"""
+
+    def __init__(self,
+                 stations: int = 11,
+                 racks: int = 30,
+                 places: int = 40,
+                 kip_reports: int = 4,
+                 box_size: int = 30,
+                 seed: int = 1,
+                 today: date = None):
+        self.stations_count = stations
+        self.racks_count = racks
+        self.places_count = places
+        self.kip_reports_count = kip_reports
+        self.box_size = box_size
+        self.rng = random.Random(seed)
+        self.today = today or timezone.localdate()
+        self.counts = {}
+
+    def run(self) -> dict:
+        self.user = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser(
+            "generator", password="generator")
+        self.stock = Stock.objects.first() or Stock.objects.bulk_create([Stock(pk=1)])[0]
+        self.type_ids = list(Tipe.objects.values_list("pk", flat=True)) or [
+            tipe.pk for tipe in Tipe.objects.bulk_create([Tipe(name=f"Тип {number}") for number in range(1, 51)])
+        ]
+
+        stations = self._stations()
+        places = self._places(stations)
+        self._devices(stations, places)
+        self._boxes()
+
+        invalidate_topology()
+        ReplacementCalendar.rebuild()
+        return self.counts
+
+    def _stations(self) -> list[Station]:
+        # Station.save() перезаписывает первую станцию, поэтому только bulk_create
+        names = [name for _, name in Station.CHOICES]
+        stations = Station.objects.bulk_create([
+            Station(name=f"{names[number % len(names)]} {number // len(names) + 1}")
+            for number in range(self.stations_count)
+        ])
+        AVZ.objects.bulk_create([AVZ(station=station) for station in stations])
+        self.counts["stations"] = len(stations)
+        return stations
+
+    def _places(self, stations) -> dict[str, list[Place]]:
+        racks = {"regular": [], "other": [], "tunnel": []}
+        for station in stations:
+            racks["regular"] += [Rack(station=station, number=str(number))
+                                 for number in range(1, self.racks_count + 1)]
+            racks["other"].append(Rack(station=station, number="релейная"))
+            racks["tunnel"].append(Rack(station=station, number="тоннель"))
+        for kind in racks:
+            racks[kind] = Rack.objects.bulk_create(racks[kind], batch_size=BATCH_SIZE)
+
+        places = {
+            "regular": [Place(rack=rack, number=str(number))
+                        for rack in racks["regular"]
+                        for number in range(1, self.places_count + 1)],
+            "other": [Place(rack=rack, number=Place.OTHER_PLACES_NUMBER) for rack in racks["other"]],
+            "tunnel": [Place(rack=rack, number=f"стрелка №{number}")
+                       for rack in racks["tunnel"]
+                       for number in range(1, self.places_count // 2 + 1)],
+        }
+        for kind in places:
+            for place in places[kind]:
+                place.fill_address(place.rack)
+            places[kind] = Place.objects.bulk_create(places[kind], batch_size=BATCH_SIZE)
+
+        self.counts["racks"] = sum(len(kind) for kind in racks.values())
+        self.counts["places"] = sum(len(kind) for kind in places.values())
+        return places
+
+    def _device(self, **fields) -> Device:
+        frequency = self.rng.choices(list(FREQUENCIES), weights=list(FREQUENCIES.values()))[0]
+        # проверки распределены равномерно по периоду, около 3% просрочено
+        checked = self.today - timedelta(days=self.rng.randint(0, frequency * 365 - 1))
+        if self.rng.random() < 0.03:
+            checked -= timedelta(days=self.rng.randint(30, 365))
+        next_check = add_years(checked, frequency)
+        return Device(**{
+            "device_type_id": self.rng.choice(self.type_ids),
+            "inventory_number": str(self.rng.randint(10 ** 6, 10 ** 8)),
+            "manufacture_date": checked - timedelta(days=self.rng.randint(0, 20 * 365)),
+            "frequency_of_check": frequency,
+            "current_check_date": checked,
+            "next_check_date": next_check,
+            "status": Device.status_for_date(next_check, self.today),
+            **fields,
+        })
+
+    def _devices(self, stations, places):
+        avz = dict(AVZ.objects.filter(station__in=stations).values_list("station_id", "pk"))
+        devices = [
+            self._device(station_id=place.station_id, mounting_address=place, name=f"Р{place.number[-4:]}")
+            for place in places["regular"] + places["tunnel"]
+        ]
+        installed = len(devices)
+        for place in places["other"]:
+            devices += [self._device(station_id=place.station_id, mounting_address=place)
+                        for _ in range(self.rng.randint(self.places_count // 4, self.places_count // 2))]
+        other = len(devices) - installed
+        for station in stations:
+            devices += [self._device(station_id=station.pk, avz_id=avz[station.pk])
+                        for _ in range(max(installed // len(stations) // 20, 1))]
+        spare = len(devices) - installed - other
+        devices += [
+            self._device(stock=self.stock, status=None, current_check_date=None, next_check_date=None)
+            for _ in range(max(installed // 30, 1))
+        ]
+
+        Device.objects.bulk_create(devices, batch_size=BATCH_SIZE)
+        place_ids = [place.pk for kind in places.values() for place in kind]
+        for start in range(0, len(place_ids), BATCH_SIZE):
+            PlaceOccupancy.refresh(place_ids[start:start + BATCH_SIZE])
+
+        self.counts.update(devices=len(devices), installed=installed, other_places=other,
+                           avz=spare, stock=len(devices) - installed - other - spare)
+
+    def make_box(self, size: int = None, editable: bool = True) -> KipReport:
+        """Ящик КИП: новые приборы на места приборов с ближайшей датой
+        проверки; старые приборы остаются на местах до замены"""
+
+        due = list(
+            Device.objects.filter(
+                status__in=[Device.overdue, Device.ready, Device.normal],
+                mounting_address__isnull=False,
+                avz__isnull=True,
+            ).exclude(
+                mounting_address__in=Device.objects.filter(
+                    status__in=[Device.in_progress, Device.send],
+                    mounting_address__isnull=False,
+                ).values("mounting_address"),
+            ).order_by("next_check_date", "pk").values_list(
+                "station_id", "mounting_address_id",
+            )[:size or self.box_size]
+        )
+        box_devices = Device.objects.bulk_create([
+            self._device(station_id=station_id, mounting_address_id=place_id, status=Device.in_progress)
+            for station_id, place_id in due
+        ])
+        kip_report = KipReport.objects.create(author=self.user, editable=editable)
+        DeviceKipReport.objects.bulk_create([
+            DeviceKipReport(kip_report=kip_report, device=device, station_id=device.station_id,
+                            check_date=self.today, who_prepared=self.user, who_checked=self.user)
+            for device in box_devices
+        ])
+        PlaceOccupancy.refresh(place_id for _, place_id in due)
+        ReplacementCalendar.move((None, device.calendar_key) for device in box_devices)
+        return kip_report
+
+    def _boxes(self):
+        """Половина ящиков отправлена: по ним созданы отчеты механиков"""
+
+        reports = 0
+        for number in range(self.kip_reports_count):
+            kip_report = self.make_box()
+            if number % 2 == 0:
+                reports += len(MechReportPlanner(kip_report).execute(user=self.user))
+        self.counts.update(kip_reports=self.kip_reports_count, mechanic_reports=reports)
@@ -0,0 +1,264 @@
+import re
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .db import serialized_write
+from .mysqldump import TableReader
+from .models import Device, Place, PlaceOccupancy, Rack, ReplacementCalendar, Station, Stock, Tipe
+from .topology import invalidate_topology
+
+
+# Stan_Id старой базы -> id станции (fixtures/stations.json)
+STATION_ID_DECODE = {
+    1: 1,  # Ботаническая
+    2: 2,  # Чкаловская
+    4: 3,  # Геологическая
+    5: 4,  # Площадь 1905
+    6: 5,  # Динамо
+    8: 7,  # Машиностроителей
+    9: 8,  # Уралмаш
+    10: 9,  # Пр. Космонавтов
+    11: 10,  # Депо Калиновское
+    12: 6,  # Уральская
+    21: 11,  # Инж. Корпус
+}
+STOCK_STATION_ID = 20
+UNKNOWN_TYPE_ID = 300
+SKIPPED_RACKS = ("АВЗ", "зап", "запас", "авз", "Запас")
+FALLBACK_RACKS = ("тоннель", "поле")
+
+LEGACY_COLUMNS = ("Stan_Id", "Stativ", "Mesto", "Nazn", "Zn", "Dw", "Du",
+                  "Per", "Dat_Sp", "Tipe_Id", "Reg", "Prow")
+
+# имена колонок, а не полей: Django 4.1 подставляет update_fields
+# в ON CONFLICT ... DO UPDATE без перевода в имена колонок
+DEVICE_FIELDS = ["station_id", "stock_id", "status", "device_type_id", "name", "inventory_number",
+                 "mounting_address_id", "manufacture_date", "current_check_date",
+                 "frequency_of_check", "next_check_date", "old_information"]
+
+
+class LegacyReject(Exception):
+    """Строка старой базы, которую нельзя перенести"""
+
+
+def stream_legacy_rows(fetch_size: int = 2_000, columns=LEGACY_COLUMNS, **connection_params):
+    """Строки таблицы glav по одной, через серверный курсор MySQL:
+    в памяти держится не больше fetch_size строк"""
+
+    import pymysql
+    from pymysql.cursors import SSCursor
+
+    params = {**settings.LEGACY_DB, **connection_params}
+    with pymysql.connect(cursorclass=SSCursor, **params) as db:
+        with db.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM glav")
+            while rows := cursor.fetchmany(fetch_size):
+                yield from rows
+
+
+def dump_legacy_rows(path, encoding: str = None, columns=LEGACY_COLUMNS):
+    """Строки таблицы glav из файла mysqldump (.sql или .sql.gz)
+    в том же виде, что stream_legacy_rows, без сервера MySQL"""
+
+    return iter(TableReader(path, "glav", columns, encoding=encoding))
+
+
+def _date(value):
+    # pymysql отдает нулевые даты MySQL ('0000-00-00') строкой
+    return value if isinstance(value, date) else None
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+class LegacyImporter:
+    """Переносит приборы и места из таблицы glav старой базы.
+
+    Станции, стативы, места и типы загружаются в словари один раз,
+    строки пишутся порциями по chunk_size в отдельных транзакциях.
+    Прибор определяется ключом legacy_key (станция/статив/место/инв. номер),
+    поэтому повторный импорт обновляет уже перенесенные приборы,
+    а не создает их заново"""
+
+    def __init__(self, chunk_size: int = 1_000, progress=None, reject=None, today: date = None):
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.reject = reject
+        self.today = today or timezone.localdate()
+
+        self.station_ids = set(Station.objects.values_list("pk", flat=True))
+        self.type_ids = set(Tipe.objects.values_list("pk", flat=True))
+        self.stock_id = Stock.objects.values_list("pk", flat=True).first()
+        self.racks = {}
+        self.fallback_racks = {}
+        for rack in Rack.objects.only("pk", "number", "station_id"):
+            self.racks[(rack.station_id, _text(rack.number))] = rack
+            if rack.number in FALLBACK_RACKS:
+                self.fallback_racks.setdefault(rack.station_id, rack)
+        self.places = {
+            (rack_id, number): pk
+            for pk, rack_id, number in Place.objects.values_list("pk", "rack_id", "number")
+        }
+        self.seen_keys = Counter()
+
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.places_created = 0
+        self.rejects = Counter()
+
+    def run(self, rows) -> "LegacyImporter":
+        chunk = []
+        for row in rows:
+            self.processed += 1
+            try:
+                prepared = self.prepare(row)
+            except LegacyReject as e:
+                self.rejects[str(e)] += 1
+                if self.reject:
+                    self.reject(self.processed, str(e), row)
+                continue
+            if prepared is None:
+                self.skipped += 1
+                continue
+            chunk.append(prepared)
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+
+        if self.places_created:
+            invalidate_topology()
+        if self.created or self.updated:
+            # прежние даты обновленных приборов не загружаются,
+            # поэтому календарь замен пересчитывается целиком
+            ReplacementCalendar.rebuild()
+        return self
+
+    def prepare(self, row):
+        """Строка glav -> (ключ, поля прибора, (статив, номер места) или None).
+        None вместо результата - строка пропускается (АВЗ и запас)"""
+
+        station_id, rack_number, place_number, name, inventory_number, \
+            manufacture_date, current_check_date, frequency, next_check_date, \
+            type_id, regulated, checked = row
+        rack_number, place_number = _text(rack_number), _text(place_number)
+        name, inventory_number = _text(name) or None, _text(inventory_number) or None
+
+        if rack_number in SKIPPED_RACKS:
+            return None
+
+        if type_id not in self.type_ids:
+            if UNKNOWN_TYPE_ID not in self.type_ids:
+                raise LegacyReject(f"Неизвестный тип прибора {type_id}")
+            type_id = UNKNOWN_TYPE_ID
+        if inventory_number and len(inventory_number) > 30:
+            raise LegacyReject("Инв. номер длиннее 30 символов")
+
+        fields = {
+            "device_type_id": type_id,
+            "name": name,
+            "inventory_number": inventory_number,
+            "manufacture_date": _date(manufacture_date),
+            "current_check_date": _date(current_check_date),
+            "frequency_of_check": frequency if isinstance(frequency, int) and frequency >= 0 else None,
+            "next_check_date": _date(next_check_date),
+            "old_information": f"Регулировал: {_text(regulated)} Проверил: {_text(checked)}"[:60],
+            "station_id": None,
+            "stock_id": None,
+            "status": None,
+            "mounting_address_id": None,
+        }
+        place = None
+
+        if station_id == STOCK_STATION_ID:
+            fields |= {
+                "name": name if type_id == UNKNOWN_TYPE_ID else None,
+                "current_check_date": None,
+                "frequency_of_check": None,
+                "next_check_date": None,
+                "stock_id": self.stock_id,
+            }
+        else:
+            station = STATION_ID_DECODE.get(station_id)
+            if station not in self.station_ids:
+                raise LegacyReject(f"Неизвестная станция {station_id}")
+
+            if "стр" in rack_number.lower() or "N" in place_number:
+                digits = re.search(r"\d+", place_number.replace(" ", ""))
+                if not digits:
+                    raise LegacyReject("Нет номера стрелки")
+                place_number = f"стрелка №{digits.group()}"
+            if not place_number:
+                raise LegacyReject("Не указано место")
+            if len(place_number) > 20:
+                raise LegacyReject("Номер места длиннее 20 символов")
+
+            rack = self.racks.get((station, rack_number)) or self.fallback_racks.get(station)
+            if rack is None:
+                raise LegacyReject(f"Нет статива {rack_number}")
+            if name and len(name) > 20:
+                raise LegacyReject("Название длиннее 20 символов")
+            fields["station_id"] = station
+            fields["status"] = Device.status_for_date(fields["next_check_date"], self.today)
+            place = (rack, place_number)
+
+        key = f"{station_id}/{rack_number}/{place_number}/{inventory_number or ''}"[:90]
+        self.seen_keys[key] += 1
+        if self.seen_keys[key] > 1:
+            # одинаковые строки различаются порядковым номером
+            key = f"{key}#{self.seen_keys[key]}"
+        return key, fields, place
+
+    def write(self, chunk):
+        """Одна транзакция на порцию: новые места, затем вставка новых
+        и обновление уже перенесенных приборов, затем занятость мест"""
+
+        with serialized_write():
+            new_places = {}
+            for _, _, place in chunk:
+                if place and (place[0].pk, place[1]) not in self.places:
+                    rack, number = place
+                    new_place = Place(rack=rack, number=number)
+                    new_place.fill_address(rack)
+                    new_places[(rack.pk, number)] = new_place
+            for (rack_id, number), new_place in zip(new_places, Place.objects.bulk_create(new_places.values())):
+                self.places[(rack_id, number)] = new_place.pk
+            self.places_created += len(new_places)
+
+            existing = {
+                key: (pk, place_id)
+                for key, pk, place_id in Device.objects.filter(
+                    legacy_key__in=[key for key, _, _ in chunk],
+                ).values_list("legacy_key", "pk", "mounting_address_id")
+            }
+            touched_places = {place_id for _, place_id in existing.values()}
+            devices = []
+            for key, fields, place in chunk:
+                if place:
+                    fields["mounting_address_id"] = self.places[(place[0].pk, place[1])]
+                    touched_places.add(fields["mounting_address_id"])
+                devices.append(Device(legacy_key=key, **fields))
+
+            # вставка с обновлением по legacy_key: одна команда на порцию,
+            # в отличие от bulk_update, который строит CASE на каждую колонку
+            Device.objects.bulk_create(
+                devices,
+                update_conflicts=True,
+                unique_fields=["legacy_key"],
+                update_fields=DEVICE_FIELDS,
+            )
+            Device.objects.filter(pk__in=[pk for pk, _ in existing.values()]).update(version=F("version") + 1)
+            PlaceOccupancy.refresh(touched_places)
+
+        self.created += len(chunk) - len(existing)
+        self.updated += len(existing)
+        if self.progress:
+            self.progress(self)
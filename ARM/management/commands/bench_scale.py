@@ -0,0 +1,178 @@
+import json
+import platform
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import django
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, reset_queries
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ARM.export_excel import ExportExcelAction
+from ARM.inventory import InventoryGenerator
+from ARM.models import Device, MechanicReport
+from ARM.statuses import refresh_device_statuses
+
+
+class Command(BaseCommand):
+    help = ("Замер основных операций на синтетической базе нескольких размеров. "
+            "Результаты пишутся в JSON для сравнения запусков")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default="1,3,10",
+                            help="Размеры базы через запятую, 1 - примерно рабочая база (11 станций)")
+        parser.add_argument("--repeat", type=int, default=5, help="Повторов каждой операции")
+        parser.add_argument("--export-repeat", type=int, default=1, help="Повторов выгрузки в Excel")
+        parser.add_argument("--output", default="bench_scale.json", help="Файл результатов")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        results = {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": options["repeat"],
+            "scales": [],
+        }
+        for scale in [int(scale) for scale in options["scales"].split(",")]:
+            self.stdout.write(f"Размер x{scale}")
+            results["scales"].append(self._run_scale(scale, options))
+
+        Path(options["output"]).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        self.stdout.write(f"Результаты записаны в {options['output']}")
+
+    def _run_scale(self, scale, options):
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "scale.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                started = time.monotonic()
+                self.user = User.objects.create_superuser("bench", password="bench")
+                self.generator = InventoryGenerator(stations=11 * scale, seed=options["seed"])
+                counts = self.generator.run()
+                result = {"scale": scale, "counts": counts,
+                          "generate_seconds": round(time.monotonic() - started, 2), "operations": {}}
+                self.stdout.write(f"  {counts}, {result['generate_seconds']} c")
+
+                self.client = Client()
+                self.client.force_login(self.user)
+                # первая отрисовка админки создает тему admin_interface
+                self.client.get(reverse("admin:ARM_device_changelist"))
+
+                for name, operation, repeat in self._operations(options):
+                    result["operations"][name] = self._measure(operation, repeat)
+                    timings = result["operations"][name]
+                    self.stdout.write(f"  {name}: медиана {timings['median_ms']} мс, "
+                                      f"p95 {timings['p95_ms']} мс, запросов {timings['queries']}, "
+                                      f"ошибок {timings['errors']}")
+                return result
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _operations(self, options):
+        repeat = options["repeat"]
+        # ящики для create_mech_reports, их приборы затем меняет update_device
+        boxes = [self.generator.make_box() for _ in range(repeat)]
+        swaps = []
+        stock_devices = list(Device.objects.filter(
+            stock__isnull=False, station__isnull=True,
+        ).values_list("pk", flat=True)[:repeat * 20])
+        factory = RequestFactory()
+        request = factory.get("/")
+        request.user = self.user
+        device_admin = site._registry[Device]
+
+        def device_changelist(timed):
+            timed(lambda: self.client.get(reverse("admin:ARM_device_changelist")))
+
+        def mechanic_report_page(timed):
+            report = MechanicReport.objects.order_by("pk").first()
+            timed(lambda: self.client.get(reverse("admin:ARM_mechanicreport_change", args=(report.pk,))))
+
+        def create_mech_reports(timed):
+            kip_report = boxes.pop()
+            before = MechanicReport.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+            timed(lambda: self.client.post(reverse("create_mech_reports", args=(kip_report.pk,)),
+                                           HTTP_REFERER="/kip/"))
+            for report in MechanicReport.objects.filter(pk__gt=before).prefetch_related("devices"):
+                swaps.extend((report.pk, kip_report.pk, device.pk) for device in report.devices.all())
+
+        def update_device(timed):
+            report_id, kip_report_id, device_id = swaps.pop()
+            version = Device.objects.values_list("version", flat=True).get(pk=device_id)
+            timed(lambda: self.client.post(
+                reverse("update_device", args=(device_id,)),
+                {"kip_report_id": kip_report_id, "version": version},
+                HTTP_REFERER=f"/kip/ARM/mechanicreport/{report_id}/change/",
+            ))
+
+        def add_to_kipreport(timed):
+            selected = [stock_devices.pop() for _ in range(min(20, len(stock_devices)))]
+            timed(lambda: self.client.post(reverse("admin:ARM_device_changelist"),
+                                           {"action": "add_to_kipreport", "_selected_action": selected}))
+
+        def cron(timed):
+            timed(lambda: refresh_device_statuses(full=True))
+
+        def export_xlsx(timed):
+            with tempfile.TemporaryFile() as output:
+                timed(lambda: ExportExcelAction.write_xlsx(device_admin, device_admin.get_queryset(request),
+                                                           device_admin.list_display, output))
+
+        return [
+            ("device_changelist", device_changelist, repeat),
+            ("mechanic_report_page", mechanic_report_page, repeat),
+            ("create_mech_reports", create_mech_reports, repeat),
+            ("update_device", update_device, repeat),
+            ("add_to_kipreport", add_to_kipreport, repeat),
+            ("cron_refresh_statuses", cron, repeat),
+            ("export_xlsx", export_xlsx, options["export_repeat"]),
+        ]
+
+    @staticmethod
+    def _failed(response) -> bool:
+        if not hasattr(response, "status_code"):
+            return False
+        if response.status_code >= 400:
+            return True
+        return response.get("Content-Type") == "application/json" and not response.json().get("success")
+
+    def _measure(self, operation, repeat):
+        """Вызывает operation repeat раз; время и запросы считаются
+        только внутри timed(), подготовка данных в замер не входит"""
+
+        timings, queries, errors = [], [], 0
+
+        def timed(call):
+            nonlocal errors
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.monotonic()
+                response = call()
+                timings.append(time.monotonic() - started)
+            queries.append(len(captured))
+            errors += self._failed(response)
+            return response
+
+        for _ in range(repeat):
+            operation(timed)
+
+        timings.sort()
+        return {
+            "runs": len(timings),
+            "median_ms": round(statistics.median(timings) * 1000, 1),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 1),
+            "min_ms": round(timings[0] * 1000, 1),
+            "max_ms": round(timings[-1] * 1000, 1),
+            "queries": max(queries),
+            "errors": errors,
+        }
@@ -0,0 +1,209 @@
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import RequestFactory, override_settings
+
+from ARM.db import is_locked_error
+from ARM.models import (Device,
+                        DeviceKipReport,
+                        DeviceVersionConflict,
+                        KipReport,
+                        MechanicReport,
+                        Place,
+                        Rack,
+                        Station,
+                        SwapSession,
+                        Tipe)
+from ARM.statuses import refresh_device_statuses
+from ARM.views import KipMechReportAdapter
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный тест SQLite: задержка чтения списка приборов, "
+            "пока параллельно идут замены приборов и обновление статусов")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--devices", type=int, default=5_000, help="Приборов в базе")
+        parser.add_argument("--swaps", type=int, default=200, help="Замен на каждого писателя")
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=20.0, help="Ограничение по времени")
+        parser.add_argument("--journal-mode", default=None,
+                            help="Переопределить journal_mode, например 'delete' для сравнения с WAL")
+
+    def handle(self, *args, **options):
+        pragmas = dict(settings.SQLITE_PRAGMAS)
+        if options["journal_mode"]:
+            pragmas["journal_mode"] = options["journal_mode"]
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_PRAGMAS=pragmas):
+            connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "bench.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command("loaddata", "stations.json", "stock.json", "avz.json", "types.json", verbosity=0)
+                pairs = self._populate(options["devices"], options["writers"] * options["swaps"])
+                # первая отрисовка админки создает тему admin_interface,
+                # параллельные читатели не должны создавать ее одновременно
+                self._read_changelist(RequestFactory())
+                connection.close()
+                results = self._run(pairs, options)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self._report(results, pragmas)
+
+    def _populate(self, devices_count, pairs_count):
+        self.user = User.objects.create_superuser("bench", password="bench")
+        station = Station.objects.first()
+        tipe = Tipe.objects.first()
+        rack = Rack.objects.create(station=station, number="1")
+        places = [Place(rack=rack, number=str(number)) for number in range(max(pairs_count, 1))]
+        for place in places:
+            place.fill_address(rack)
+        places = Place.objects.bulk_create(places)
+        Device.objects.bulk_create([
+            Device(device_type=tipe, station=station, status=Device.normal,
+                   inventory_number=str(number), next_check_date=date(2030, 1, 1))
+            for number in range(devices_count)
+        ], batch_size=1_000)
+
+        installed = Device.objects.bulk_create([
+            Device(device_type=tipe, station=station, mounting_address=place,
+                   status=Device.overdue, next_check_date=date(2020, 1, 1))
+            for place in places[:pairs_count]
+        ], batch_size=1_000)
+        prepared = Device.objects.bulk_create([
+            Device(device_type=tipe, station=station, mounting_address=place,
+                   status=Device.send, next_check_date=date(2030, 1, 1))
+            for place in places[:pairs_count]
+        ], batch_size=1_000)
+
+        kip_report = KipReport.objects.create(author=self.user, editable=False)
+        DeviceKipReport.objects.bulk_create(
+            [DeviceKipReport(kip_report=kip_report, device=device, station=station) for device in prepared],
+            batch_size=1_000,
+        )
+        report = MechanicReport.objects.create(user=self.user, station=station)
+        report.devices.add(*installed)
+        return [(report.pk, kip_report.pk, device.pk) for device in installed]
+
+    def _read_changelist(self, factory):
+        request = factory.get("/kip/ARM/device/")
+        request.user = self.user
+        site._registry[Device].changelist_view(request).render()
+
+    def _run(self, pairs, options):
+        stop = threading.Event()
+        deadline = time.monotonic() + options["seconds"]
+        results = {"read": [], "swap": [], "cron": [], "locked": 0, "conflicts": 0}
+        lock = threading.Lock()
+
+        def record(kind, started):
+            with lock:
+                results[kind].append(time.monotonic() - started)
+
+        def locked():
+            with lock:
+                results["locked"] += 1
+
+        def reader():
+            factory = RequestFactory()
+            try:
+                while not stop.is_set() and time.monotonic() < deadline:
+                    started = time.monotonic()
+                    try:
+                        self._read_changelist(factory)
+                    except OperationalError as e:
+                        if not is_locked_error(e):
+                            raise
+                        locked()
+                    else:
+                        record("read", started)
+            finally:
+                connection.close()
+
+        def writer(chunk):
+            try:
+                for mech_report_id, kip_report_id, device_id in chunk:
+                    if time.monotonic() >= deadline:
+                        break
+                    started = time.monotonic()
+                    try:
+                        adapter = KipMechReportAdapter(mech_report_id=mech_report_id,
+                                                       kip_report_id=kip_report_id,
+                                                       storage=SwapSession.find_or_create(mech_report_id))
+                        device = Device.objects.get(pk=device_id)
+                        adapter.swap_devices(device, adapter.find_exact_mount_addr_exch_device(device))
+                    except DeviceVersionConflict:
+                        with lock:
+                            results["conflicts"] += 1
+                    except OperationalError as e:
+                        if not is_locked_error(e):
+                            raise
+                        locked()
+                    else:
+                        record("swap", started)
+            finally:
+                connection.close()
+
+        def cron():
+            try:
+                while not stop.is_set() and time.monotonic() < deadline:
+                    started = time.monotonic()
+                    try:
+                        refresh_device_statuses(full=True)
+                    except OperationalError as e:
+                        if not is_locked_error(e):
+                            raise
+                        locked()
+                    else:
+                        record("cron", started)
+                    stop.wait(0.5)
+            finally:
+                connection.close()
+
+        size = max(len(pairs) // options["writers"], 1)
+        writers = [
+            threading.Thread(target=writer, args=(pairs[number * size:(number + 1) * size],))
+            for number in range(options["writers"])
+        ]
+        others = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        others.append(threading.Thread(target=cron))
+
+        started = time.monotonic()
+        for thread in writers + others:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in others:
+            thread.join()
+        results["elapsed"] = time.monotonic() - started
+        return results
+
+    def _report(self, results, pragmas):
+        self.stdout.write(f"PRAGMA: {pragmas}")
+        self.stdout.write(f"Время: {results['elapsed']:.1f} c, "
+                          f"'database is locked': {results['locked']}, "
+                          f"конфликтов версий: {results['conflicts']}")
+        for kind, title in (("read", "Список приборов"), ("swap", "Замена прибора"), ("cron", "Обновление статусов")):
+            timings = sorted(results[kind])
+            if not timings:
+                self.stdout.write(f"{title}: нет успешных операций")
+                continue
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"{title}: {len(timings)} шт., медиана {statistics.median(timings) * 1000:.1f} мс, "
+                f"p95 {p95 * 1000:.1f} мс, максимум {timings[-1] * 1000:.1f} мс"
+            )
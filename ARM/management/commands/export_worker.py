@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ARM.exports import claim_next_job, fail_stale_jobs, purge_expired_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Выполняет выгрузки из очереди"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Выполнить задачи из очереди и завершиться")
+        parser.add_argument("--interval", type=float, default=2.0,
+                            help="Пауза между проверками очереди, секунд")
+
+    def handle(self, *args, **options):
+        if stale := fail_stale_jobs():
+            self.stdout.write(f"Прерванных выгрузок: {stale}")
+
+        while True:
+            purge_expired_jobs()
+
+            while job := claim_next_job():
+                job = run_job(job)
+                self.stdout.write(f"{job}: {job.processed} строк")
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ARM.inventory import InventoryGenerator
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу синтетическими станциями, стативами, местами, приборами, "
+            "ящиками КИП и отчетами механиков. --scale 1 - примерно размер рабочей базы")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=1, help="Множитель количества станций")
+        parser.add_argument("--stations", type=int, default=11, help="Станций при --scale 1")
+        parser.add_argument("--racks", type=int, default=30, help="Стативов на станции")
+        parser.add_argument("--places", type=int, default=40, help="Мест на стативе")
+        parser.add_argument("--kip-reports", type=int, default=4, help="Ящиков КИП")
+        parser.add_argument("--box-size", type=int, default=30, help="Приборов в ящике")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        generator = InventoryGenerator(
+            stations=options["stations"] * options["scale"],
+            racks=options["racks"],
+            places=options["places"],
+            kip_reports=options["kip_reports"],
+            box_size=options["box_size"],
+            seed=options["seed"],
+        )
+        with transaction.atomic():
+            counts = generator.run()
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in counts.items()))
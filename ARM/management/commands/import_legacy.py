@@ -0,0 +1,192 @@
+import csv
+import gzip
+import random
+import resource
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, reset_queries
+
+from ARM.legacy import (LEGACY_COLUMNS,
+                        STATION_ID_DECODE,
+                        STOCK_STATION_ID,
+                        LegacyImporter,
+                        dump_legacy_rows,
+                        stream_legacy_rows)
+from ARM.models import Device, Place, Rack, Station
+
+
+class Command(BaseCommand):
+    help = ("Переносит приборы и места из таблицы glav старой базы MySQL "
+            "или из ее дампа (--dump). Повторный запуск обновляет уже перенесенные приборы")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dump", default=None,
+                            help="Файл mysqldump (.sql или .sql.gz) вместо подключения к MySQL")
+        parser.add_argument("--encoding", default=None,
+                            help="Кодировка дампа, по умолчанию из SET NAMES в дампе")
+        parser.add_argument("--chunk-size", type=int, default=1_000, help="Строк в одной транзакции")
+        parser.add_argument("--fetch-size", type=int, default=2_000, help="Строк за одно чтение из MySQL")
+        parser.add_argument("--progress-every", type=int, default=10_000, help="Выводить прогресс каждые N строк")
+        parser.add_argument("--rejects", default=None, help="CSV-файл для отклоненных строк")
+        parser.add_argument("--synthetic", type=int, default=None, metavar="N",
+                            help="Замер: импорт N сгенерированных строк во временную базу")
+        parser.add_argument("--via-dump", action="store_true",
+                            help="Для --synthetic: записать строки в .sql.gz и импортировать из него")
+
+    def handle(self, *args, **options):
+        if options["synthetic"]:
+            return self._benchmark(options)
+
+        rejects_file = open(options["rejects"], "w", newline="", encoding="utf-8") if options["rejects"] else None
+        try:
+            reject = None
+            if rejects_file:
+                writer = csv.writer(rejects_file)
+                writer.writerow(["Строка", "Причина", "Данные"])
+
+                def reject(number, reason, row):
+                    writer.writerow([number, reason, repr(row)])
+
+            if options["dump"]:
+                rows = dump_legacy_rows(options["dump"], options["encoding"])
+            else:
+                rows = stream_legacy_rows(options["fetch_size"])
+            importer = self._import(rows, options, reject)
+        finally:
+            if rejects_file:
+                rejects_file.close()
+        self._report(importer)
+
+    def _import(self, rows, options, reject=None) -> LegacyImporter:
+        started = time.monotonic()
+        step = options["progress_every"]
+        reported = [0]
+
+        def progress(importer):
+            # при DEBUG Django хранит текст последних 9000 запросов,
+            # а запросы вставки порции занимают сотни килобайт
+            reset_queries()
+            if importer.processed - reported[0] >= step:
+                reported[0] = importer.processed
+                rate = importer.processed / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(f"Обработано {importer.processed} строк, {rate:.0f} строк/с")
+
+        importer = LegacyImporter(chunk_size=options["chunk_size"], progress=progress, reject=reject)
+        importer.run(rows)
+        importer.elapsed = time.monotonic() - started
+        return importer
+
+    def _report(self, importer: LegacyImporter):
+        self.stdout.write(
+            f"Строк: {importer.processed} за {importer.elapsed:.1f} c. "
+            f"Приборов создано: {importer.created}, обновлено: {importer.updated}, "
+            f"мест создано: {importer.places_created}, пропущено (АВЗ, запас): {importer.skipped}, "
+            f"отклонено: {sum(importer.rejects.values())}"
+        )
+        for reason, count in importer.rejects.most_common():
+            self.stdout.write(f"  {reason}: {count}")
+
+    def _benchmark(self, options):
+        """Импорт во временную базу: первый проход создает приборы,
+        второй (повторный запуск) обновляет их"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "import.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command("loaddata", "stations.json", "stock.json", "types.json", verbosity=0)
+                racks_count = self._create_racks()
+                count = options["synthetic"]
+
+                if options["via_dump"]:
+                    dump_path = Path(directory) / "glav.sql.gz"
+                    write_dump(dump_path, synthetic_rows(count, racks_count))
+                    self.stdout.write(f"Дамп: {dump_path.stat().st_size / 2 ** 20:.1f} МБ")
+
+                for title in ("Первый импорт", "Повторный импорт"):
+                    if options["via_dump"]:
+                        rows = dump_legacy_rows(dump_path)
+                    else:
+                        rows = synthetic_rows(count, racks_count)
+                    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    importer = self._import(rows, options)
+                    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    self.stdout.write(f"{title}:")
+                    self._report(importer)
+                    self.stdout.write(f"Пиковая память процесса: {rss_after / 1024:.0f} МБ "
+                                      f"(+{(rss_after - rss_before) / 1024:.0f} МБ за импорт)")
+
+                self.stdout.write(f"Приборов в базе: {Device.objects.count()}, мест: {Place.objects.count()}")
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def _create_racks() -> int:
+        racks_count = 40
+        Rack.objects.bulk_create([
+            Rack(station=station, number=number)
+            for station in Station.objects.filter(pk__in=STATION_ID_DECODE.values())
+            for number in [str(number) for number in range(1, racks_count + 1)] + ["тоннель"]
+        ])
+        return racks_count
+
+
+def synthetic_rows(count: int, racks_count: int, seed: int = 1):
+    """Строки в формате glav: приборы на стативах и стрелках, склад,
+    запас и небольшая доля строк с неизвестной станцией"""
+
+    rng = random.Random(seed)
+    stations = list(STATION_ID_DECODE)
+    start = date(2015, 1, 1)
+    for number in range(count):
+        kind = number % 50
+        station_id = stations[number % len(stations)]
+        rack, place = str(rng.randint(1, racks_count)), str(number // len(stations) % 200 + 1)
+        if kind == 0:
+            station_id = STOCK_STATION_ID
+        elif kind == 1:
+            rack = "зап"
+        elif kind == 2:
+            station_id = 99
+        elif kind < 6:
+            rack, place = "стр", f"N {number % 300}"
+        checked = start + timedelta(days=rng.randint(0, 3_000))
+        yield (station_id, rack, place, f"Р{number % 1000}", str(100_000 + number), checked - timedelta(days=900),
+               checked, 5, checked + timedelta(days=5 * 365), rng.randint(1, 50), "Иванов", "Петров")
+
+
+DUMP_COLUMN_TYPES = ("int(11)", "varchar(20)", "varchar(20)", "varchar(20)", "varchar(30)", "date", "date",
+                     "int(11)", "date", "int(11)", "varchar(30)", "varchar(30)")
+
+
+def _sql_value(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, int):
+        return str(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def write_dump(path, rows, rows_per_insert: int = 500):
+    """Таблица glav в формате mysqldump с расширенными INSERT"""
+
+    with gzip.open(path, "wt", encoding="utf-8") as dump:
+        dump.write("/*!40101 SET NAMES utf8mb4 */;\n")
+        dump.write("CREATE TABLE `glav` (\n")
+        dump.write(",\n".join(f"  `{name}` {column_type} DEFAULT NULL"
+                              for name, column_type in zip(LEGACY_COLUMNS, DUMP_COLUMN_TYPES)))
+        dump.write("\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;\n")
+        statement = []
+        for row in rows:
+            statement.append(f"({','.join(_sql_value(value) for value in row)})")
+            if len(statement) == rows_per_insert:
+                dump.write(f"INSERT INTO `glav` VALUES {','.join(statement)};\n")
+                statement = []
+        if statement:
+            dump.write(f"INSERT INTO `glav` VALUES {','.join(statement)};\n")
@@ -0,0 +1,254 @@
+import bisect
+import math
+import re
+import threading
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils.module_loading import import_string
+from django_cron.models import CronJobLog
+
+from .models import ExportJob
+
+
+# Метрики в текстовом формате Prometheus (exposition format 0.0.4).
+# Значения хранятся в памяти процесса: при нескольких воркерах gunicorn
+# каждый отдает свои. Задачи cron и очередь выгрузок работают в отдельных
+# процессах, их метрики собираются из базы в момент запроса (collector)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_number(value)}" for name, labels, value in self.samples()]
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    _child = _Value
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            yield f"{self.name}_total", _labels(self.labelnames, values), child.value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    _child = _Value
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            yield self.name, _labels(self.labelnames, values), child.value
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       _labels(self.labelnames, values, f'le="{_number(bound)}"'), cumulative)
+            yield f"{self.name}_sum", _labels(self.labelnames, values), child.sum
+            yield f"{self.name}_count", _labels(self.labelnames, values), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, function):
+        """function() возвращает метрики, заполненные в момент запроса"""
+
+        self._collectors.append(function)
+        return function
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        for collect in self._collectors:
+            metrics += collect()
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "arm_http_request_duration_seconds", "Время ответа на HTTP-запрос", ("view", "method"))
+REQUEST_QUERIES = REGISTRY.histogram(
+    "arm_http_request_db_queries", "Запросов к базе на один HTTP-запрос", ("view",),
+    buckets=(1, 5, 10, 15, 25, 35, 50, 100, 250, 500))
+REQUESTS = REGISTRY.counter(
+    "arm_http_requests", "HTTP-запросы по коду ответа", ("view", "status"))
+
+DEVICE_ACTIONS = REGISTRY.counter(
+    "arm_device_actions", "Замены приборов и отметки дефектов по результату", ("action", "outcome"))
+
+EXPORT_ROWS = REGISTRY.histogram(
+    "arm_export_rows", "Строк в выгрузке Excel, сформированной в запросе",
+    buckets=(100, 500, 1_000, 2_000, 5_000))
+EXPORT_BYTES = REGISTRY.histogram(
+    "arm_export_bytes", "Размер выгрузки Excel, сформированной в запросе",
+    buckets=(10_000, 100_000, 500_000, 1_000_000, 5_000_000))
+EXPORT_DURATION = REGISTRY.histogram(
+    "arm_export_duration_seconds", "Время выгрузки Excel, сформированной в запросе",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30))
+
+
+@REGISTRY.collector
+def cron_jobs() -> list[Metric]:
+    """Последний запуск каждой задачи CRON_CLASSES по журналу django_cron"""
+
+    duration = Gauge("arm_cron_last_duration_seconds", "Длительность последнего запуска задачи cron", ("job",))
+    success = Gauge("arm_cron_last_success", "1, если последний запуск задачи cron успешен", ("job",))
+    finished = Gauge("arm_cron_last_run_timestamp_seconds", "Время окончания последнего запуска", ("job",))
+    changed = Gauge("arm_device_statuses_last_changed", "Приборов со смененным статусом при последнем запуске")
+
+    for path in settings.CRON_CLASSES:
+        job = import_string(path)
+        log = CronJobLog.objects.filter(code=job.code).order_by("-start_time").first()
+        if log is None:
+            continue
+        duration.labels(job.code).set((log.end_time - log.start_time).total_seconds())
+        success.labels(job.code).set(int(log.is_success))
+        finished.labels(job.code).set(log.end_time.timestamp())
+        if job.code == "ARM.update_device_statuses" and log.is_success:
+            # сообщение задачи: "Обновлено статусов: N"
+            if count := re.search(r"(\d+)\s*$", log.message or ""):
+                changed.set(int(count[1]))
+    return [duration, success, finished, changed]
+
+
+@REGISTRY.collector
+def export_jobs() -> list[Metric]:
+    """Очередь выгрузок (ARM.exports) и последняя готовая выгрузка"""
+
+    jobs = Gauge("arm_export_jobs", "Выгрузки в очереди и за время хранения по статусу", ("status",))
+    rows = Gauge("arm_export_job_last_rows", "Строк в последней выгрузке из очереди")
+    size = Gauge("arm_export_job_last_bytes", "Размер файла последней выгрузки из очереди")
+    duration = Gauge("arm_export_job_last_seconds", "От постановки в очередь до готовности последней выгрузки")
+
+    for status, _ in ExportJob.CHOICES:
+        jobs.labels(status).set(0)
+    for row in ExportJob.objects.values("status").annotate(count=Count("pk")):
+        jobs.labels(row["status"]).set(row["count"])
+
+    last = ExportJob.objects.filter(status=ExportJob.done, finished__isnull=False).order_by("-finished").first()
+    if last is not None:
+        rows.set(last.total)
+        duration.set((last.finished - last.created).total_seconds())
+        path = settings.EXPORT_ROOT / last.file_name
+        if path.is_file():
+            size.set(path.stat().st_size)
+    return [jobs, rows, size, duration]
@@ -0,0 +1,102 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+
+from .metrics import REQUEST_DURATION, REQUEST_QUERIES, REQUESTS
+from .models import RequestQueryLog
+from .profiling import RequestProfiler, profile_requested, release_lock, try_lock
+from .querystats import QueryStats, budget_for
+
+
+logger = logging.getLogger("ARM.queries")
+
+
+class QueryStatsMiddleware:
+    """Считает запросы к базе и время ответа на каждый HTTP-запрос (метрики
+    ARM.metrics). Запросы сверх бюджета
+    QUERY_BUDGETS или порогов QUERY_LOG_MIN_QUERIES / QUERY_LOG_MIN_MS
+    пишутся в лог одной строкой JSON и в RequestQueryLog"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view_name = (match.view_name or match._func_path) if match else ""
+        budget = budget_for(view_name)
+        record = {
+            "method": request.method,
+            "path": request.path[:255],
+            "view_name": view_name[:200],
+            "status_code": response.status_code,
+            "queries": stats.count,
+            "duplicates": stats.duplicates,
+            "sql_ms": round(stats.duration * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            "budget": budget,
+        }
+        response.query_stats = {**record, "most_repeated": stats.most_repeated()}
+
+        metric_view = view_name or "<unresolved>"
+        REQUEST_DURATION.labels(metric_view, request.method).observe(duration)
+        REQUEST_QUERIES.labels(metric_view).observe(stats.count)
+        REQUESTS.labels(metric_view, response.status_code).inc()
+
+        over_budget = budget is not None and stats.count > budget
+        if over_budget or stats.count >= settings.QUERY_LOG_MIN_QUERIES \
+                or record["duration_ms"] >= settings.QUERY_LOG_MIN_MS:
+            record["slowest"] = stats.slowest()
+            logger.log(logging.WARNING if over_budget else logging.INFO,
+                       json.dumps(record, ensure_ascii=False))
+            self._save(request, record)
+        return response
+
+    @staticmethod
+    def _save(request, record):
+        user = getattr(request, "user", None)
+        try:
+            RequestQueryLog.objects.create(user=user if user and user.is_authenticated else None, **record)
+        except DatabaseError:
+            # статистика не должна ломать ответ, например при "database is locked"
+            logger.warning("Не удалось сохранить статистику запросов", exc_info=True)
+
+
+class ProfilerMiddleware:
+    """Профиль отдельного запроса по требованию сотрудника: параметр
+    PROFILE_PARAM в адресе или заголовок X-ARM-Profile. Номер сохраненного
+    профиля возвращается в заголовке ответа X-ARM-Profile. При
+    PROFILE_ENABLED = False промежуточный слой не подключается совсем"""
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # профилируется только один запрос за раз, остальные идут как обычно
+        if not profile_requested(request) or not try_lock():
+            return self.get_response(request)
+
+        profiler = RequestProfiler(request)
+        try:
+            response = profiler.run(self.get_response)
+        finally:
+            release_lock()
+
+        try:
+            profile = profiler.save(response)
+        except (DatabaseError, OSError):
+            logger.warning("Не удалось сохранить профиль запроса", exc_info=True)
+        else:
+            response["X-ARM-Profile"] = str(profile.pk)
+        return response
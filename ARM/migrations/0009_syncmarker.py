@@ -0,0 +1,26 @@
+# Generated by Django 4.1 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0008_alter_mechanicreport_devices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True, verbose_name='Ключ')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Служебная отметка',
+                'verbose_name_plural': 'Служебные отметки',
+            },
+        ),
+    ]
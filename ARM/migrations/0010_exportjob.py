@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 08:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ARM', '0009_syncmarker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=100, verbose_name='Раздел')),
+                ('query', models.BinaryField()),
+                ('fields', models.JSONField(default=list, verbose_name='Колонки')),
+                ('cache_key', models.CharField(db_index=True, editable=False, max_length=64)),
+                ('status', models.CharField(choices=[('в очереди', 'в очереди'), ('выполняется', 'выполняется'), ('готово', 'готово'), ('ошибка', 'ошибка')], default='в очереди', max_length=20, verbose_name='Статус')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='Файл')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершен')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка',
+                'verbose_name_plural': 'Выгрузки',
+            },
+        ),
+    ]
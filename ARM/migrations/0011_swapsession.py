@@ -0,0 +1,26 @@
+# Generated by Django 4.1 on 2026-10-18 08:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0010_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwapSession',
+            fields=[
+                ('mech_report', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='ARM.mechanicreport', verbose_name='Отчет механика')),
+                ('device_ids', models.JSONField(default=list, verbose_name='Использованные приборы')),
+                ('touched', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Сессия замен',
+                'verbose_name_plural': 'Сессии замен',
+            },
+        ),
+    ]
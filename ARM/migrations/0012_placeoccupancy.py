@@ -0,0 +1,25 @@
+# Generated by Django 4.1 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0011_swapsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceOccupancy',
+            fields=[
+                ('place', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='occupancy', serialize=False, to='ARM.place', verbose_name='Место')),
+                ('devices', models.JSONField(default=dict, verbose_name='Приборы на месте')),
+            ],
+            options={
+                'verbose_name': 'Занятость места',
+                'verbose_name_plural': 'Занятость мест',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def fill_place_occupancy(apps, schema_editor):
+    Device = apps.get_model("ARM", "Device")
+    PlaceOccupancy = apps.get_model("ARM", "PlaceOccupancy")
+
+    occupancy = {}
+    for device_id, place_id, status, device_type_id in Device.objects.exclude(
+        mounting_address=None,
+    ).values_list("pk", "mounting_address_id", "status", "device_type_id").iterator():
+        occupancy.setdefault(place_id, {})[str(device_id)] = [status, device_type_id]
+
+    PlaceOccupancy.objects.bulk_create(
+        [PlaceOccupancy(place_id=place_id, devices=devices) for place_id, devices in occupancy.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ARM", "0012_placeoccupancy"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_place_occupancy, migrations.RunPython.noop),
+    ]
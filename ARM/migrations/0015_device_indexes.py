@@ -0,0 +1,41 @@
+# Generated by Django 4.1 on 2026-10-18 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0014_device_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['next_check_date'], name='arm_device_next_check_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(condition=models.Q(('stock__isnull', True)), fields=['next_check_date'], name='arm_device_installed_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['status'], name='arm_device_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['station', 'mounting_address', 'device_type', 'status'], name='arm_device_exchange_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['avz', 'device_type', 'status'], name='arm_device_avz_exchange_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(condition=models.Q(('stock__isnull', False)), fields=['device_type'], name='arm_device_stock_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['inventory_number'], name='arm_device_inventory_idx'),
+        ),
+    ]
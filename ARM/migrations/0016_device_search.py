@@ -0,0 +1,87 @@
+from django.db import migrations
+
+
+SEARCH_TABLE = "arm_device_search"
+
+# Индекс поиска приборов. На SQLite - таблица FTS5, которую держат в
+# актуальном состоянии триггеры на ARM_device и ARM_tipe; на PostgreSQL -
+# триграммные GIN-индексы (pg_trgm) по тем же колонкам
+SQLITE_SEARCH_SQL = [
+    f"""CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        name, inventory_number, device_type,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_ai AFTER INSERT ON "ARM_device" BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, name, inventory_number, device_type)
+        VALUES (new.id, new.name, new.inventory_number,
+                (SELECT name FROM "ARM_tipe" WHERE id = new.device_type_id));
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_au AFTER UPDATE OF name, inventory_number, device_type_id
+        ON "ARM_device" BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET name = new.name,
+            inventory_number = new.inventory_number,
+            device_type = (SELECT name FROM "ARM_tipe" WHERE id = new.device_type_id)
+        WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_ad AFTER DELETE ON "ARM_device" BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_tipe_au AFTER UPDATE OF name ON "ARM_tipe" BEGIN
+        UPDATE {SEARCH_TABLE} SET device_type = new.name
+        WHERE rowid IN (SELECT id FROM "ARM_device" WHERE device_type_id = new.id);
+    END""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, name, inventory_number, device_type)
+        SELECT device.id, device.name, device.inventory_number, tipe.name
+        FROM "ARM_device" device LEFT JOIN "ARM_tipe" tipe ON tipe.id = device.device_type_id""",
+]
+
+SQLITE_DROP_SEARCH_SQL = [
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_tipe_au",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+POSTGRESQL_SEARCH_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    'CREATE INDEX IF NOT EXISTS arm_device_name_trgm ON "ARM_device" '
+    'USING gin (UPPER("name") gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS arm_device_inventory_trgm ON "ARM_device" '
+    'USING gin (UPPER("inventory_number") gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS arm_tipe_name_trgm ON "ARM_tipe" '
+    'USING gin (UPPER("name") gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS arm_tipe_name_trgm",
+    "DROP INDEX IF EXISTS arm_device_inventory_trgm",
+    "DROP INDEX IF EXISTS arm_device_name_trgm",
+]
+
+
+STATEMENTS = {
+    "sqlite": (SQLITE_SEARCH_SQL, SQLITE_DROP_SEARCH_SQL),
+    "postgresql": (POSTGRESQL_SEARCH_SQL, POSTGRESQL_DROP_SEARCH_SQL),
+}
+
+
+def run_statements(schema_editor, forward: bool):
+    create, drop = STATEMENTS.get(schema_editor.connection.vendor, ((), ()))
+    for statement in (create if forward else drop):
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ARM", "0015_device_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            lambda apps, schema_editor: run_statements(schema_editor, forward=True),
+            lambda apps, schema_editor: run_statements(schema_editor, forward=False),
+        ),
+    ]
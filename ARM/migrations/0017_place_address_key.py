@@ -0,0 +1,52 @@
+# Generated by Django 4.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def normalize_address(address):
+    rack, _, number = address.strip().partition("-")
+    return f"{' '.join(rack.split())}-{' '.join(number.split())}".casefold()
+
+
+def fill_address_keys(apps, schema_editor):
+    Place = apps.get_model("ARM", "Place")
+
+    places = list(Place.objects.select_related("rack"))
+    for place in places:
+        place.station_id = place.rack.station_id
+        place.address_key = normalize_address(f"{place.rack.number or ''}-{place.number}")
+    Place.objects.bulk_update(places, ["station", "address_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0016_device_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='address_key',
+            field=models.CharField(default='', editable=False, max_length=50, verbose_name='Адрес для поиска'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='station',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='places', to='ARM.station', verbose_name='Станция'),
+        ),
+        migrations.RunPython(fill_address_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['address_key'], name='arm_place_address_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['station', 'address_key'], name='arm_place_station_address_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['number'], name='arm_place_number_idx'),
+        ),
+    ]
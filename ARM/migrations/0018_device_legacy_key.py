@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 09:15
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+search = import_module("ARM.migrations.0016_device_search")
+
+# на SQLite AddField пересоздает таблицу ARM_device, а триггеры индекса
+# поиска ссылаются на нее, поэтому на время изменения они удаляются
+SEARCH_TRIGGERS = search.SQLITE_SEARCH_SQL[1:5]
+DROP_SEARCH_TRIGGERS = search.SQLITE_DROP_SEARCH_SQL[:4]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "sqlite":
+            for statement in statements:
+                schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0017_place_address_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(DROP_SEARCH_TRIGGERS), run_sqlite(SEARCH_TRIGGERS)),
+        migrations.AddField(
+            model_name='device',
+            name='legacy_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True, verbose_name='Ключ в старой базе'),
+        ),
+        migrations.RunPython(run_sqlite(SEARCH_TRIGGERS), run_sqlite(DROP_SEARCH_TRIGGERS)),
+    ]
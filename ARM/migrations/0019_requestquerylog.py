@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 09:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ARM', '0018_device_legacy_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestQueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Время')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=255, verbose_name='Адрес')),
+                ('view_name', models.CharField(db_index=True, max_length=200, verbose_name='Представление')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Код ответа')),
+                ('queries', models.PositiveIntegerField(verbose_name='Запросов к базе')),
+                ('duplicates', models.PositiveIntegerField(default=0, verbose_name='Повторов')),
+                ('sql_ms', models.FloatField(verbose_name='Время SQL, мс')),
+                ('duration_ms', models.FloatField(verbose_name='Время ответа, мс')),
+                ('budget', models.PositiveIntegerField(blank=True, null=True, verbose_name='Бюджет запросов')),
+                ('slowest', models.JSONField(default=list, verbose_name='Самые долгие запросы')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Статистика запросов',
+                'verbose_name_plural': 'Статистика запросов',
+            },
+        ),
+    ]
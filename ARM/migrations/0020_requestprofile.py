@@ -0,0 +1,37 @@
+# Generated by Django 4.1 on 2026-10-18 09:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ARM', '0019_requestquerylog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Время')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=255, verbose_name='Адрес')),
+                ('view_name', models.CharField(max_length=200, verbose_name='Представление')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Код ответа')),
+                ('duration_ms', models.FloatField(verbose_name='Время ответа, мс')),
+                ('queries', models.PositiveIntegerField(verbose_name='Запросов к базе')),
+                ('sql_ms', models.FloatField(verbose_name='Время SQL, мс')),
+                ('memory_peak_kb', models.PositiveIntegerField(verbose_name='Пик памяти, КБ')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='Файл')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1 on 2026-10-18 09:42
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+
+def fill_replacement_calendar(apps, schema_editor):
+    Device = apps.get_model("ARM", "Device")
+    ReplacementCalendar = apps.get_model("ARM", "ReplacementCalendar")
+
+    cells = Device.objects.filter(next_check_date__isnull=False).annotate(
+        year=ExtractYear("next_check_date"),
+        month=ExtractMonth("next_check_date"),
+    ).values("year", "month", "station_id", "device_type_id").annotate(count=Count("pk")).order_by()
+    ReplacementCalendar.objects.bulk_create([ReplacementCalendar(**cell) for cell in cells], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0020_requestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplacementCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Год')),
+                ('month', models.PositiveSmallIntegerField(verbose_name='Месяц')),
+                ('count', models.IntegerField(default=0, verbose_name='Приборов')),
+                ('device_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ARM.tipe', verbose_name='Тип прибора')),
+                ('station', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='ARM.station', verbose_name='Станция')),
+            ],
+            options={
+                'verbose_name': 'Календарь замен',
+                'verbose_name_plural': 'Календарь замен',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='replacementcalendar',
+            constraint=models.UniqueConstraint(fields=('year', 'month', 'station', 'device_type'), name='arm_calendar_cell_unique'),
+        ),
+        migrations.RunPython(fill_replacement_calendar, migrations.RunPython.noop),
+    ]
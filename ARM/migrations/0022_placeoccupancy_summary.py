@@ -0,0 +1,54 @@
+# Generated by Django 4.1 on 2026-10-18 09:57
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_place_occupancy(apps, schema_editor):
+    Device = apps.get_model("ARM", "Device")
+    PlaceOccupancy = apps.get_model("ARM", "PlaceOccupancy")
+
+    occupancy = {}
+    for row in Device.objects.exclude(mounting_address=None).values(
+        "mounting_address_id", "status", "device_type_id",
+    ).annotate(count=Count("pk")).order_by():
+        summary = occupancy.setdefault(row["mounting_address_id"], PlaceOccupancy(
+            place_id=row["mounting_address_id"], count=0, statuses={}, device_types={},
+        ))
+        summary.count += row["count"]
+        for field, value in (("statuses", row["status"]), ("device_types", row["device_type_id"])):
+            key = "" if value is None else str(value)
+            getattr(summary, field)[key] = getattr(summary, field).get(key, 0) + row["count"]
+
+    PlaceOccupancy.objects.all().delete()
+    PlaceOccupancy.objects.bulk_create(occupancy.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0021_replacementcalendar'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='placeoccupancy',
+            name='devices',
+        ),
+        migrations.AddField(
+            model_name='placeoccupancy',
+            name='count',
+            field=models.IntegerField(default=0, verbose_name='Приборов на месте'),
+        ),
+        migrations.AddField(
+            model_name='placeoccupancy',
+            name='device_types',
+            field=models.JSONField(default=dict, verbose_name='Приборов по типам'),
+        ),
+        migrations.AddField(
+            model_name='placeoccupancy',
+            name='statuses',
+            field=models.JSONField(default=dict, verbose_name='Приборов по статусам'),
+        ),
+        migrations.RunPython(fill_place_occupancy, migrations.RunPython.noop),
+    ]
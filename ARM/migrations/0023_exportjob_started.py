@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ARM', '0022_placeoccupancy_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начат'),
+        ),
+    ]
@@ -1,13 +1,17 @@
-from datetime import date
+from datetime import date, timedelta
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import ExtractMonth, ExtractYear
 from django.contrib.auth.models import User, Group
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.html import format_html
 
+from .db import serialized_write
+
 
 class Stock(models.Model):
     name = models.CharField(verbose_name="Склад", default="Склад", editable=False, max_length=6, unique=True)
@@ -91,6 +95,22 @@ class AVZ(models.Model):
         return f"АВЗ {self.station.__str__()}"
 
 
+class PlaceQuerySet(models.QuerySet):
+    def address_prefix(self, term: str):
+        """Места, нормализованный адрес которых начинается с term:
+        '27-7' -> 27-7, 27-712...; 'тоннель-стр' -> тоннель-стрелка №1.
+        Диапазон по индексу address_key, без просмотра таблицы"""
+
+        prefix = Place.normalize_prefix(term)
+        if not prefix:
+            return self
+        return self.filter(
+            address_key__gte=prefix,
+            address_key__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1),
+            address_key__startswith=prefix,
+        )
+
+
 class Place(models.Model): # место прибора
     rack = models.ForeignKey(Rack,
                              on_delete=models.CASCADE, 
@@ -99,10 +119,59 @@ class Place(models.Model): # место прибора
                                 "статива и выберите значение "
                                 "из списка результатов")
     number = models.CharField(max_length=20, verbose_name="Номер места")
+    station = models.ForeignKey(Station,
+                                on_delete=models.SET_NULL,
+                                null=True,
+                                editable=False,
+                                related_name="places",
+                                verbose_name="Станция")
+    address_key = models.CharField(max_length=50, default="", editable=False, verbose_name="Адрес для поиска")
+
+    objects = PlaceQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Место"
         verbose_name_plural = "Места"
+        indexes = [
+            models.Index(fields=["address_key"], name="arm_place_address_idx"),
+            models.Index(fields=["station", "address_key"], name="arm_place_station_address_idx"),
+            models.Index(fields=["number"], name="arm_place_number_idx"),
+        ]
+
+    OTHER_PLACES_RACKS = ("релейная", "тоннель", "поле")
+    OTHER_PLACES_NUMBER = "остальное"
+
+    @staticmethod
+    def normalize_address(address: str) -> str:
+        """Приводит адрес 'статив-место' к виду для поиска:
+        без лишних пробелов и без учета регистра"""
+
+        rack, _, number = address.strip().partition("-")
+        return f"{' '.join(rack.split())}-{' '.join(number.split())}".casefold()
+
+    @classmethod
+    def normalize_prefix(cls, term: str) -> str:
+        if "-" in term:
+            return cls.normalize_address(term)
+        return " ".join(term.split()).casefold()
+
+    def fill_address(self, rack: Rack = None):
+        """Заполняет станцию и ключ адреса из статива"""
+
+        rack = rack or self.rack
+        self.station_id = rack.station_id
+        self.address_key = self.normalize_address(f"{rack.number or ''}-{self.number}")
+
+    def save(self, *args, **kwargs):
+        self.fill_address()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "station", "address_key"}
+        super().save(*args, **kwargs)
+
+    def is_other_place(self) -> bool:
+        """Место вида 'релейная-остальное', где может стоять много приборов"""
+
+        return self.number == self.OTHER_PLACES_NUMBER and self.rack.number in self.OTHER_PLACES_RACKS
 
     def __str__(self):
         station_name = self.rack.station.__str__()[:5]
@@ -110,6 +179,102 @@ class Place(models.Model): # место прибора
                f"{self.rack.number}-{self.number}")
 
 
+def next_month_start(day: date) -> date:
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+class DeviceVersionConflict(Exception):
+    """Прибор изменен другим пользователем после того, как был загружен"""
+
+    def __init__(self, device):
+        self.device = device
+        super().__init__(f"Прибор {device.inventory_number} уже изменен другим пользователем, "
+                         f"обновите страницу и повторите действие")
+
+
+class DeviceQuerySet(models.QuerySet):
+    @staticmethod
+    def live_status_expression(today: date = None):
+        """Правило Device.get_status в виде выражения для базы данных"""
+
+        today = today or timezone.localdate()
+        return Case(
+            When(next_check_date__isnull=True, then=Value(None)),
+            When(next_check_date__gte=next_month_start(today), then=Value(Device.normal)),
+            When(next_check_date__gt=today, then=Value(Device.ready)),
+            default=Value(Device.overdue),
+            output_field=models.CharField(),
+        )
+
+    def for_listing(self):
+        """Только колонки списка приборов и связанные объекты,
+        нужные для их подписей (Device, Place и AVZ __str__)"""
+
+        return self.select_related(
+            "station",
+            "device_type",
+            "mounting_address__rack__station",
+            "avz__station",
+        ).only(
+            "name",
+            "inventory_number",
+            "next_check_date",
+            "status",
+            "station__name",
+            "device_type__name",
+            "mounting_address__number",
+            "mounting_address__rack__number",
+            "mounting_address__rack__station__name",
+            "avz__station__name",
+        )
+
+    def with_live_status(self, today: date = None):
+        return self.annotate(live_status=self.live_status_expression(today))
+
+    def refresh_status(self, today: date = None) -> int:
+        """Записывает актуальный статус одним UPDATE,
+        затрагивая только приборы с устаревшим статусом,
+        и пересчитывает занятость их мест"""
+
+        live_status = self.live_status_expression(today)
+        stale = self.alias(
+            live_status=live_status,
+        ).exclude(
+            status=F("live_status"),
+        )
+        place_ids = set(
+            stale.exclude(mounting_address=None).values_list("mounting_address_id", flat=True).distinct()
+        )
+        changed = stale.update(status=live_status, version=F("version") + 1)
+        PlaceOccupancy.refresh(place_ids)
+        return changed
+
+    def lock(self, *pks) -> list[int]:
+        """Блокирует строки приборов до конца транзакции (SELECT ... FOR UPDATE)
+        в порядке pk, чтобы параллельные замены не взаимоблокировались.
+        На SQLite запрос выполняется без блокировки строк"""
+
+        return list(self.select_for_update().filter(pk__in=pks).order_by("pk").values_list("pk", flat=True))
+
+    def bulk_update_checked(self, devices, fields) -> int:
+        """bulk_update с проверкой версий: если хоть один прибор изменен
+        после загрузки, ничего не записывается. Вызывается в транзакции"""
+
+        versions = dict(
+            self.select_for_update().filter(
+                pk__in=[device.pk for device in devices],
+            ).values_list("pk", "version")
+        )
+        for device in devices:
+            if versions.get(device.pk) != device.version:
+                raise DeviceVersionConflict(device)
+        for device in devices:
+            device.version += 1
+        return self.bulk_update(devices, fields=[*fields, "version"])
+
+
 class Device(models.Model):
     ready = "нужна замена"
     send = "отправлен"
@@ -178,16 +343,107 @@ class Device(models.Model):
     current_check_date = models.DateField(verbose_name='дата проверки', null=True, blank=True)
     next_check_date = models.DateField(verbose_name='дата следующей проверки', null=True)
     old_information = models.CharField(max_length=60, null=True, blank=True, verbose_name="Старая информация")
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
+    legacy_key = models.CharField(max_length=100,
+                                  unique=True,
+                                  null=True,
+                                  blank=True,
+                                  editable=False,
+                                  verbose_name="Ключ в старой базе")
+
+    objects = DeviceQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Прибор"
         verbose_name_plural = "Приборы"
+        indexes = [
+            # фильтры по году/месяцу и диапазоны дат в обновлении статусов
+            models.Index(fields=["next_check_date"], name="arm_device_next_check_idx"),
+            models.Index(fields=["next_check_date"], condition=Q(stock__isnull=True),
+                         name="arm_device_installed_due_idx"),
+            models.Index(fields=["status"], name="arm_device_status_idx"),
+            # поиск прибора на замену на точном месте и в АВЗ
+            models.Index(fields=["station", "mounting_address", "device_type", "status"],
+                         name="arm_device_exchange_idx"),
+            models.Index(fields=["avz", "device_type", "status"], name="arm_device_avz_exchange_idx"),
+            # свободные приборы склада по типу (ARM.stock)
+            models.Index(fields=["device_type"], condition=Q(stock__isnull=False),
+                         name="arm_device_stock_type_idx"),
+            models.Index(fields=["inventory_number"], name="arm_device_inventory_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_place_id = instance.__dict__.get("mounting_address_id")
+        if all(field in instance.__dict__ for field in ("mounting_address_id", "status", "device_type_id")):
+            instance._loaded_occupancy_key = instance.occupancy_key
+        if all(field in instance.__dict__ for field in ("next_check_date", "station_id", "device_type_id")):
+            instance._loaded_calendar_key = instance.calendar_key
+        return instance
+
+    @property
+    def calendar_key(self) -> tuple | None:
+        """Ячейка календаря замен (ReplacementCalendar): год, месяц, станция, тип"""
+
+        if self.next_check_date is None:
+            return None
+        return self.next_check_date.year, self.next_check_date.month, self.station_id, self.device_type_id
+
+    @property
+    def occupancy_key(self) -> tuple | None:
+        """Сводка занятости места (PlaceOccupancy): место, статус, тип"""
+
+        if self.mounting_address_id is None:
+            return None
+        return self.mounting_address_id, self.status, self.device_type_id
+
+    def save(self, *args, **kwargs):
+        """Изменение существующего прибора записывается, только если его
+        версия в базе совпадает с загруженной, иначе DeviceVersionConflict"""
+
+        if self._state.adding or kwargs.get("force_insert"):
+            return super().save(*args, **kwargs)
+
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+        connection = connections[kwargs.get("using") or router.db_for_write(self.__class__, instance=self)]
+        marked_for_rollback = connection.in_atomic_block and connection.needs_rollback
+        self._expected_version = self.version
+        self._version_conflict = False
+        self.version += 1
+        try:
+            super().save(*args, **kwargs)
+        except BaseException as e:
+            self.version = self._expected_version
+            if isinstance(e, DeviceVersionConflict) and connection.in_atomic_block and not marked_for_rollback:
+                # UPDATE не изменил ни одной строки, поэтому внешнюю транзакцию,
+                # которую save_base пометил на откат, можно продолжать
+                connection.set_rollback(False)
+            raise
+        finally:
+            self._expected_version = None
+            self._version_conflict = False
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected_version = getattr(self, "_expected_version", None)
+        if expected_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+        if not super()._do_update(base_qs.filter(version=expected_version),
+                                  using, pk_val, values, update_fields, True):
+            self._version_conflict = True
+        return True
+
+    def _save_table(self, *args, **kwargs):
+        updated = super()._save_table(*args, **kwargs)
+        # исключение до post_save: обработчики сигналов (занятость мест,
+        # календарь замен) не должны учитывать несостоявшееся изменение
+        if getattr(self, "_version_conflict", False):
+            raise DeviceVersionConflict(self)
+        return updated
 
     def clean(self):
-        other_places = Place.objects.filter(
-            Q(rack__number="релейная") | Q(rack__number="тоннель") | Q(rack__number="поле"),
-            number="остальное",
-        )
         if self.name:
             if not self.mounting_address:
                 raise ValidationError("Укажите монтажный адрес или удалите название прибора")
@@ -195,21 +451,25 @@ class Device(models.Model):
                 raise ValidationError("Обратите внимание, у приборов в АВЗ не должно быть названия")
 
         if self.mounting_address:
-            devices_on_address = self.mounting_address.device_set.all()
-            devices_on_place = self.mounting_address.device_set.count()
+            occupancy = PlaceOccupancy.of(self.mounting_address_id)
+            devices_on_place = occupancy.count
+            loaded_key = getattr(self, "_loaded_occupancy_key", None)
+            on_place = loaded_key is not None and loaded_key[0] == self.mounting_address_id
+
+            from .topology import get_topology
 
-            if self.mounting_address not in other_places:
+            if not get_topology().is_other_place(self.mounting_address_id):
 
                 if devices_on_place > 0 and (self.status != self.in_progress or self.status != self.send)\
-                        and self not in devices_on_address:
+                        and not on_place:
                     raise ValidationError("На данном адресе уже установлен прибор, "
                                           "выберите другой адрес или измените статус на 'готовится', 'отправлен'")
 
-                if devices_on_place > 1 and self not in devices_on_address:
+                if devices_on_place > 1 and not on_place:
                     raise ValidationError("На данном адресе уже установлен прибор и один прибор уже готовится")
 
-                if devices_on_place > 1 and self in devices_on_address:
-                    other_device_status = [device.status for device in devices_on_address if device != self][0]
+                if devices_on_place > 1 and on_place:
+                    other_device_status = occupancy.other_statuses(loaded_key[1])[0]
                     if self.status == other_device_status:
                         raise ValidationError("На этом адресе уже есть прибор с таким же статусом")
                     if not self.status and other_device_status == "in_progress":
@@ -269,31 +529,267 @@ class Device(models.Model):
             )
             return self.next_check_date
 
-    def get_status(self):
+    @classmethod
+    def status_for_date(cls, next_check_date, today):
+        if next_check_date is None:
+            return None
+        if (next_check_date.year, next_check_date.month) > (today.year, today.month):
+            return cls.normal
+        if next_check_date > today:
+            return cls.ready
+        return cls.overdue
+
+    def get_status(self, today=None):
         if self.next_check_date:
-            year = self.next_check_date.year
-            month = self.next_check_date.month
-            day = self.next_check_date.day
-            if any(
-                    (
-                        year > timezone.localdate().year,
-                        all((
-                            year == timezone.localdate().year,
-                            month > timezone.localdate().month,
-                        )),
-                    )
-            ):
-                return self.normal
-            elif all((
-                year == timezone.localdate().year,
-                month == timezone.localdate().month,
-                day > timezone.localdate().day,
-            )):
-                return self.ready
+            return self.status_for_date(self.next_check_date, today or timezone.localdate())
+
+
+class PlaceOccupancy(models.Model):
+    """Сводка по приборам места: сколько их и сколько с каждым статусом и
+    типом. Сигналы при сохранении и удалении прибора переносят его между
+    сводками (move), после массовых update()/bulk_update() места
+    пересчитываются вызовом refresh()"""
+
+    place = models.OneToOneField(Place,
+                                 on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name="occupancy",
+                                 verbose_name="Место")
+    count = models.IntegerField(default=0, verbose_name="Приборов на месте")
+    statuses = models.JSONField(default=dict, verbose_name="Приборов по статусам")
+    device_types = models.JSONField(default=dict, verbose_name="Приборов по типам")
+
+    class Meta:
+        verbose_name = "Занятость места"
+        verbose_name_plural = "Занятость мест"
+
+    def __str__(self):
+        return f"{self.place_id}: {self.count}"
+
+    @classmethod
+    def of(cls, place_id: int):
+        try:
+            return cls.objects.get(place_id=place_id)
+        except cls.DoesNotExist:
+            return cls(place_id=place_id)
+
+    @staticmethod
+    def _summary_key(value) -> str:
+        # ключи JSON - строки, прибор без статуса или типа учитывается под ""
+        return "" if value is None else str(value)
+
+    def other_statuses(self, status) -> list:
+        """Статусы приборов места, кроме одного прибора со статусом status"""
+
+        statuses = [key or None for key, count in self.statuses.items() for _ in range(count)]
+        if status in statuses:
+            statuses.remove(status)
+        return statuses
+
+    def has_device_type(self, device_type_id) -> bool:
+        return self._summary_key(device_type_id) in self.device_types
+
+    def add(self, status, device_type_id, delta: int):
+        self.count += delta
+        for summary, value in ((self.statuses, status), (self.device_types, device_type_id)):
+            key = self._summary_key(value)
+            summary[key] = summary.get(key, 0) + delta
+            if not summary[key]:
+                del summary[key]
+
+    @classmethod
+    def move(cls, changes):
+        """Переносит приборы между сводками: changes - пары (прежний ключ,
+        новый ключ) Device.occupancy_key, None - прибор не на месте"""
+
+        deltas = {}
+        for old_key, new_key in changes:
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                deltas[old_key] = deltas.get(old_key, 0) - 1
+            if new_key is not None:
+                deltas[new_key] = deltas.get(new_key, 0) + 1
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        with serialized_write():
+            rows = {row.place_id: row for row in cls.objects.select_for_update().filter(
+                place_id__in={place_id for place_id, _, _ in deltas},
+            )}
+            missing = set()
+            for (place_id, status, device_type_id), delta in deltas.items():
+                if place_id in rows:
+                    rows[place_id].add(status, device_type_id, delta)
+                else:
+                    missing.add(place_id)
+            cls.objects.bulk_update(rows.values(), ["count", "statuses", "device_types"])
+            # сводки еще нет (первый прибор на месте) - считается по приборам
+            cls.refresh(missing)
+
+    @classmethod
+    def update_devices(cls, devices):
+        """Учитывает изменения сохраненных приборов. Прежний ключ известен
+        у приборов, загруженных из базы с местом, статусом и типом, для
+        остальных прежнее и новое места пересчитываются целиком"""
+
+        changes, places = [], set()
+        for device in devices:
+            key = device.occupancy_key
+            if hasattr(device, "_loaded_occupancy_key"):
+                changes.append((device._loaded_occupancy_key, key))
             else:
-                return self.overdue
+                places |= {getattr(device, "_loaded_place_id", None), device.mounting_address_id}
+            device._loaded_occupancy_key = key
+            device._loaded_place_id = device.mounting_address_id
+        cls.move(changes)
+        cls.refresh(places)
+
+    @classmethod
+    def refresh(cls, place_ids):
+        """Пересчитывает сводки мест тремя запросами
+        независимо от их количества"""
+
+        place_ids = {place_id for place_id in place_ids if place_id}
+        if not place_ids:
+            return
+
+        occupancy = {place_id: cls(place_id=place_id) for place_id in place_ids}
+        for row in Device.objects.filter(
+            mounting_address_id__in=place_ids,
+        ).values("mounting_address_id", "status", "device_type_id").annotate(count=Count("pk")).order_by():
+            occupancy[row["mounting_address_id"]].add(row["status"], row["device_type_id"], row["count"])
+
+        existing_places = set(Place.objects.filter(pk__in=place_ids).values_list("pk", flat=True))
+        cls.objects.bulk_create(
+            [summary for place_id, summary in occupancy.items() if place_id in existing_places],
+            update_conflicts=True,
+            unique_fields=["place_id"],
+            update_fields=["count", "statuses", "device_types"],
+        )
+
+
+class ReplacementCalendar(models.Model):
+    """Число приборов с датой следующей проверки в месяце по станциям и
+    типам - календарь замен для фильтров по году и месяцу. Обновляется
+    сигналами при сохранении и удалении приборов, после массовых записей -
+    вызовом refresh() или rebuild(). Значения суммируются (Sum), поэтому
+    повтор ячейки с пустой станцией не искажает итог"""
+
+    year = models.PositiveSmallIntegerField(verbose_name="Год")
+    month = models.PositiveSmallIntegerField(verbose_name="Месяц")
+    station = models.ForeignKey(Station, null=True, blank=True, on_delete=models.CASCADE, verbose_name="Станция")
+    device_type = models.ForeignKey(Tipe, on_delete=models.CASCADE, verbose_name="Тип прибора")
+    count = models.IntegerField(default=0, verbose_name="Приборов")
+
+    class Meta:
+        verbose_name = "Календарь замен"
+        verbose_name_plural = "Календарь замен"
+        constraints = [
+            models.UniqueConstraint(fields=["year", "month", "station", "device_type"],
+                                    name="arm_calendar_cell_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.month:02}.{self.year}: {self.count}"
+
+    @classmethod
+    def move(cls, changes):
+        """Переносит приборы между ячейками: changes - пары (прежняя ячейка,
+        новая ячейка), None - вне календаря. Изменения одной ячейки
+        складываются, поэтому число запросов зависит от числа ячеек"""
+
+        deltas = {}
+        for old_key, new_key in changes:
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                deltas[old_key] = deltas.get(old_key, 0) - 1
+            if new_key is not None:
+                deltas[new_key] = deltas.get(new_key, 0) + 1
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if deltas:
+            cls._apply(deltas)
+
+    @classmethod
+    def update_devices(cls, devices):
+        """Учитывает изменения сохраненных приборов. Прежняя ячейка известна
+        у приборов, загруженных из базы со всеми нужными полями, для
+        остальных месяц новой ячейки пересчитывается целиком"""
+
+        changes, months = [], set()
+        for device in devices:
+            key = device.calendar_key
+            if hasattr(device, "_loaded_calendar_key"):
+                changes.append((device._loaded_calendar_key, key))
+            elif key is not None:
+                months.add(key[:2])
+            device._loaded_calendar_key = key
+        cls.move(changes)
+        cls.refresh(months)
+
+    @staticmethod
+    def _key(cell) -> tuple:
+        return cell.year, cell.month, cell.station_id, cell.device_type_id
+
+    @classmethod
+    def _apply(cls, deltas: dict):
+        """Прибавляет deltas {ячейка: изменение} тремя запросами: чтение
+        ячеек, UPDATE count = count + изменение и вставка новых ячеек"""
+
+        keys = Q()
+        for year, month, station_id, device_type_id in deltas:
+            keys |= Q(year=year, month=month, station_id=station_id, device_type_id=device_type_id)
+        cells = {cls._key(cell): cell for cell in cls.objects.filter(keys)}
+
+        changed, created = [], []
+        for key, delta in deltas.items():
+            if key in cells:
+                cells[key].count = F("count") + delta
+                changed.append(cells[key])
+            elif delta > 0:
+                year, month, station_id, device_type_id = key
+                created.append(cls(year=year, month=month, station_id=station_id,
+                                   device_type_id=device_type_id, count=delta))
+
+        cls.objects.bulk_update(changed, ["count"])
+        if not created:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(created)
+        except IntegrityError:
+            # ячейки одновременно создал другой запрос
+            cls.refresh(key[:2] for key in deltas)
+
+    @staticmethod
+    def _cells(devices):
+        return devices.filter(next_check_date__isnull=False).annotate(
+            year=ExtractYear("next_check_date"),
+            month=ExtractMonth("next_check_date"),
+        ).values("year", "month", "station_id", "device_type_id").annotate(count=Count("pk")).order_by()
+
+    @classmethod
+    def refresh(cls, months):
+        """Пересчитывает месяцы [(год, месяц)] целиком, по одному запросу на месяц"""
+
+        for year, month in set(months):
+            start = date(year, month, 1)
+            cells = cls._cells(Device.objects.filter(next_check_date__gte=start,
+                                                     next_check_date__lt=next_month_start(start)))
+            with transaction.atomic():
+                cls.objects.filter(year=year, month=month).delete()
+                cls.objects.bulk_create([cls(**cell) for cell in cells])
+
+    @classmethod
+    def rebuild(cls):
+        cells = cls._cells(Device.objects.all())
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([cls(**cell) for cell in cells], batch_size=1_000)
+
 
-    
 class MechanicReport(models.Model):
     title = models.CharField(max_length=30, verbose_name="Заголовок", blank=True, help_text="Краткое пояснение, "
                                                             "например 'просрок', 'заменить в этом месяце' и т.д. "
@@ -401,3 +897,163 @@ class DeviceKipReport(models.Model):
     def __str__(self):
         return f"{self.device} на {self.station}({self.mounting_address})"
 
+
+class SyncMarker(models.Model):
+    key = models.CharField(max_length=50, unique=True, verbose_name="Ключ")
+    value = models.BigIntegerField(default=0, verbose_name="Значение")
+    updated = models.DateTimeField(auto_now=True, verbose_name="Изменен")
+
+    class Meta:
+        verbose_name = "Служебная отметка"
+        verbose_name_plural = "Служебные отметки"
+
+    def __str__(self):
+        return f"{self.key}={self.value}"
+
+
+class ExportJob(models.Model):
+    pending = "в очереди"
+    running = "выполняется"
+    done = "готово"
+    failed = "ошибка"
+
+    CHOICES = [
+        (pending, "в очереди"),
+        (running, "выполняется"),
+        (done, "готово"),
+        (failed, "ошибка"),
+    ]
+
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, verbose_name="Пользователь")
+    model_label = models.CharField(max_length=100, verbose_name="Раздел")
+    query = models.BinaryField(editable=False)
+    fields = models.JSONField(default=list, verbose_name="Колонки")
+    cache_key = models.CharField(max_length=64, db_index=True, editable=False)
+    status = models.CharField(max_length=20, choices=CHOICES, default=pending, verbose_name="Статус")
+    total = models.PositiveIntegerField(default=0, verbose_name="Всего строк")
+    processed = models.PositiveIntegerField(default=0, verbose_name="Обработано строк")
+    file_name = models.CharField(max_length=255, blank=True, verbose_name="Файл")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created = models.DateTimeField(auto_now_add=True, editable=False, verbose_name="Создан")
+    started = models.DateTimeField(null=True, blank=True, verbose_name="Начат")
+    finished = models.DateTimeField(null=True, blank=True, verbose_name="Завершен")
+
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+
+    def __str__(self):
+        return f"Выгрузка N {self.pk} ({self.status})"
+
+    def get_progress(self):
+        if self.status == self.done:
+            return 100
+        if not self.total:
+            return 0
+        return min(99, self.processed * 100 // self.total)
+
+
+class SwapSession(models.Model):
+    """Приборы, уже использованные для замен по отчету механика.
+    Хранится в базе, поэтому одинакова для всех процессов gunicorn.
+    Сессии старше SWAP_SESSION_TTL секунд считаются пустыми,
+    а всего хранится не больше SWAP_SESSION_MAX сессий"""
+
+    mech_report = models.OneToOneField(MechanicReport,
+                                       on_delete=models.CASCADE,
+                                       primary_key=True,
+                                       verbose_name="Отчет механика")
+    device_ids = models.JSONField(default=list, verbose_name="Использованные приборы")
+    touched = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменен")
+
+    class Meta:
+        verbose_name = "Сессия замен"
+        verbose_name_plural = "Сессии замен"
+
+    def __str__(self):
+        return f"Замены по отчету N {self.mech_report_id}"
+
+    @classmethod
+    def find_or_create(cls, mech_report_id: int):
+        session, created = cls.objects.get_or_create(mech_report_id=mech_report_id)
+
+        if created:
+            cls.prune(keep=session.pk)
+        elif session.is_expired():
+            session.device_ids = []
+            session.save(update_fields=["device_ids", "touched"])
+
+        return session
+
+    @classmethod
+    def prune(cls, keep: int):
+        sessions = cls.objects.exclude(pk=keep)
+        cutoff = timezone.now() - timedelta(seconds=settings.SWAP_SESSION_TTL)
+        sessions.filter(touched__lt=cutoff).delete()
+
+        overflow = sessions.order_by("-touched").values_list("pk", flat=True)[max(settings.SWAP_SESSION_MAX - 1, 0):]
+        sessions.filter(pk__in=list(overflow)).delete()
+
+    def is_expired(self) -> bool:
+        return self.touched < timezone.now() - timedelta(seconds=settings.SWAP_SESSION_TTL)
+
+    def add(self, device_id: int):
+        with transaction.atomic():
+            session = self.__class__.objects.select_for_update().get(pk=self.pk)
+            if device_id not in session.device_ids:
+                session.device_ids.append(device_id)
+                session.save(update_fields=["device_ids", "touched"])
+        self.device_ids = session.device_ids
+
+
+class RequestQueryLog(models.Model):
+    """Запросы к базе во время одного HTTP-запроса (ARM.middleware.QueryStatsMiddleware).
+    Сохраняются только запросы, превысившие бюджет или пороги QUERY_LOG_MIN_*"""
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Время")
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=255, verbose_name="Адрес")
+    view_name = models.CharField(max_length=200, db_index=True, verbose_name="Представление")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Код ответа")
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, verbose_name="Пользователь")
+    queries = models.PositiveIntegerField(verbose_name="Запросов к базе")
+    duplicates = models.PositiveIntegerField(default=0, verbose_name="Повторов")
+    sql_ms = models.FloatField(verbose_name="Время SQL, мс")
+    duration_ms = models.FloatField(verbose_name="Время ответа, мс")
+    budget = models.PositiveIntegerField(null=True, blank=True, verbose_name="Бюджет запросов")
+    slowest = models.JSONField(default=list, verbose_name="Самые долгие запросы")
+
+    class Meta:
+        verbose_name = "Статистика запросов"
+        verbose_name_plural = "Статистика запросов"
+
+    def __str__(self):
+        return f"{self.method} {self.path}: {self.queries}"
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+
+class RequestProfile(models.Model):
+    """Профиль одного HTTP-запроса (ARM.middleware.ProfilerMiddleware).
+    Сам профиль - архив file_name в PROFILE_ROOT"""
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Время")
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=255, verbose_name="Адрес")
+    view_name = models.CharField(max_length=200, verbose_name="Представление")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Код ответа")
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, verbose_name="Пользователь")
+    duration_ms = models.FloatField(verbose_name="Время ответа, мс")
+    queries = models.PositiveIntegerField(verbose_name="Запросов к базе")
+    sql_ms = models.FloatField(verbose_name="Время SQL, мс")
+    memory_peak_kb = models.PositiveIntegerField(verbose_name="Пик памяти, КБ")
+    file_name = models.CharField(max_length=255, blank=True, verbose_name="Файл")
+
+    class Meta:
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+
+    def __str__(self):
+        return f"Профиль N {self.pk}: {self.method} {self.path}"
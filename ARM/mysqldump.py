@@ -0,0 +1,178 @@
+import gzip
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+
+# mysqldump пишет каждую команду INSERT одной строкой (переводы строк
+# внутри значений экранируются), поэтому дамп читается построчно и в
+# памяти одновременно находится не больше одной команды (net_buffer_length)
+TOKEN = re.compile(r"""\s*(?:
+      '(?P<string>(?:[^'\\]+|\\.|'')*)'
+    | (?P<null>NULL)
+    | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | 0x(?P<hex>[0-9A-Fa-f]*)
+    | _binary\s*'(?P<binary>(?:[^'\\]+|\\.|'')*)'
+    | (?P<punct>[(),;])
+)""", re.VERBOSE | re.DOTALL)
+ESCAPE = re.compile(r"\\(.)|''", re.DOTALL)
+ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+COLUMN = re.compile(r"^\s*`(?P<name>[^`]+)`\s+(?P<type>\w+)")
+SET_NAMES = re.compile(r"SET NAMES (\w+)")
+CHARSETS = {"utf8": "utf-8", "utf8mb3": "utf-8", "utf8mb4": "utf-8", "cp1251": "cp1251", "latin1": "cp1252"}
+
+
+class DumpError(ValueError):
+    """Дамп не удалось разобрать"""
+
+
+def _unescape(value: str) -> str:
+    if "\\" not in value and "''" not in value:
+        return value
+    return ESCAPE.sub(lambda match: ESCAPES.get(match[1], match[1]) if match[1] is not None else "'", value)
+
+
+def _date(value: str):
+    # нулевые даты ('0000-00-00') остаются строкой, как их отдает pymysql
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+def _datetime(value: str):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+CONVERTERS = {
+    **dict.fromkeys(("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year"), int),
+    **dict.fromkeys(("decimal", "numeric"), Decimal),
+    **dict.fromkeys(("float", "double", "real"), float),
+    "date": _date,
+    **dict.fromkeys(("datetime", "timestamp"), _datetime),
+}
+
+
+def open_dump(path):
+    """Файл дампа в двоичном режиме, .gz распознается по сигнатуре"""
+
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def parse_values(statement: str, start: int = 0):
+    """Кортежи значений из 'VALUES (...),(...);' начиная с позиции start"""
+
+    row, position, length = None, start, len(statement)
+    while position < length:
+        match = TOKEN.match(statement, position)
+        if not match:
+            if statement[position:].strip():
+                raise DumpError(f"Не удалось разобрать значение: {statement[position:position + 40]!r}")
+            break
+        position = match.end()
+        kind = match.lastgroup
+
+        if kind == "punct":
+            punct = match["punct"]
+            if punct == "(":
+                row = []
+            elif punct == ")":
+                yield row
+                row = None
+            elif punct == ";":
+                break
+            continue
+        if row is None:
+            raise DumpError(f"Значение вне скобок: {match[0]!r}")
+
+        if kind == "string":
+            row.append(_unescape(match["string"]))
+        elif kind == "null":
+            row.append(None)
+        elif kind == "number":
+            row.append(match["number"])
+        elif kind == "hex":
+            row.append(bytes.fromhex(match["hex"]))
+        else:
+            row.append(_unescape(match["binary"]).encode("latin-1", errors="replace"))
+
+
+class TableReader:
+    """Потоково читает строки одной таблицы из дампа mysqldump.
+    Порядок и типы колонок берутся из CREATE TABLE в том же дампе;
+    columns задает, какие колонки и в каком порядке попадут в кортеж"""
+
+    def __init__(self, path, table: str, columns=None, encoding: str = None):
+        self.path = path
+        self.table = table
+        self.columns = columns
+        self.encoding = encoding
+        self.table_columns = []
+        self.converters = []
+
+    def __iter__(self):
+        encoding = self.encoding or "utf-8"
+        create_prefix = f"CREATE TABLE `{self.table}`".encode()
+        insert_prefix = f"INSERT INTO `{self.table}`".encode()
+        in_create = False
+        projection = None
+
+        with open_dump(self.path) as file:
+            for raw_line in file:
+                if in_create:
+                    line = raw_line.decode(encoding)
+                    if line.startswith(")"):
+                        in_create = False
+                        projection = self._projection()
+                    elif column := COLUMN.match(line):
+                        self.table_columns.append(column["name"])
+                        self.converters.append(CONVERTERS.get(column["type"].lower()))
+                    continue
+
+                if raw_line.startswith(insert_prefix):
+                    line = raw_line.decode(encoding)
+                    values = line.find(" VALUES ", len(insert_prefix))
+                    if values < 0:
+                        raise DumpError(f"Нет VALUES в команде {line[:60]!r}")
+                    columns_list = line[len(insert_prefix):values].strip()
+                    if columns_list:
+                        # дамп с --complete-insert: список колонок в каждой команде
+                        projection = self._projection(re.findall(r"`([^`]+)`", columns_list))
+                    if projection is None:
+                        raise DumpError(f"В дампе нет CREATE TABLE `{self.table}`")
+                    yield from self._rows(line, values + len(" VALUES "), projection)
+                elif raw_line.startswith(create_prefix):
+                    in_create = True
+                    self.table_columns, self.converters = [], []
+                elif not self.encoding and raw_line.startswith(b"/*!40101 SET NAMES"):
+                    charset = SET_NAMES.search(raw_line.decode("ascii", errors="replace"))
+                    if charset:
+                        encoding = CHARSETS.get(charset[1].lower(), encoding)
+
+    def _projection(self, present=None):
+        """[(индекс в команде INSERT, преобразователь)] для нужных колонок.
+        Имена колонок, как и в MySQL, сравниваются без учета регистра"""
+
+        present = [name.lower() for name in present or self.table_columns]
+        converters = {name.lower(): convert for name, convert in zip(self.table_columns, self.converters)}
+        wanted = [name.lower() for name in self.columns] if self.columns else present
+        missing = set(wanted) - set(present)
+        if missing:
+            raise DumpError(f"В таблице `{self.table}` нет колонок: {', '.join(sorted(missing))}")
+        return [(present.index(name), converters.get(name)) for name in wanted]
+
+    @staticmethod
+    def _rows(line: str, start: int, projection):
+        for values in parse_values(line, start):
+            row = []
+            for index, convert in projection:
+                value = values[index]
+                if value is not None and convert is not None and not isinstance(value, bytes):
+                    value = convert(value)
+                row.append(value)
+            yield tuple(row)
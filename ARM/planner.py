@@ -0,0 +1,205 @@
+from datetime import date
+
+from .db import serialized_write
+from .models import (Device,
+                     DeviceKipReport,
+                     KipReport,
+                     MechanicReport,
+                     PlaceOccupancy,
+                     ReplacementCalendar,
+                     Station)
+from .topology import get_topology
+
+
+DEVICE_LABEL_RELATED = (
+    "device_type",
+    "mounting_address__rack__station",
+    "avz__station",
+)
+
+
+class MechReportPlanner:
+    """Распределяет приборы отправленного ящика КИП по отчетам
+    механиков станций. Данные загружаются фиксированным числом
+    запросов, распределение считается в памяти, а запись выполняется
+    пакетно в одной транзакции"""
+
+    def __init__(self, kip_report: KipReport):
+        self.kip_report = kip_report
+        self.rows: list[DeviceKipReport] = []
+        self.stations: dict[int, list[Device]] = {}
+        self._planned = False
+        self.topology = get_topology()
+
+    def _is_other_place(self, device: Device) -> bool:
+        return self.topology.is_other_place(device.mounting_address_id)
+
+    @staticmethod
+    def _replace_order(device: Device):
+        return device.next_check_date or date.min, device.pk
+
+    def _load_rows(self):
+        self.rows = list(
+            DeviceKipReport.objects.filter(
+                kip_report=self.kip_report,
+            ).select_related(
+                "device",
+                *(f"device__{field}" for field in DEVICE_LABEL_RELATED),
+            ).order_by("pk")
+        )
+
+    def _load_avz_candidates(self) -> dict[tuple, list[Device]]:
+        avz_ids = {row.device.avz_id for row in self.rows if row.device.avz_id}
+        if not avz_ids:
+            return {}
+
+        candidates = Device.objects.filter(
+            avz_id__in=avz_ids,
+        ).exclude(
+            status__in=[Device.send, Device.in_progress],
+        ).exclude(
+            pk__in=DeviceKipReport.objects.filter(
+                kip_report=self.kip_report,
+            ).values("device_id"),
+        ).select_related(*DEVICE_LABEL_RELATED)
+
+        groups = {}
+        for device in candidates:
+            groups.setdefault((device.avz_id, device.device_type_id), []).append(device)
+        for devices in groups.values():
+            devices.sort(key=self._replace_order)
+        return groups
+
+    def _load_place_devices(self) -> dict[int, list[Device]]:
+        place_ids = {
+            row.device.mounting_address_id
+            for row in self.rows
+            if row.device.mounting_address_id
+            and not row.device.avz_id
+            and not self._is_other_place(row.device)
+        }
+        if not place_ids:
+            return {}
+
+        devices_on_places = {}
+        for device in Device.objects.filter(
+            mounting_address_id__in=place_ids,
+        ).select_related(*DEVICE_LABEL_RELATED):
+            devices_on_places.setdefault(device.mounting_address_id, []).append(device)
+        return devices_on_places
+
+    def _prepare_box_device(self, row: DeviceKipReport):
+        device = row.device
+        device.status = Device.send
+        device.who_checked_id = row.who_checked_id
+        device.who_prepared_id = row.who_prepared_id
+        device.current_check_date = row.check_date
+        device.next_check_date = device.get_next_check_date()
+
+    def _pick_device(self, device: Device, avz_candidates, place_devices) -> Device:
+        if device.avz_id:
+            candidates = avz_candidates.get((device.avz_id, device.device_type_id))
+            return candidates.pop(0) if candidates else device
+
+        # прибор без адреса идет в отчет сам: прежний поиск по
+        # mounting_address=None подбирал ему любой неустановленный прибор
+        if device.mounting_address_id is None or self._is_other_place(device):
+            return device
+
+        other_devices_on_place = [
+            other_device
+            for other_device in place_devices.get(device.mounting_address_id, ())
+            if other_device.pk != device.pk
+            and other_device.station_id == device.station_id
+            and other_device.device_type_id == device.device_type_id
+        ]
+        if len(other_devices_on_place) == 1:
+            return other_devices_on_place[0]
+        return device
+
+    def plan(self) -> dict[int, list[Device]]:
+        """Возвращает распределение приборов по станциям,
+        ничего не записывая в базу"""
+
+        if self._planned:
+            return self.stations
+
+        self._load_rows()
+        avz_candidates = self._load_avz_candidates()
+        place_devices = self._load_place_devices()
+
+        added_devices = set()
+        for row in self.rows:
+            self._prepare_box_device(row)
+            mech_device = self._pick_device(row.device, avz_candidates, place_devices)
+            if mech_device.pk in added_devices:
+                continue
+            added_devices.add(mech_device.pk)
+            station_id = mech_device.station_id or row.device.station_id or row.station_id
+            self.stations.setdefault(station_id, []).append(mech_device)
+
+        self._planned = True
+        return self.stations
+
+    def preview(self) -> list[dict]:
+        stations = Station.objects.in_bulk(list(self.plan()))
+        return [
+            {
+                "station_id": station_id,
+                "station": str(stations.get(station_id, "--")),
+                "devices": [
+                    {"id": device.pk, "label": str(device)}
+                    for device in devices
+                ],
+            }
+            for station_id, devices in self.stations.items()
+        ]
+
+    @serialized_write()
+    def execute(self, user) -> list[MechanicReport]:
+        """Записывает приборы ящика, отчеты механиков и связи
+        между ними пакетными запросами"""
+
+        self.plan()
+        stations = Station.objects.in_bulk(list(self.stations))
+        kip_report_id = self.kip_report.pk
+
+        Device.objects.bulk_update_checked(
+            [row.device for row in self.rows],
+            [
+                "status",
+                "who_checked",
+                "who_prepared",
+                "current_check_date",
+                "next_check_date",
+            ],
+        )
+        PlaceOccupancy.refresh(row.device.mounting_address_id for row in self.rows)
+        ReplacementCalendar.update_devices(row.device for row in self.rows)
+
+        planned = [
+            (stations[station_id], devices)
+            for station_id, devices in self.stations.items()
+            if devices and station_id in stations
+        ]
+        reports = MechanicReport.objects.bulk_create([
+            MechanicReport(
+                title=f"КИП N {kip_report_id} ({station})",
+                user=user,
+                station=station,
+                explanation=f"Отправленный ящик из отчета КИП №{kip_report_id}. "
+                            f"Сформированно автоматически",
+            )
+            for station, _ in planned
+        ])
+
+        through_model = MechanicReport.devices.through
+        through_model.objects.bulk_create([
+            through_model(mechanicreport_id=report.pk, device_id=device.pk)
+            for report, (_, devices) in zip(reports, planned)
+            for device in devices
+        ])
+
+        self.kip_report.editable = False
+        self.kip_report.save(update_fields=["editable", "modified"])
+        return reports
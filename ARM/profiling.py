@@ -0,0 +1,174 @@
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+import traceback
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import RequestProfile
+
+
+# tracemalloc и профилировщик общие для процесса,
+# поэтому одновременно профилируется только один запрос
+_lock = threading.Lock()
+
+APP_DIR = str(Path(__file__).resolve().parent)
+
+
+class SqlTimeline:
+    """Обертка connection.execute_wrapper: каждый запрос к базе со
+    смещением от начала HTTP-запроса и местом вызова в коде ARM"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "start_ms": round((started - self.started) * 1000, 2),
+                "ms": round((time.perf_counter() - started) * 1000, 2),
+                "sql": sql,
+                "where": self._caller(),
+            })
+
+    @staticmethod
+    def _caller() -> str:
+        for frame in reversed(traceback.extract_stack()[:-2]):
+            if frame.filename.startswith(APP_DIR) and not frame.filename.endswith("profiling.py"):
+                return f"{Path(frame.filename).name}:{frame.lineno} {frame.name}"
+        return ""
+
+    @property
+    def duration(self) -> float:
+        return sum(query["ms"] for query in self.queries)
+
+
+class RequestProfiler:
+    """Снимает профиль процессора (cProfile), хронологию запросов к базе
+    и распределение памяти (tracemalloc) на время вызова get_response"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def run(self, get_response):
+        started = time.perf_counter()
+        self.timeline = SqlTimeline(started)
+        self.profile = cProfile.Profile()
+        own_tracing = not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start(settings.PROFILE_TRACEBACK_FRAMES)
+        tracemalloc.reset_peak()
+        try:
+            with connection.execute_wrapper(self.timeline):
+                self.profile.enable()
+                try:
+                    response = get_response(self.request)
+                finally:
+                    self.profile.disable()
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            self.snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+        finally:
+            if own_tracing:
+                tracemalloc.stop()
+        self.duration = time.perf_counter() - started
+        return response
+
+    def cpu_report(self, limit: int = 60) -> str:
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def memory_report(self, limit: int = 40) -> str:
+        lines = [f"Пик: {self.memory_peak // 1024} КБ", ""]
+        for stat in self.snapshot.statistics("lineno")[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size // 1024:>8} КБ {stat.count:>8} блоков  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines)
+
+    def save(self, response) -> RequestProfile:
+        match = getattr(self.request, "resolver_match", None)
+        user = getattr(self.request, "user", None)
+        profile = RequestProfile.objects.create(
+            method=self.request.method,
+            path=self.request.path[:255],
+            view_name=((match.view_name or match._func_path) if match else "")[:200],
+            status_code=response.status_code,
+            user=user if user and user.is_authenticated else None,
+            duration_ms=round(self.duration * 1000, 2),
+            queries=len(self.timeline.queries),
+            sql_ms=round(self.timeline.duration, 2),
+            memory_peak_kb=self.memory_peak // 1024,
+        )
+        profile.file_name = f"profile-{profile.pk}-{timezone.localtime(profile.created):%Y%m%d-%H%M%S}.zip"
+
+        root = Path(settings.PROFILE_ROOT)
+        root.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(root / profile.file_name, "w", zipfile.ZIP_DEFLATED) as archive:
+            # cpu.prof открывается pstats, snakeviz и т.п.
+            self.profile.create_stats()
+            archive.writestr("cpu.prof", marshal.dumps(self.profile.stats))
+            archive.writestr("cpu.txt", self.cpu_report())
+            archive.writestr("sql.json", json.dumps(self.timeline.queries, indent=1, ensure_ascii=False))
+            archive.writestr("memory.txt", self.memory_report())
+        profile.save(update_fields=["file_name"])
+
+        purge_profiles()
+        return profile
+
+
+def profile_requested(request) -> bool:
+    return (settings.PROFILE_PARAM in request.GET
+            or settings.PROFILE_HEADER in request.META) and request.user.is_staff
+
+
+def try_lock() -> bool:
+    return _lock.acquire(blocking=False)
+
+
+def release_lock():
+    _lock.release()
+
+
+def profile_path(profile: RequestProfile) -> Path:
+    return Path(settings.PROFILE_ROOT) / profile.file_name
+
+
+def read_profile_file(profile: RequestProfile, name: str) -> str | None:
+    try:
+        with zipfile.ZipFile(profile_path(profile)) as archive:
+            return archive.read(name).decode("utf-8")
+    except (FileNotFoundError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def purge_profiles() -> int:
+    """Удаляет профили старше PROFILE_KEEP_DAYS и сверх PROFILE_KEEP_COUNT последних"""
+
+    expired = list(RequestProfile.objects.filter(
+        created__lt=timezone.now() - timedelta(days=settings.PROFILE_KEEP_DAYS),
+    ))
+    expired += RequestProfile.objects.exclude(
+        pk__in=[profile.pk for profile in expired],
+    ).order_by("-created", "-pk")[settings.PROFILE_KEEP_COUNT:]
+
+    for profile in expired:
+        if profile.file_name:
+            profile_path(profile).unlink(missing_ok=True)
+    return RequestProfile.objects.filter(pk__in=[profile.pk for profile in expired]).delete()[0]
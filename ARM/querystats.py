@@ -0,0 +1,73 @@
+import heapq
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+
+class QueryStats:
+    """Обертка connection.execute_wrapper: число запросов, общее время SQL,
+    самые долгие запросы и повторы одного и того же запроса (признак N+1)"""
+
+    def __init__(self, slowest: int = None):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_limit = settings.QUERY_LOG_SLOWEST if slowest is None else slowest
+        self._slowest = []
+        self._statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self._statements[sql] += 1
+            entry = (elapsed, self.count, sql)
+            if len(self._slowest) < self.slowest_limit:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    @property
+    def duplicates(self) -> int:
+        return self.count - len(self._statements)
+
+    def slowest(self) -> list[dict]:
+        return [
+            {"sql": sql[:1_000], "ms": round(elapsed * 1000, 2), "repeats": self._statements[sql]}
+            for elapsed, _, sql in sorted(self._slowest, reverse=True)
+        ]
+
+    def most_repeated(self, limit: int = 3) -> list[tuple[str, int]]:
+        return [(sql[:300], count) for sql, count in self._statements.most_common(limit) if count > 1]
+
+
+def budget_for(view_name: str) -> int | None:
+    return settings.QUERY_BUDGETS.get(view_name)
+
+
+@contextmanager
+def capture_query_stats(using=connection):
+    stats = QueryStats()
+    with using.execute_wrapper(stats):
+        yield stats
+
+
+class QueryBudgetMixin:
+    """Для тестов: ответ страницы укладывается в бюджет запросов
+    QUERY_BUDGETS ее представления. Статистику к ответу прикрепляет
+    QueryStatsMiddleware"""
+
+    def assertWithinQueryBudget(self, response):
+        stats = response.query_stats
+        if stats["budget"] is None:
+            self.fail(f"Для {stats['view_name']} не задан бюджет запросов в QUERY_BUDGETS")
+        if stats["queries"] > stats["budget"]:
+            repeated = "\n".join(f"  {count} x {sql}" for sql, count in stats["most_repeated"])
+            self.fail(f"{stats['view_name']}: {stats['queries']} запросов при бюджете {stats['budget']}\n"
+                      f"Повторяющиеся запросы:\n{repeated}")
@@ -0,0 +1,40 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+# таблица FTS5 на SQLite, создается миграцией 0016_device_search
+SEARCH_TABLE = "arm_device_search"
+
+
+def search_terms(search_term: str) -> list[str]:
+    """Слова запроса: 'НМШ1-400 12' -> ['нмш1', '400', '12']"""
+
+    return re.findall(r"\w+", search_term.casefold())
+
+
+def search_devices(queryset, search_term: str):
+    """Приборы, у которых название, инвентарный номер или тип содержат
+    слова, начинающиеся с каждого слова запроса"""
+
+    terms = search_terms(search_term)
+    if not terms:
+        return queryset
+
+    if connection.vendor == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", (match,))
+        )
+
+    # триграммы не различают начало слова, поэтому на PostgreSQL
+    # слово ищется как подстрока; icontains идет по индексам UPPER(...)
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term)
+            | Q(inventory_number__icontains=term)
+            | Q(device_type__name__icontains=term)
+        )
+    return queryset
@@ -0,0 +1,65 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Device, Place, PlaceOccupancy, Rack, ReplacementCalendar, Station
+from .topology import invalidate_topology
+
+
+@receiver(post_save, sender=Device)
+def update_place_occupancy(sender, instance, created, **kwargs):
+    """Переносит прибор между сводками мест, если изменились
+    его место, статус или тип"""
+
+    if created:
+        instance._loaded_occupancy_key = None
+    PlaceOccupancy.update_devices([instance])
+
+
+@receiver(post_delete, sender=Device)
+def release_place_occupancy(sender, instance, **kwargs):
+    PlaceOccupancy.move([(getattr(instance, "_loaded_occupancy_key", instance.occupancy_key), None)])
+
+
+@receiver(post_save, sender=Device)
+def update_replacement_calendar(sender, instance, created, **kwargs):
+    """Переносит прибор в календаре замен, если изменились дата
+    следующей проверки, станция или тип"""
+
+    if created:
+        instance._loaded_calendar_key = None
+    ReplacementCalendar.update_devices([instance])
+
+
+@receiver(post_delete, sender=Device)
+def remove_from_replacement_calendar(sender, instance, **kwargs):
+    ReplacementCalendar.move([(getattr(instance, "_loaded_calendar_key", instance.calendar_key), None)])
+
+
+@receiver(post_save, sender=Rack)
+def refresh_place_addresses(sender, instance, **kwargs):
+    """Номер или станция статива входят в ключ адреса его мест"""
+
+    places = list(instance.place_set.all())
+    for place in places:
+        place.fill_address(instance)
+    Place.objects.bulk_update(places, ["station", "address_key"], batch_size=1000)
+
+
+@receiver(post_save, sender=Place)
+def fill_loaded_place_address(sender, instance, raw=False, **kwargs):
+    """loaddata сохраняет места в обход Place.save()"""
+
+    if raw:
+        instance.fill_address(Rack.objects.get(pk=instance.rack_id))
+        Place.objects.filter(pk=instance.pk).update(station=instance.station_id,
+                                                    address_key=instance.address_key)
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+@receiver(post_save, sender=Rack)
+@receiver(post_delete, sender=Rack)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def reset_topology(sender, **kwargs):
+    invalidate_topology()
@@ -9,8 +9,12 @@ function send_devices_ajax(kipreport_id) {
             console.log("Device status updated");
             location.reload();
         },
-        error: function(err) {
+        error: function(xhr, status, err) {
             console.error("Error updating device status:", err);
+            if (xhr.status === 409 && xhr.responseJSON) {
+                alert(xhr.responseJSON.message);
+                location.reload();
+            }
         }
     });
 }
\ No newline at end of file
@@ -1,4 +1,4 @@
-function update_device_ajax(device_id) {
+function update_device_ajax(device_id, version) {
     const csrf_token = document.getElementsByName("csrfmiddlewaretoken")[0].value;
     const url = "/arm/device/update/" + device_id + "/";
     let title = document.getElementsByName("title");
@@ -15,7 +15,8 @@ function update_device_ajax(device_id) {
         type: "POST",
         url: url,
         data: {"csrfmiddlewaretoken": csrf_token,
-                "kip_report_id": kip_report_id},
+                "kip_report_id": kip_report_id,
+                "version": version},
         success: function(data) {
             if (data){
                if (data.success) {
@@ -36,6 +37,11 @@ function update_device_ajax(device_id) {
         },
         error: function(xhr, status, err) {
             console.error("Error updating device defect:", err);
+            if (xhr.status === 409 && xhr.responseJSON) {
+                alert(xhr.responseJSON.message);
+                location.reload();
+                return
+            }
             alert("Невозможно выполнить действие");
         }
     });
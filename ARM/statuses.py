@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .db import serialized_write
+from .models import Device, SyncMarker, next_month_start
+
+
+STATUS_WATERMARK = "device_statuses"
+
+
+def status_devices():
+    """Приборы, статус которых зависит только от даты следующей проверки"""
+
+    return Device.objects.filter(
+        ~(Q(status=Device.send) | Q(status=Device.in_progress)),
+        stock__isnull=True,
+        next_check_date__isnull=False,
+    )
+
+
+def refresh_device_statuses(today: date = None, full: bool = False) -> int:
+    """Переводит статусы приборов, у которых дата следующей проверки
+    пересекла границу (наступление дня проверки или начало месяца)
+    с момента прошлого запуска. Возвращает количество измененных приборов"""
+
+    today = today or timezone.localdate()
+    marker, _ = SyncMarker.objects.get_or_create(key=STATUS_WATERMARK)
+    last_run = date.fromordinal(marker.value) if marker.value else None
+
+    if last_run == today and not full:
+        return 0
+
+    devices = status_devices()
+
+    if not (full or last_run is None or last_run > today):
+        crossed = Q(next_check_date__gt=last_run, next_check_date__lte=today)
+        if (last_run.year, last_run.month) != (today.year, today.month):
+            crossed |= Q(next_check_date__gt=today, next_check_date__lt=next_month_start(today))
+        devices = devices.filter(crossed)
+
+    with serialized_write():
+        changed = devices.refresh_status(today)
+        marker.value = today.toordinal()
+        marker.save(update_fields=["value", "updated"])
+    return changed
@@ -0,0 +1,50 @@
+from django.db import connection
+from django.db.models import F
+
+from .db import serialized_write
+from .models import Device, DeviceKipReport, KipReport, Tipe
+
+
+def free_stock_devices(device_type: Tipe):
+    """Приборы типа на складе, еще не собранные ни в один открытый ящик"""
+
+    return Device.objects.filter(
+        device_type=device_type,
+        stock__isnull=False,
+    ).exclude(
+        pk__in=DeviceKipReport.objects.filter(
+            kip_report__editable=True,
+        ).values("device_id"),
+    ).order_by("pk")
+
+
+def allocate_stock(kip_report: KipReport,
+                   device_type: Tipe,
+                   quantity: int,
+                   exclude=(),
+                   device_fields: dict = None,
+                   **row_fields) -> tuple[list[int], int]:
+    """Резервирует quantity свободных приборов типа со склада в ящик
+    kip_report одной вставкой строк ящика. Число запросов не зависит
+    от quantity. Возвращает id зарезервированных приборов и нехватку"""
+
+    if quantity <= 0:
+        return [], 0
+
+    # на SQLite serialized_write ставит параллельные распределения в очередь
+    # на блокировке записи, и вторая транзакция видит уже занятые приборы
+    with serialized_write():
+        candidates = free_stock_devices(device_type).exclude(pk__in=list(exclude))
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+
+        device_ids = list(candidates.values_list("pk", flat=True)[:quantity])
+        if device_ids and device_fields:
+            Device.objects.filter(pk__in=device_ids).update(version=F("version") + 1, **device_fields)
+
+        DeviceKipReport.objects.bulk_create([
+            DeviceKipReport(kip_report=kip_report, device_id=device_id, **row_fields)
+            for device_id in device_ids
+        ])
+
+    return device_ids, quantity - len(device_ids)
@@ -1,3 +1,1260 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django_cron.models import CronJobLog
+from openpyxl import load_workbook
+
+from .models import (AVZ,
+                     Device,
+                     Comment,
+                     DeviceKipReport,
+                     DeviceVersionConflict,
+                     ExportJob,
+                     KipReport,
+                     MechanicReport,
+                     Place,
+                     PlaceOccupancy,
+                     Rack,
+                     ReplacementCalendar,
+                     RequestProfile,
+                     RequestQueryLog,
+                     Station,
+                     Stock,
+                     SwapSession,
+                     SyncMarker,
+                     Tipe)
+from .admin import MechanicReportAdmin
+from .cron import ReconcileDeviceStatuses
+from .db import is_locked_error, retry_on_locked
+from .export_excel import ExportExcelAction
+from .inventory import InventoryGenerator
+from .metrics import DEVICE_ACTIONS, Registry
+from .legacy import LegacyImporter, dump_legacy_rows
+from .mysqldump import TableReader
+from .planner import MechReportPlanner
+from .querystats import QueryBudgetMixin
+from .search import search_devices
+from .statuses import refresh_device_statuses, status_devices
+from .stock import allocate_stock, free_stock_devices
+from . import topology
+from .topology import get_topology
+from .views import KipMechReportAdapter
+
+
+class ArmTestCase(TestCase):
+    fixtures = ["stations.json", "stock.json", "avz.json", "types.json"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("kip", password="kip")
+        cls.station = Station.objects.get(pk=1)
+        cls.stock = Stock.objects.get(pk=1)
+        cls.avz = AVZ.objects.get(station=cls.station)
+        cls.tipe = Tipe.objects.first()
+        cls.rack = Rack.objects.create(station=cls.station, number="27")
+        cls.other_rack = Rack.objects.create(station=cls.station, number="релейная")
+        cls.other_place = Place.objects.create(rack=cls.other_rack, number="остальное")
+
+    def create_place(self, number):
+        return Place.objects.create(rack=self.rack, number=str(number))
+
+    def create_device(self, **fields):
+        fields.setdefault("device_type", self.tipe)
+        fields.setdefault("frequency_of_check", 3)
+        return Device.objects.create(**fields)
+
+    def create_box(self, devices, **fields):
+        kip_report = KipReport.objects.create(author=self.user)
+        DeviceKipReport.objects.bulk_create([
+            DeviceKipReport(
+                kip_report=kip_report,
+                device=device,
+                station=self.station,
+                mounting_address="",
+                check_date=date(2023, 5, 10),
+                **fields,
+            )
+            for device in devices
+        ])
+        return kip_report
+
+
+class MechReportPlannerTests(ArmTestCase):
+    def prepare_box(self, size):
+        box_devices = []
+        for number in range(size):
+            place = self.create_place(number)
+            self.create_device(station=self.station, mounting_address=place,
+                               next_check_date=date(2023, 6, 1), status=Device.ready)
+            box_devices.append(self.create_device(station=self.station, mounting_address=place,
+                                                  status=Device.in_progress))
+        return self.create_box(box_devices)
+
+    def test_exact_place_device_is_replaced(self):
+        place = self.create_place(1)
+        old_device = self.create_device(station=self.station, mounting_address=place,
+                                        status=Device.ready)
+        new_device = self.create_device(station=self.station, mounting_address=place,
+                                        status=Device.in_progress)
+        kip_report = self.create_box([new_device])
+
+        reports = MechReportPlanner(kip_report).execute(user=self.user)
+
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(list(reports[0].devices.all()), [old_device])
+        new_device.refresh_from_db()
+        self.assertEqual(new_device.status, Device.send)
+        self.assertEqual(new_device.next_check_date, date(2026, 5, 10))
+        kip_report.refresh_from_db()
+        self.assertFalse(kip_report.editable)
+
+    def test_avz_device_with_earliest_date_is_replaced(self):
+        later = self.create_device(station=self.station, avz=self.avz,
+                                   next_check_date=date(2024, 1, 1), status=Device.normal)
+        earlier = self.create_device(station=self.station, avz=self.avz,
+                                     next_check_date=date(2023, 1, 1), status=Device.overdue)
+        first = self.create_device(station=self.station, avz=self.avz, status=Device.in_progress)
+        second = self.create_device(station=self.station, avz=self.avz, status=Device.in_progress)
+        kip_report = self.create_box([first, second])
+
+        plan = MechReportPlanner(kip_report).plan()
+
+        self.assertEqual(plan, {self.station.pk: [earlier, later]})
+
+    def test_box_device_without_address_goes_to_report(self):
+        # прибор без адреса не меняет другой прибор без адреса той же станции
+        self.create_device(station=self.station, status=Device.ready)
+        box_device = self.create_device(station=self.station, status=Device.in_progress)
+        kip_report = self.create_box([box_device])
+
+        self.assertEqual(MechReportPlanner(kip_report).plan(), {self.station.pk: [box_device]})
+
+    def test_other_place_box_device_goes_to_report(self):
+        self.create_device(station=self.station, mounting_address=self.other_place,
+                           status=Device.ready)
+        box_device = self.create_device(station=self.station, mounting_address=self.other_place,
+                                        status=Device.in_progress)
+        kip_report = self.create_box([box_device])
+
+        self.assertEqual(MechReportPlanner(kip_report).plan(), {self.station.pk: [box_device]})
+
+    def test_preview_does_not_write(self):
+        kip_report = self.prepare_box(2)
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("create_mech_reports", args=(kip_report.pk,)), {"preview": 1}
+        )
+
+        self.assertEqual(len(response.json()["stations"][0]["devices"]), 2)
+        self.assertFalse(MechanicReport.objects.exists())
+        self.assertFalse(Device.objects.filter(status=Device.send).exists())
+
+    def test_query_count_does_not_depend_on_box_size(self):
+        # первый ящик создает ячейки календаря замен для новых дат проверки
+        MechReportPlanner(self.prepare_box(1)).execute(user=self.user)
+        counts = []
+        for size in (2, 20):
+            kip_report = self.prepare_box(size)
+            with CaptureQueriesContext(connection) as queries:
+                MechReportPlanner(kip_report).execute(user=self.user)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+
+class PlaceOccupancyTests(ArmTestCase):
+    def test_occupancy_follows_save_move_and_delete(self):
+        place, new_place = self.create_place(1), self.create_place(2)
+        device = self.create_device(station=self.station, mounting_address=place, status=Device.normal)
+        occupancy = PlaceOccupancy.of(place.pk)
+        self.assertEqual((occupancy.count, occupancy.statuses, occupancy.device_types),
+                         (1, {Device.normal: 1}, {str(self.tipe.pk): 1}))
+
+        device = Device.objects.get(pk=device.pk)
+        device.mounting_address = new_place
+        device.save()
+        self.assertEqual(PlaceOccupancy.of(place.pk).count, 0)
+        self.assertEqual(PlaceOccupancy.of(new_place.pk).count, 1)
+
+        device.delete()
+        self.assertEqual(PlaceOccupancy.of(new_place.pk).count, 0)
+
+    def test_save_moves_device_without_reading_place(self):
+        devices = [self.create_device(station=self.station, mounting_address=self.other_place,
+                                      status=Device.normal) for _ in range(5)]
+        device = Device.objects.get(pk=devices[0].pk)
+        device.status = Device.ready
+
+        with CaptureQueriesContext(connection) as queries:
+            device.save()
+        self.assertFalse([query for query in queries if 'FROM "ARM_device"' in query["sql"]])
+        occupancy = PlaceOccupancy.of(self.other_place.pk)
+        self.assertEqual((occupancy.count, occupancy.statuses), (5, {Device.normal: 4, Device.ready: 1}))
+
+        PlaceOccupancy.refresh([self.other_place.pk])
+        self.assertEqual(PlaceOccupancy.of(self.other_place.pk).statuses, occupancy.statuses)
+
+    def test_bulk_status_refresh_updates_occupancy(self):
+        place = self.create_place(1)
+        device = self.create_device(station=self.station, mounting_address=place,
+                                    next_check_date=date(2023, 5, 1), status=Device.normal)
+        refresh_device_statuses(today=date(2023, 5, 10), full=True)
+        device.refresh_from_db()
+        self.assertEqual(PlaceOccupancy.of(place.pk).other_statuses(None), [device.status])
+        self.assertEqual(PlaceOccupancy.of(place.pk).count, 1)
+
+    def test_clean_uses_single_occupancy_lookup(self):
+        place = self.create_place(1)
+        self.create_device(station=self.station, mounting_address=place, status=Device.normal)
+        device = Device(device_type=self.tipe, station=self.station, mounting_address=place,
+                        status=Device.normal, frequency_of_check=3)
+        get_topology()
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError):
+                device.clean()
+
+
+class TopologyTests(ArmTestCase):
+    def test_resolves_normalized_address(self):
+        place = self.create_place(712)
+        registry = get_topology()
+        self.assertEqual(registry.resolve(self.station.pk, " 27 - 712 ").pk, place.pk)
+        self.assertIsNone(registry.resolve(self.station.pk, "27-713"))
+        self.assertTrue(registry.is_other_place(self.other_place.pk))
+        self.assertFalse(registry.is_other_place(place.pk))
+
+    def test_cached_between_calls_and_reset_on_change(self):
+        get_topology()
+        with self.assertNumQueries(0):
+            get_topology()
+
+        place = self.create_place(1)
+        self.assertEqual(get_topology().resolve(self.station.pk, "27-1").pk, place.pk)
+
+    def test_reloads_when_other_process_bumps_version(self):
+        registry = get_topology()
+        SyncMarker.objects.update_or_create(key=topology.TOPOLOGY_VERSION,
+                                            defaults={"value": registry.version + 1})
+        topology._checked_at = 0.0
+        self.assertIsNot(get_topology(), registry)
+
+
+class StockAllocationTests(ArmTestCase):
+    def create_stock(self, count):
+        return Device.objects.bulk_create([
+            Device(device_type=self.tipe, stock=self.stock, frequency_of_check=3)
+            for _ in range(count)
+        ])
+
+    def allocate(self, kip_report, quantity):
+        return allocate_stock(kip_report, self.tipe, quantity,
+                              station=self.station, mounting_address="",
+                              check_date=date(2023, 5, 10))
+
+    def test_boxes_never_share_devices(self):
+        self.create_stock(5)
+        first, second = self.create_box([]), self.create_box([])
+
+        first_ids, shortfall = self.allocate(first, 3)
+        self.assertEqual((len(first_ids), shortfall), (3, 0))
+        second_ids, shortfall = self.allocate(second, 3)
+        self.assertEqual((len(second_ids), shortfall), (2, 1))
+        self.assertFalse(set(first_ids) & set(second_ids))
+        self.assertEqual(first.devices.count(), 3)
+
+    def test_closed_box_releases_nothing_twice(self):
+        self.create_stock(2)
+        closed = self.create_box([])
+        self.allocate(closed, 2)
+        closed.editable = False
+        closed.save()
+
+        self.assertEqual(len(self.allocate(self.create_box([]), 2)[0]), 2)
+
+    def test_query_count_does_not_depend_on_quantity(self):
+        self.create_stock(60)
+        self.allocate(self.create_box([]), 1)
+        small_box, large_box = self.create_box([]), self.create_box([])
+        with CaptureQueriesContext(connection) as small:
+            self.allocate(small_box, 5)
+        with CaptureQueriesContext(connection) as large:
+            self.allocate(large_box, 50)
+        self.assertEqual(len(small), len(large))
+
+    def test_counted_row_skips_devices_of_the_same_submission(self):
+        first, second, third = self.create_stock(3)
+        rows = [(first, "3 шт."), (second, "1 шт.")]
+        data = {
+            "title": "", "explanation": "",
+            "devicekipreport_set-TOTAL_FORMS": len(rows), "devicekipreport_set-INITIAL_FORMS": 0,
+        }
+        for number, (device, mounting_address) in enumerate(rows):
+            data.update({
+                f"devicekipreport_set-{number}-device": device.pk,
+                f"devicekipreport_set-{number}-station": self.station.pk,
+                f"devicekipreport_set-{number}-mounting_address": mounting_address,
+                f"devicekipreport_set-{number}-check_date": "10.05.2023",
+            })
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse("admin:ARM_kipreport_add"), data)
+
+        self.assertEqual(response.status_code, 302)
+        device_ids = list(KipReport.objects.get().devicekipreport_set.values_list("device_id", flat=True))
+        self.assertEqual(sorted(device_ids), [first.pk, second.pk, third.pk])
+
+
+class DeviceIndexTests(ArmTestCase):
+    """Запросы из фильтров, обновления статусов и поиска замены
+    должны идти по индексам, а не полным просмотром ARM_device"""
+
+    def assertUsesIndex(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        table = Device._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}", params)
+                plan = [row[0] for row in cursor.fetchall()]
+                full_scans = [line for line in plan if f'Seq Scan on "{table}"' in line]
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                full_scans = [line for line in plan if line in (f"SCAN {table}", f"SCAN TABLE {table}")]
+        self.assertFalse(full_scans, "\n".join(plan))
+
+    def test_hot_queries_use_indexes(self):
+        place = self.create_place(1)
+        queries = {
+            "год": Device.objects.filter(next_check_date__gte=date(2023, 1, 1),
+                                         next_check_date__lt=date(2024, 1, 1)),
+            "статусы": status_devices().filter(next_check_date__gt=date(2023, 5, 1),
+                                               next_check_date__lte=date(2023, 5, 10)),
+            "статус": Device.objects.filter(status=Device.ready),
+            "замена": Device.objects.filter(station=self.station, mounting_address=place,
+                                            device_type=self.tipe, status=Device.send),
+            "АВЗ": Device.objects.filter(avz=self.avz, device_type=self.tipe).exclude(
+                status__in=[Device.send, Device.in_progress]),
+            "склад": free_stock_devices(self.tipe),
+            "инв. номер": Device.objects.filter(inventory_number="12345"),
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset)
+
+
+class PlaceAddressTests(ArmTestCase):
+    def setUp(self):
+        self.tunnel = Rack.objects.create(station=self.station, number="Тоннель")
+        self.switch = Place.objects.create(rack=self.tunnel, number="стрелка №1")
+        self.places = {number: self.create_place(number) for number in ("7", "712", "8")}
+
+    def search(self, term):
+        queryset, _ = site._registry[Place].get_search_results(None, Place.objects.all(), term)
+        return set(queryset.values_list("pk", flat=True))
+
+    def test_key_is_normalized_and_follows_rack(self):
+        self.assertEqual((self.switch.station_id, self.switch.address_key), (self.station.pk, "тоннель-стрелка №1"))
+
+        self.tunnel.number = "поле"
+        self.tunnel.save()
+        self.switch.refresh_from_db()
+        self.assertEqual(self.switch.address_key, "поле-стрелка №1")
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search("27-7"), {self.places["7"].pk, self.places["712"].pk})
+        self.assertEqual(self.search("27 - 712"), {self.places["712"].pk})
+        self.assertEqual(self.search("тоннель-стр"), {self.switch.pk})
+        self.assertEqual(self.search("8"), {self.places["8"].pk})
+        self.assertEqual(self.search("2"), set(Place.objects.filter(rack=self.rack).values_list("pk", flat=True)))
+
+    def test_prefix_search_uses_index(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("план запроса проверяется на SQLite")
+        sql, params = Place.objects.address_prefix("27-7").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("arm_place_address_idx", plan)
+
+
+class LegacyImportTests(ArmTestCase):
+    def row(self, rack="27", place="5", inventory="100", station_id=1, next_check=date(2030, 1, 10), type_id=None):
+        return (station_id, f" {rack} ", place, "НМШ", inventory, date(2010, 1, 1), date(2020, 1, 10),
+                10, next_check, type_id or self.tipe.pk, "Иванов", "Петров")
+
+    def run_import(self, rows):
+        rejects = []
+        importer = LegacyImporter(chunk_size=2, reject=lambda *reject: rejects.append(reject[:2]),
+                                  today=date(2023, 6, 15))
+        return importer.run(rows), rejects
+
+    def test_import_creates_places_and_devices(self):
+        tunnel = Rack.objects.create(station=self.station, number="тоннель")
+        importer, rejects = self.run_import([
+            self.row(),
+            self.row(place="6", inventory="101", next_check=date(2023, 6, 1)),
+            self.row(rack="стр", place="N 3", inventory="102"),
+            self.row(rack="зап", inventory="103"),
+            self.row(station_id=20, inventory="104"),
+            self.row(station_id=99, inventory="105"),
+        ])
+
+        self.assertEqual((importer.created, importer.updated, importer.skipped), (4, 0, 1))
+        self.assertEqual(rejects, [(6, "Неизвестная станция 99")])
+        place = Place.objects.get(rack=self.rack, number="5")
+        self.assertEqual(place.address_key, "27-5")
+        device = Device.objects.get(inventory_number="100")
+        self.assertEqual((device.mounting_address, device.station, device.status), (place, self.station, Device.normal))
+        self.assertEqual(Device.objects.get(inventory_number="101").status, Device.overdue)
+        self.assertEqual(PlaceOccupancy.of(place.pk).count, 1)
+        self.assertEqual(Device.objects.get(inventory_number="104").stock, self.stock)
+        switch = Device.objects.get(inventory_number="102").mounting_address
+        self.assertEqual((switch.rack, switch.number), (tunnel, "стрелка №3"))
+        self.assertIsNotNone(get_topology().resolve(self.station.pk, "27-5"))
+
+    def test_rerun_updates_devices_in_place(self):
+        self.run_import([self.row(), self.row(place="6", inventory="101")])
+        device = Device.objects.get(inventory_number="100")
+        old_place = device.mounting_address
+
+        importer, _ = self.run_import([self.row(next_check=date(2023, 6, 20)), self.row(place="6", inventory="101")])
+
+        self.assertEqual((importer.created, importer.updated, importer.places_created), (0, 2, 0))
+        self.assertEqual(Device.objects.count(), 2)
+        updated = Device.objects.get(pk=device.pk)
+        self.assertEqual((updated.status, updated.version), (Device.ready, device.version + 1))
+        self.assertEqual(PlaceOccupancy.of(old_place.pk).statuses, {Device.ready: 1})
+
+
+class MysqlDumpTests(ArmTestCase):
+    DUMP = """-- MySQL dump 10.13
+/*!40101 SET NAMES {charset} */;
+DROP TABLE IF EXISTS `glav`;
+CREATE TABLE `glav` (
+  `Id` int(11) NOT NULL AUTO_INCREMENT,
+  `Stan_Id` int(11) DEFAULT NULL,
+  `Stativ` varchar(20) DEFAULT NULL,
+  `Mesto` varchar(20) DEFAULT NULL,
+  `Nazn` varchar(20) DEFAULT NULL,
+  `Zn` varchar(30) DEFAULT NULL,
+  `Dw` date DEFAULT NULL,
+  `Du` date DEFAULT NULL,
+  `Per` int(11) DEFAULT NULL,
+  `Dat_Sp` date DEFAULT NULL,
+  `Tipe_Id` int(11) DEFAULT NULL,
+  `Reg` varchar(30) DEFAULT NULL,
+  `Prow` varchar(30) DEFAULT NULL,
+  PRIMARY KEY (`Id`),
+  KEY `Stan_Id` (`Stan_Id`)
+) ENGINE=InnoDB DEFAULT CHARSET={charset};
+INSERT INTO `glav` VALUES (1,1,'27','5','НМШ','100','2010-01-01','2020-01-10',10,'2030-01-10',{type_id},'Иван\\'ов','a\\nb'),(2,1,'27','6',NULL,'101','0000-00-00',NULL,10,'2023-06-01',{type_id},'','');
+INSERT INTO `other` VALUES (1,'(skip)');
+INSERT INTO `glav` (`Stan_Id`, `Stativ`, `Mesto`, `Nazn`, `Zn`, `Dw`, `Du`, `Per`, `Dat_Sp`, `Tipe_Id`, `Reg`, `Prow`) VALUES (20,'1','1','x;y','104',NULL,NULL,NULL,NULL,{type_id},'','');
+"""
+
+    def write_dump(self, charset="utf8mb4", compress=False):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "glav.sql"
+        content = self.DUMP.format(charset=charset, type_id=self.tipe.pk).encode(
+            "cp1251" if charset == "cp1251" else "utf-8")
+        if compress:
+            path = path.with_suffix(".sql.gz")
+            content = gzip.compress(content)
+        path.write_bytes(content)
+        return path
+
+    def test_rows_are_typed_and_unescaped(self):
+        rows = list(dump_legacy_rows(self.write_dump(compress=True)))
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0], (1, "27", "5", "НМШ", "100", date(2010, 1, 1), date(2020, 1, 10),
+                                   10, date(2030, 1, 10), self.tipe.pk, "Иван'ов", "a\nb"))
+        self.assertEqual(rows[1][3:7], (None, "101", "0000-00-00", None))
+        self.assertEqual(rows[2][:4], (20, "1", "1", "x;y"))
+
+    def test_charset_and_column_projection(self):
+        rows = list(TableReader(self.write_dump(charset="cp1251"), "glav", ["stan_id", "NAZN"]))
+
+        self.assertEqual(rows, [(1, "НМШ"), (1, None), (20, "x;y")])
+
+    def test_import_from_dump(self):
+        importer = LegacyImporter(today=date(2023, 6, 15)).run(dump_legacy_rows(self.write_dump()))
+
+        self.assertEqual((importer.created, sum(importer.rejects.values())), (3, 0))
+        self.assertEqual(Device.objects.get(inventory_number="101").manufacture_date, None)
+        self.assertEqual(Device.objects.get(inventory_number="104").stock, self.stock)
+
+
+class InventoryGeneratorTests(ArmTestCase):
+    def test_generated_inventory_is_consistent(self):
+        generator = InventoryGenerator(stations=2, racks=3, places=8, kip_reports=2, box_size=5,
+                                       today=date(2023, 6, 15))
+        counts = generator.run()
+
+        stations = Station.objects.order_by("-pk")[:2]
+        devices = Device.objects.filter(station__in=stations)
+        self.assertEqual(counts["places"], Place.objects.filter(station__in=stations).count())
+        self.assertEqual(devices.filter(mounting_address__isnull=True, avz__isnull=False).count(), counts["avz"])
+        self.assertTrue(Device.objects.filter(stock=self.stock, station__isnull=True).exists())
+        self.assertEqual(devices.filter(status=Device.in_progress).count(), 5)
+        self.assertEqual(devices.filter(status=Device.send).count(), 5)
+        self.assertEqual(MechanicReport.objects.count(), counts["mechanic_reports"])
+        for place in Place.objects.filter(station__in=stations, number=Place.OTHER_PLACES_NUMBER):
+            self.assertGreater(PlaceOccupancy.of(place.pk).count, 1)
+        for occupancy in PlaceOccupancy.objects.filter(place__station__in=stations):
+            self.assertEqual(occupancy.count, devices.filter(mounting_address_id=occupancy.place_id).count())
+
+
+class QueryBudgetTests(QueryBudgetMixin, ArmTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.generator = InventoryGenerator(stations=2, racks=3, places=10, kip_reports=2, box_size=8,
+                                           today=date(2023, 6, 15))
+        cls.generator.run()
+        cls.report = MechanicReport.objects.order_by("pk").first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_admin_pages_are_within_budget(self):
+        kip_report = KipReport.objects.order_by("pk").first()
+        for url in (reverse("admin:ARM_device_changelist"),
+                    reverse("admin:ARM_mechanicreport_changelist"),
+                    reverse("admin:ARM_mechanicreport_change", args=(self.report.pk,)),
+                    reverse("admin:ARM_kipreport_change", args=(kip_report.pk,))):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+    def test_update_device_is_within_budget(self):
+        device = self.report.devices.order_by("pk").first()
+        kip_report = KipReport.objects.order_by("pk").first()
+        response = self.client.post(
+            reverse("update_device", args=(device.pk,)),
+            {"kip_report_id": kip_report.pk, "version": device.version},
+            HTTP_REFERER=f"/kip/ARM/mechanicreport/{self.report.pk}/change/",
+        )
+
+        self.assertTrue(response.json()["success"], response.json())
+        self.assertWithinQueryBudget(response)
+
+    @override_settings(QUERY_BUDGETS={"admin:ARM_mechanicreport_changelist": 1})
+    def test_request_over_budget_is_logged(self):
+        with self.assertLogs("ARM.queries", "WARNING"):
+            response = self.client.get(reverse("admin:ARM_mechanicreport_changelist"))
+
+        log = RequestQueryLog.objects.get()
+        self.assertEqual(log.view_name, "admin:ARM_mechanicreport_changelist")
+        self.assertEqual(log.queries, response.query_stats["queries"])
+        self.assertEqual(log.user, self.user)
+        self.assertTrue(log.over_budget)
+        self.assertTrue(log.slowest)
+
+        response = self.client.get(reverse("admin:ARM_requestquerylog_changelist"))
+        self.assertContains(response, "admin:ARM_mechanicreport_changelist")
+
+    def test_request_within_budget_is_not_logged(self):
+        self.client.get(reverse("admin:ARM_mechanicreport_changelist"))
+
+        self.assertFalse(RequestQueryLog.objects.exists())
+
+
+class RequestProfileTests(ArmTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        settings = override_settings(PROFILE_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+        self.url = reverse("admin:ARM_device_changelist")
+
+    def test_profile_is_saved_on_request(self):
+        self.create_device(station=self.station)
+        response = self.client.get(self.url, {"_profile": ""})
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response["X-ARM-Profile"], str(profile.pk))
+        self.assertEqual(profile.view_name, "admin:ARM_device_changelist")
+        self.assertEqual(profile.user, self.user)
+        self.assertGreater(profile.queries, 0)
+        with zipfile.ZipFile(self.root / profile.file_name) as archive:
+            self.assertEqual(sorted(archive.namelist()), ["cpu.prof", "cpu.txt", "memory.txt", "sql.json"])
+            self.assertIn("cumulative", archive.read("cpu.txt").decode())
+            self.assertEqual(len(json.loads(archive.read("sql.json"))), profile.queries)
+
+        response = self.client.get(reverse("download_profile", args=(profile.pk,)))
+        self.assertEqual(response["Content-Disposition"], f'attachment; filename="{profile.file_name}"')
+        response = self.client.get(reverse("admin:ARM_requestprofile_change", args=(profile.pk,)))
+        self.assertContains(response, "cumulative")
+
+    def test_header_triggers_profile(self):
+        response = self.client.get(self.url, HTTP_X_ARM_PROFILE="1")
+
+        self.assertEqual(response["X-ARM-Profile"], str(RequestProfile.objects.get().pk))
+
+    def test_only_staff_can_profile(self):
+        self.client.get(self.url)
+        self.client.logout()
+        self.client.get(reverse("admin:login"), {"_profile": ""})
+
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILE_KEEP_COUNT=1)
+    def test_old_profiles_are_purged(self):
+        self.client.get(self.url, {"_profile": ""})
+        self.client.get(self.url, {"_profile": ""})
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual([path.name for path in self.root.iterdir()], [profile.file_name])
+
+
+class MetricsTests(ArmTestCase):
+    def test_registry_renders_exposition_format(self):
+        registry = Registry()
+        counter = registry.counter("arm_test", "Тест", ("view",))
+        histogram = registry.histogram("arm_test_seconds", "Тест", buckets=(0.1, 1))
+        counter.labels('a"b').inc()
+        counter.labels('a"b').inc(2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP arm_test Тест",
+            "# TYPE arm_test counter",
+            'arm_test_total{view="a\\"b"} 3',
+            "# HELP arm_test_seconds Тест",
+            "# TYPE arm_test_seconds histogram",
+            'arm_test_seconds_bucket{le="0.1"} 1',
+            'arm_test_seconds_bucket{le="1"} 2',
+            'arm_test_seconds_bucket{le="+Inf"} 2',
+            "arm_test_seconds_sum 0.55",
+            "arm_test_seconds_count 2",
+        ])
+
+    def test_endpoint_reports_requests_and_device_actions(self):
+        rejected = DEVICE_ACTIONS.labels("update_device", "rejected")
+        before = rejected.value
+        report = MechanicReport.objects.create(user=self.user, station=self.station)
+        self.client.force_login(self.user)
+        self.client.post(reverse("update_device", args=(1,)), {"kip_report_id": 999},
+                         HTTP_REFERER=f"/kip/ARM/mechanicreport/{report.pk}/change/")
+
+        self.assertEqual(rejected.value, before + 1)
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        self.assertContains(response, 'arm_http_request_duration_seconds_bucket{view="update_device",method="POST"')
+        self.assertContains(response, f'arm_device_actions_total{{action="update_device",outcome="rejected"}} '
+                                      f'{int(before + 1)}')
+
+    def test_endpoint_is_closed_to_remote_anonymous(self):
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.5").status_code, 403)
+
+    def test_background_jobs_are_read_from_database(self):
+        started = timezone.now()
+        CronJobLog.objects.create(code="ARM.update_device_statuses", start_time=started,
+                                  end_time=started + timedelta(seconds=2), is_success=True,
+                                  message="Обновлено статусов: 7")
+
+        response = self.client.get(reverse("metrics"))
+        self.assertContains(response, 'arm_cron_last_duration_seconds{job="ARM.update_device_statuses"} 2\n')
+        self.assertContains(response, "arm_device_statuses_last_changed 7\n")
+        self.assertContains(response, 'arm_export_jobs{status="в очереди"} 0\n')
+
+
+class ReplacementCalendarTests(ArmTestCase):
+    @staticmethod
+    def cells():
+        return {
+            (cell.year, cell.month, cell.station_id, cell.device_type_id): cell.count
+            for cell in ReplacementCalendar.objects.filter(count__gt=0)
+        }
+
+    def assertCalendarIsConsistent(self):
+        cells = self.cells()
+        ReplacementCalendar.rebuild()
+        self.assertEqual(cells, self.cells())
+
+    def test_calendar_follows_save_move_and_delete(self):
+        device = self.create_device(station=self.station, next_check_date=date(2025, 6, 10))
+        self.create_device(station=self.station, next_check_date=date(2025, 6, 20))
+        self.assertEqual(self.cells(), {(2025, 6, self.station.pk, self.tipe.pk): 2})
+
+        device = Device.objects.get(pk=device.pk)
+        device.next_check_date = date(2025, 7, 1)
+        device.save()
+        self.assertEqual(self.cells(), {(2025, 6, self.station.pk, self.tipe.pk): 1,
+                                        (2025, 7, self.station.pk, self.tipe.pk): 1})
+
+        device.station = None
+        device.save(update_fields=["station"])
+        self.assertEqual(self.cells(), {(2025, 6, self.station.pk, self.tipe.pk): 1,
+                                        (2025, 7, None, self.tipe.pk): 1})
+
+        device.delete()
+        self.assertEqual(self.cells(), {(2025, 6, self.station.pk, self.tipe.pk): 1})
+        self.assertCalendarIsConsistent()
+
+    def test_unchanged_save_does_not_touch_calendar(self):
+        device = self.create_device(station=self.station, next_check_date=date(2025, 6, 10))
+        device = Device.objects.get(pk=device.pk)
+        device.status = Device.ready
+
+        with CaptureQueriesContext(connection) as queries:
+            device.save(update_fields=["status"])
+        self.assertFalse([query for query in queries if "ARM_replacementcalendar" in query["sql"]])
+
+    def test_deferred_device_refreshes_month(self):
+        device = self.create_device(station=self.station, next_check_date=date(2025, 6, 10))
+        device = Device.objects.only("pk", "version").get(pk=device.pk)
+        device.next_check_date = date(2025, 6, 30)
+        device.save(update_fields=["next_check_date"])
+
+        self.assertCalendarIsConsistent()
+
+    def test_planner_keeps_calendar_consistent(self):
+        generator = InventoryGenerator(stations=1, racks=2, places=5, kip_reports=0, today=date(2023, 6, 15))
+        generator.run()
+        kip_report = generator.make_box(5)
+        self.assertCalendarIsConsistent()
+
+        MechReportPlanner(kip_report).execute(user=self.user)
+        self.assertCalendarIsConsistent()
+
+    def test_filters_use_request_parameters_and_show_counts(self):
+        for day in (date(2025, 3, 1), date(2025, 3, 31), date(2024, 3, 15), date(2025, 4, 1)):
+            self.create_device(station=self.station, next_check_date=day)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("admin:ARM_device_changelist"),
+                                   {"next_check_date__year": "2025", "next_check_date__month": "3"},
+                                   HTTP_REFERER="/kip/ARM/device/?next_check_date__year=2024")
+
+        self.assertEqual(response.context["cl"].result_count, 2)
+        self.assertContains(response, "март (2)")
+        self.assertContains(response, "апрель (1)")
+        self.assertContains(response, "2024 (1)")
+        self.assertContains(response, "2025 (3)")
+
+        response = self.client.get(reverse("admin:ARM_device_changelist"),
+                                   {"next_check_date__year": "abc", "next_check_date__month": "13"})
+        self.assertEqual(response.status_code, 200)
+
+
+class LiveStatusTests(ArmTestCase):
+    def test_live_status_matches_get_status_on_boundaries(self):
+        dates = [None, date(2022, 12, 31), date(2023, 1, 1), date(2023, 5, 31), date(2023, 6, 1),
+                 date(2023, 6, 14), date(2023, 6, 15), date(2023, 6, 16), date(2023, 6, 30),
+                 date(2023, 7, 1), date(2023, 12, 31), date(2024, 1, 1), date(2024, 6, 15)]
+        for day in dates:
+            self.create_device(station=self.station, next_check_date=day)
+
+        for today in (date(2023, 6, 1), date(2023, 6, 15), date(2023, 6, 30), date(2023, 12, 31)):
+            for device in Device.objects.with_live_status(today):
+                self.assertEqual(device.live_status, device.get_status(today=today),
+                                 (today, device.next_check_date))
+
+    def test_refresh_status_updates_only_stale_rows(self):
+        self.create_device(station=self.station, next_check_date=date(2023, 6, 10), status=Device.ready)
+        stale = self.create_device(station=self.station, next_check_date=date(2023, 6, 1),
+                                   status=Device.normal)
+
+        self.assertEqual(Device.objects.refresh_status(date(2023, 6, 5)), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, Device.overdue)
+
+
+class RefreshDeviceStatusesTests(ArmTestCase):
+    def test_statuses_follow_boundaries(self):
+        dates = [date(2023, 5, 31), date(2023, 6, 1), date(2023, 6, 15),
+                 date(2023, 6, 16), date(2023, 6, 30), date(2023, 7, 1)]
+        devices = [self.create_device(station=self.station, next_check_date=day, status=Device.normal)
+                   for day in dates]
+        sent = self.create_device(station=self.station, next_check_date=date(2023, 1, 1),
+                                  status=Device.send)
+
+        for today in (date(2023, 5, 20), date(2023, 6, 1), date(2023, 6, 15), date(2023, 7, 1)):
+            refresh_device_statuses(today=today)
+            for device in devices:
+                device.refresh_from_db()
+                self.assertEqual(device.status, device.get_status(today=today), (today, device.next_check_date))
+
+        sent.refresh_from_db()
+        self.assertEqual(sent.status, Device.send)
+
+    def test_second_run_on_same_day_is_free(self):
+        refresh_device_statuses(today=date(2023, 6, 1))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(refresh_device_statuses(today=date(2023, 6, 1)), 0)
+
+    def test_only_devices_crossing_boundary_change(self):
+        self.create_device(station=self.station, next_check_date=date(2023, 6, 10), status=Device.ready)
+        self.create_device(station=self.station, next_check_date=date(2023, 8, 1), status=Device.normal)
+        refresh_device_statuses(today=date(2023, 6, 1))
+
+        self.assertEqual(refresh_device_statuses(today=date(2023, 6, 10)), 1)
+
+    def test_daily_reconcile_fixes_drift_within_boundaries(self):
+        today = timezone.localdate()
+        device = self.create_device(station=self.station, next_check_date=today + timedelta(days=400),
+                                    status=Device.normal)
+        refresh_device_statuses(today=today)
+        # статус разошелся без пересечения границы дат
+        Device.objects.filter(pk=device.pk).update(status=Device.overdue)
+
+        self.assertEqual(refresh_device_statuses(today=today + timedelta(days=1)), 0)
+        ReconcileDeviceStatuses().do()
+        device.refresh_from_db()
+        self.assertEqual(device.status, Device.normal)
+
+
+class ExportTests(ArmTestCase):
+    def create_devices(self, count):
+        for number in range(count):
+            self.create_device(station=self.station, avz=self.avz, inventory_number=str(number),
+                               next_check_date=date(2024, 1, 1))
+
+    def export(self):
+        output = BytesIO()
+        admin = site._registry[Device]
+        ExportExcelAction.write_xlsx(admin, Device.objects.all(), admin.list_display, output)
+        output.seek(0)
+        return list(load_workbook(output).active.values)
+
+    def test_xlsx_contains_header_and_rows(self):
+        self.create_devices(3)
+
+        rows = self.export()
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][0], "СТАНЦИЯ")
+        self.assertEqual(rows[1][5], str(self.avz))
+        self.assertEqual(rows[1][6], "01/01/2024")
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        self.create_devices(2)
+        with CaptureQueriesContext(connection) as small:
+            self.export()
+        self.create_devices(30)
+        with CaptureQueriesContext(connection) as large:
+            self.export()
+
+        self.assertEqual(len(small), len(large))
+
+    def test_csv_action_streams_rows(self):
+        self.create_devices(2)
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse("admin:ARM_device_changelist"), {
+            "action": "export_as_csv",
+            "_selected_action": list(Device.objects.values_list("pk", flat=True)),
+        })
+
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(content.strip().splitlines()), 3)
+
+
+class ExportJobTests(ArmTestCase):
+    def setUp(self):
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        settings_override = override_settings(EXPORT_ROOT=Path(export_dir.name), EXPORT_INLINE_LIMIT=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for number in range(3):
+            self.create_device(station=self.station, inventory_number=str(number))
+        self.client.force_login(self.user)
+
+    def request_export(self):
+        return self.client.post(reverse("admin:ARM_device_changelist"), {
+            "action": "export_as_xls",
+            "_selected_action": list(Device.objects.values_list("pk", flat=True)),
+        })
+
+    def test_large_export_runs_in_worker(self):
+        self.request_export()
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, ExportJob.pending)
+
+        call_command("export_worker", "--once", stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.get_progress()), (ExportJob.done, 3, 100))
+        response = self.client.get(reverse("download_export", args=(job.pk,)))
+        workbook = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(workbook.active.max_row, 4)
+
+    def test_foreign_export_is_not_found(self):
+        self.request_export()
+        call_command("export_worker", "--once", stdout=StringIO())
+        job = ExportJob.objects.get()
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        self.client.force_login(staff)
+
+        response = self.client.get(reverse("download_export", args=(job.pk,)))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(job.status, ExportJob.done)
+
+    def test_identical_request_reuses_job(self):
+        self.request_export()
+        self.request_export()
+
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_broken_job_is_failed_not_left_running(self):
+        self.request_export()
+        ExportJob.objects.update(query=b"broken")
+
+        call_command("export_worker", "--once", stdout=StringIO())
+
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, ExportJob.failed)
+        self.assertIsNotNone(job.finished)
+
+    def test_worker_fails_stale_running_jobs(self):
+        self.request_export()
+        ExportJob.objects.update(status=ExportJob.running, started=timezone.now() - timedelta(hours=2))
+        fresh = ExportJob.objects.create(user=self.user, model_label="ARM.Device", query=b"",
+                                         status=ExportJob.running, started=timezone.now())
+
+        call_command("export_worker", "--once", stdout=StringIO())
+
+        self.assertEqual(ExportJob.objects.filter(status=ExportJob.failed).count(), 1)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, ExportJob.running)
+
+
+class MechanicReportPageTests(ArmTestCase):
+    QUERY_BUDGET = 20
+
+    def create_report(self, size):
+        report = MechanicReport.objects.create(user=self.user, station=self.station, title="КИП N 1")
+        report.devices.set([
+            self.create_device(station=self.station, mounting_address=self.create_place(f"{size}-{number}"),
+                               current_check_date=date(2020, 1, 1), next_check_date=date(2023, 1, 1),
+                               status=Device.ready)
+            for number in range(size)
+        ])
+        Comment.objects.bulk_create([
+            Comment(author=self.user, mech_report=report, text="Замечание")
+            for _ in range(size)
+        ])
+        return report
+
+    def count_page_queries(self, report):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:ARM_mechanicreport_change", args=(report.pk,)))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_report_size(self):
+        self.client.force_login(self.user)
+        self.count_page_queries(self.create_report(1))
+
+        small = self.count_page_queries(self.create_report(3))
+        large = self.count_page_queries(self.create_report(40))
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.QUERY_BUDGET)
+
+
+class MechanicReportChangeListTests(ArmTestCase):
+    def create_reports(self, count, size=9):
+        for _ in range(count):
+            report = MechanicReport.objects.create(user=self.user, station=self.station)
+            report.devices.set([self.create_device(station=self.station, avz=self.avz) for _ in range(size)])
+
+    def get_changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:ARM_mechanicreport_changelist"))
+        return response, len(queries)
+
+    def test_query_count_does_not_depend_on_report_count(self):
+        self.client.force_login(self.user)
+        self.create_reports(1)
+        self.get_changelist()
+
+        _, small = self.get_changelist()
+        self.create_reports(20)
+        response, large = self.get_changelist()
+
+        self.assertEqual(small, large)
+        self.assertContains(response, "9 приборов")
+        self.assertContains(response, "...еще 4 приборов")
+
+    def test_preview_is_bounded(self):
+        self.client.force_login(self.user)
+        self.create_reports(1, size=12)
+
+        response, _ = self.get_changelist()
+
+        report = response.context["cl"].result_list[0]
+        first_devices = report.devices.through.objects.filter(mechanicreport=report).order_by("pk")
+        self.assertEqual([device.pk for device in report.device_preview],
+                         [row.device_id for row in first_devices[:MechanicReportAdmin.PREVIEW_SIZE]])
+        self.assertEqual(report.device_count, 12)
+
+    def test_empty_changelist(self):
+        self.client.force_login(self.user)
+
+        response, _ = self.get_changelist()
+
+        self.assertEqual(response.status_code, 200)
+
+
+class DeviceChangeListTests(ArmTestCase):
+    def create_devices(self, count):
+        for number in range(count):
+            place = self.create_place(f"{count}-{number}")
+            self.create_device(station=self.station, mounting_address=place, name=f"Р{number}",
+                               inventory_number=str(number), next_check_date=date(2024, 1, 1))
+            self.create_device(station=self.station, avz=self.avz)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_and_autocomplete_queries_do_not_depend_on_rows(self):
+        self.client.force_login(self.user)
+        changelist = reverse("admin:ARM_device_changelist")
+        autocomplete = (reverse("admin:autocomplete"), {
+            "app_label": "ARM", "model_name": "mechanicreport", "field_name": "devices", "term": "",
+        })
+        self.create_devices(2)
+        self.count_queries(changelist)
+        small = self.count_queries(changelist), self.count_queries(*autocomplete)
+
+        self.create_devices(40)
+        large = self.count_queries(changelist), self.count_queries(*autocomplete)
+
+        self.assertEqual(small, large)
+
+    def add_to_kipreport(self, devices):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("admin:ARM_device_changelist"), {
+                "action": "add_to_kipreport", "_selected_action": [device.pk for device in devices],
+            })
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_add_to_kipreport_queries_do_not_depend_on_rows(self):
+        self.client.force_login(self.user)
+        kip_report = KipReport.objects.create(author=self.user)
+        small = self.add_to_kipreport([self.create_device(stock=self.stock) for _ in range(2)])
+        large = self.add_to_kipreport([self.create_device(stock=self.stock) for _ in range(20)])
+
+        self.assertEqual(small, large)
+        self.assertEqual(kip_report.devices.count(), 22)
+
+
+class DeviceSearchTests(ArmTestCase):
+    def setUp(self):
+        self.relay = self.create_device(name="Р12", inventory_number="2045-117")
+        self.other = self.create_device(name="Р13", inventory_number="3100")
+
+    def search(self, term):
+        return set(search_devices(Device.objects.all(), term).values_list("pk", flat=True))
+
+    def test_prefix_and_word_matching(self):
+        self.assertEqual(self.search("2045"), {self.relay.pk})
+        self.assertEqual(self.search("204"), {self.relay.pk})
+        self.assertEqual(self.search("117 р12"), {self.relay.pk})
+        self.assertEqual(self.search(self.tipe.name), {self.relay.pk, self.other.pk})
+        self.assertEqual(self.search("нет-такого"), set())
+
+    def test_index_follows_device_and_type_changes(self):
+        self.other.inventory_number = "2045-900"
+        self.other.save()
+        self.assertEqual(self.search("2045"), {self.relay.pk, self.other.pk})
+
+        Tipe.objects.filter(pk=self.tipe.pk).update(name="Тестовый")
+        self.assertEqual(self.search("тестов"), {self.relay.pk, self.other.pk})
+
+        self.relay.delete()
+        self.assertEqual(self.search("2045"), {self.other.pk})
+
+    def test_autocomplete_uses_index(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "ARM", "model_name": "mechanicreport", "field_name": "devices", "term": "3100",
+        })
+        self.assertEqual([int(row["id"]) for row in response.json()["results"]], [self.other.pk])
+
+
+class SwapTests(ArmTestCase):
+    def setUp(self):
+        place = self.create_place(1)
+        self.device = self.create_device(station=self.station, mounting_address=place, status=Device.ready,
+                                         next_check_date=date(2023, 1, 1))
+        self.exchange_device = self.create_device(station=self.station, mounting_address=place,
+                                                  status=Device.send, next_check_date=date(2026, 1, 1))
+        self.kip_report = self.create_box([self.exchange_device])
+        self.report = MechanicReport.objects.create(user=self.user, station=self.station)
+        self.report.devices.set([self.device])
+        self.client.force_login(self.user)
+
+    def swap(self, device):
+        return self.client.post(
+            reverse("update_device", args=(device.pk,)),
+            {"kip_report_id": self.kip_report.pk},
+            HTTP_REFERER=f"/kip/ARM/mechanicreport/{self.report.pk}/change/",
+        ).json()
+
+    def test_swap_is_recorded_in_session(self):
+        self.assertTrue(self.swap(self.device)["success"])
+
+        self.exchange_device.refresh_from_db()
+        self.device.refresh_from_db()
+        self.assertEqual(self.exchange_device.status, Device.overdue)
+        self.assertEqual(self.device.stock, self.stock)
+        self.assertEqual(SwapSession.objects.get(mech_report=self.report).device_ids, [self.exchange_device.pk])
+
+    def test_other_places_number_on_any_rack_uses_other_places_rule(self):
+        place = self.create_place(Place.OTHER_PLACES_NUMBER)
+        device = self.create_device(station=self.station, mounting_address=place, status=Device.ready)
+        self.kip_report.devices.add(self.create_device(station=self.station, mounting_address=place,
+                                                       status=Device.send),
+                                    through_defaults={"station": self.station})
+        self.report.devices.add(device)
+
+        # замена на "27-остальное" ищется как на релейная/тоннель/поле, а не по точному месту
+        self.assertEqual(self.swap(device), {"success": False, "message": "Нет приборов для замены"})
+
+    @override_settings(SWAP_SESSION_TTL=0)
+    def test_expired_session_is_empty(self):
+        SwapSession.find_or_create(self.report.pk).add(self.exchange_device.pk)
+
+        self.assertEqual(SwapSession.find_or_create(self.report.pk).device_ids, [])
+
+    @override_settings(SWAP_SESSION_MAX=1)
+    def test_sessions_are_bounded(self):
+        SwapSession.find_or_create(self.report.pk)
+        other_report = MechanicReport.objects.create(user=self.user, station=self.station)
+        SwapSession.find_or_create(other_report.pk)
+
+        self.assertEqual(list(SwapSession.objects.values_list("pk", flat=True)), [other_report.pk])
+
+
+class DeviceVersionTests(ArmTestCase):
+    setUp = SwapTests.setUp
+
+    def test_stale_save_is_rejected(self):
+        stale = Device.objects.get(pk=self.device.pk)
+        fresh = Device.objects.get(pk=self.device.pk)
+        fresh.name = "1"
+        fresh.save(update_fields=["name"])
+        self.assertEqual(fresh.version, 2)
+
+        stale.name = "2"
+        with self.assertRaises(DeviceVersionConflict):
+            stale.save()
+        self.assertEqual(stale.version, 1)
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.name, "1")
+
+    def test_stale_save_does_not_reach_signals(self):
+        place = self.create_place(2)
+        stale = Device.objects.get(pk=self.device.pk)
+        Device.objects.get(pk=self.device.pk).save()
+        cells = ReplacementCalendarTests.cells()
+
+        stale.next_check_date = date(2027, 5, 1)
+        stale.mounting_address = place
+        with self.assertRaises(DeviceVersionConflict):
+            stale.save()
+        self.assertEqual(ReplacementCalendarTests.cells(), cells)
+        self.assertEqual(PlaceOccupancy.of(place.pk).count, 0)
+        self.assertEqual(PlaceOccupancy.of(self.device.mounting_address_id).statuses,
+                         {Device.ready: 1, Device.send: 1})
+
+    def test_stale_page_gets_conflict(self):
+        response = self.client.post(
+            reverse("update_device", args=(self.device.pk,)),
+            {"kip_report_id": self.kip_report.pk, "version": self.device.version + 1},
+            HTTP_REFERER=f"/kip/ARM/mechanicreport/{self.report.pk}/change/",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()["conflict"])
+        self.assertFalse(SwapSession.objects.get(mech_report=self.report).device_ids)
+
+
+class ParallelSwapTests(TransactionTestCase):
+    fixtures = ["stations.json", "stock.json", "avz.json", "types.json"]
+    WORKERS = 8
+
+    def setUp(self):
+        user = User.objects.create_superuser("kip", password="kip")
+        station = Station.objects.get(pk=1)
+        tipe = Tipe.objects.first()
+        place = Place.objects.create(rack=Rack.objects.create(station=station, number="27"), number="1")
+        self.device = Device.objects.create(device_type=tipe, station=station, mounting_address=place,
+                                            status=Device.ready, next_check_date=date(2023, 1, 1))
+        self.exchange_device = Device.objects.create(device_type=tipe, station=station, mounting_address=place,
+                                                     status=Device.send, next_check_date=date(2026, 1, 1))
+        self.kip_report = KipReport.objects.create(author=user)
+        self.kip_report.devices.add(self.exchange_device, through_defaults={"station": station})
+        self.report = MechanicReport.objects.create(user=user, station=station)
+        self.report.devices.add(self.device)
+
+    def swap(self, barrier, results):
+        try:
+            device = Device.objects.get(pk=self.device.pk)
+            exchange_device = Device.objects.get(pk=self.exchange_device.pk)
+            barrier.wait()
+            # как в update_device: потоки гонятся за блокировку на запись
+            # через serialized_write, занятую базу повторяет retry_on_locked
+            retry_on_locked(lambda: KipMechReportAdapter(
+                mech_report_id=self.report.pk,
+                kip_report_id=self.kip_report.pk,
+                storage=SwapSession.find_or_create(self.report.pk),
+            ).swap_devices(device, exchange_device))()
+            results.append("ok")
+        except DeviceVersionConflict:
+            results.append("conflict")
+        except OperationalError as e:
+            results.append("locked" if is_locked_error(e) else repr(e))
+        finally:
+            connection.close()
+
+    def test_only_one_parallel_swap_wins(self):
+        barrier, results = threading.Barrier(self.WORKERS), []
+        threads = [threading.Thread(target=self.swap, args=(barrier, results)) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.WORKERS)
+        self.assertEqual(results.count("ok"), 1)
+        self.assertLessEqual(set(results) - {"ok"}, {"conflict", "locked"})
+        self.device.refresh_from_db()
+        self.exchange_device.refresh_from_db()
+        self.assertIsNotNone(self.device.stock_id)
+        self.assertEqual(self.exchange_device.version, 2)
+        self.assertEqual(SwapSession.objects.get(mech_report=self.report).device_ids, [self.exchange_device.pk])
@@ -0,0 +1,139 @@
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Place, Rack, Station, SyncMarker
+
+
+TOPOLOGY_VERSION = "topology"
+
+
+class RackEntry:
+    __slots__ = ("pk", "number", "station_id", "station_name", "places")
+
+    def __init__(self, pk, number, station_id, station_name):
+        self.pk = pk
+        self.number = number
+        self.station_id = station_id
+        self.station_name = station_name
+        self.places = []
+
+    def __str__(self):
+        return f"({self.station_name}){self.number}"
+
+
+class PlaceEntry:
+    __slots__ = ("pk", "number", "rack", "is_other")
+
+    def __init__(self, pk, number, rack: RackEntry):
+        self.pk = pk
+        self.number = number
+        self.rack = rack
+        self.is_other = (number == Place.OTHER_PLACES_NUMBER
+                         and rack.number in Place.OTHER_PLACES_RACKS)
+
+    @property
+    def station_id(self):
+        return self.rack.station_id
+
+    def __str__(self):
+        return f"({str(self.rack.station_name)[:5]}){self.rack.number}-{self.number}"
+
+
+class Topology:
+    """Стативы и места всех станций, загруженные двумя запросами.
+    Места ищутся по станции и нормализованному адресу 'статив-место'"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.racks: dict[tuple, RackEntry] = {}
+        self.station_racks: dict[int, list[RackEntry]] = {}
+        self.places: dict[int, PlaceEntry] = {}
+        self.addresses: dict[tuple, PlaceEntry] = {}
+
+        stations = dict(Station.objects.values_list("pk", "name"))
+        racks_by_id = {}
+        for pk, number, station_id in Rack.objects.values_list("pk", "number", "station_id"):
+            rack = RackEntry(pk, number, station_id, stations.get(station_id))
+            racks_by_id[pk] = rack
+            self.station_racks.setdefault(station_id, []).append(rack)
+            if number is not None:
+                self.racks.setdefault((station_id, number.casefold()), rack)
+
+        for pk, number, rack_id, address_key in Place.objects.values_list(
+            "pk", "number", "rack_id", "address_key",
+        ):
+            rack = racks_by_id[rack_id]
+            place = PlaceEntry(pk, number, rack)
+            rack.places.append(place)
+            self.places[pk] = place
+            self.addresses.setdefault((rack.station_id, address_key), place)
+
+    def rack(self, station_id: int, number: str) -> RackEntry | None:
+        return self.racks.get((station_id, " ".join(number.split()).casefold()))
+
+    def rack_numbers(self, station_id: int) -> list[str]:
+        return sorted(rack.number for rack in self.station_racks.get(station_id, ()) if rack.number)
+
+    def resolve(self, station_id: int, address: str) -> PlaceEntry | None:
+        return self.addresses.get((station_id, Place.normalize_address(address)))
+
+    def is_other_place(self, place_id: int) -> bool:
+        place = self.places.get(place_id)
+        return bool(place and place.is_other)
+
+    def has_other_places_number(self, place_id: int) -> bool:
+        """Место с номером 'остальное' на любом стативе: так отчеты
+        механиков выбирают замену без проверки статива"""
+
+        place = self.places.get(place_id)
+        return bool(place and place.number == Place.OTHER_PLACES_NUMBER)
+
+
+_topology: Topology | None = None
+_checked_at = 0.0
+
+
+def _stored_version() -> int:
+    return SyncMarker.objects.filter(key=TOPOLOGY_VERSION).values_list("value", flat=True).first() or 0
+
+
+def get_topology() -> Topology:
+    """Возвращает кэш топологии процесса. Версия в базе сверяется
+    не чаще раза в TOPOLOGY_CHECK_SECONDS, поэтому изменения из других
+    процессов становятся видны с этой задержкой"""
+
+    global _topology, _checked_at
+
+    now = monotonic()
+    if _topology is not None and now - _checked_at < settings.TOPOLOGY_CHECK_SECONDS:
+        return _topology
+
+    version = _stored_version()
+    if _topology is None or _topology.version != version:
+        _topology = Topology(version)
+    _checked_at = now
+    return _topology
+
+
+def _reset():
+    global _topology
+
+    _topology = None
+
+
+def _bump_version():
+    _reset()
+    marker, _ = SyncMarker.objects.get_or_create(key=TOPOLOGY_VERSION)
+    SyncMarker.objects.filter(pk=marker.pk).update(value=F("value") + 1)
+
+
+def invalidate_topology():
+    """Сбрасывает кэш своего процесса сразу, а версию для остальных
+    процессов повышает после фиксации транзакции, чтобы они не успели
+    загрузить старые данные под новой версией"""
+
+    _reset()
+    transaction.on_commit(_bump_version)
@@ -7,4 +7,7 @@ urlpatterns = [
     path("comment/create/<int:mech_report_id>/", views.create_comment, name="create_comment"),
     path("mechanicreport/create/<int:kip_report_id>/", views.create_mech_reports, name="create_mech_reports"),
     path("device/defect/<int:device_id>/", views.mark_defect_device, name="mark_defect_device"),
+    path("export/<int:job_id>/download/", views.download_export, name="download_export"),
+    path("profile/<int:profile_id>/download/", views.download_profile, name="download_profile"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
\ No newline at end of file
@@ -1,36 +1,39 @@
+import json
+import logging
 import re
+from functools import wraps
 from typing import Type
 
-from django.http import HttpResponseRedirect, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
-from .models import Device, Stock, Comment, MechanicReport, KipReport, DeviceKipReport, Place, Station
+from .db import retry_on_locked, serialized_write
+from .exports import job_path
+from .metrics import CONTENT_TYPE, DEVICE_ACTIONS, REGISTRY
+from .profiling import profile_path
+from .models import (Device,
+                     DeviceVersionConflict,
+                     Stock,
+                     Comment,
+                     MechanicReport,
+                     KipReport,
+                     ExportJob,
+                     PlaceOccupancy,
+                     RequestProfile,
+                     SwapSession)
+from .planner import MechReportPlanner
+from .topology import get_topology
 from django.db.utils import IntegrityError
-from django.db.models import Q
+from django.db.models import F, Q
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.admin.models import LogEntry, CHANGE
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
 
 
-class DataStorage:
-    instances = []
-
-    def __init__(self, id_: int):
-        self.id_ = id_
-        self.data: list[Device] = []
-
-    @classmethod
-    def find_or_create(cls, id_: int):
-        for instance in cls.instances:
-            if instance.id_ == id_:
-                instance_ = instance
-                break
-        else:
-            instance_ = cls(id_)
-            cls.instances.append(instance_)
-
-        return instance_
+logger = logging.getLogger(__name__)
 
 
 class Report:
@@ -68,7 +71,7 @@ class KipMechReportAdapter:
     def __init__(self,
                  mech_report_id: int,
                  kip_report_id: int,
-                 storage: DataStorage):
+                 storage: SwapSession):
         self.mech_report = mech_report_id
         self.kip_report = kip_report_id
         self.storage = storage
@@ -86,8 +89,10 @@ class KipMechReportAdapter:
         ])
 
     @staticmethod
-    def _send_to_stock(device_id: int):
+    def _send_to_stock(device_id: int, version: int = None):
         device = Device.objects.get(id=device_id)
+        if version is not None and device.version != version:
+            raise DeviceVersionConflict(device)
         device.name = None
         device.current_check_date = None
         device.next_check_date = None
@@ -111,12 +116,14 @@ class KipMechReportAdapter:
             "mounting_address",
         ])
 
+    @serialized_write()
     def _defect_device_actions(self,
                                device: Device,
                                exchange_device: Device):
-        self.storage.data.append(exchange_device)
+        Device.objects.lock(device.pk, exchange_device.pk)
+        self.storage.add(exchange_device.pk)
         self._copy_fields(device, exchange_device)
-        self._send_to_stock(exchange_device.id)
+        self._send_to_stock(exchange_device.id, exchange_device.version)
         self.mech_report.devices.remove(device)
 
     def find_avz_exchange_device(self, device: Device) -> Device | None:
@@ -127,8 +134,8 @@ class KipMechReportAdapter:
             status=Device.send,
             avz=device.avz,
             device_type=device.device_type,
-        ).order_by("-next_check_date").exclude(
-            pk__in=[device.pk for device in self.storage.data]
+        ).order_by(F("next_check_date").desc(nulls_last=True), "-pk").exclude(
+            pk__in=self.storage.device_ids
         )
 
         exchange_device = avz_devices.last()
@@ -147,8 +154,8 @@ class KipMechReportAdapter:
                 status=Device.send,
                 mounting_address=device.mounting_address,
                 device_type=device.device_type,
-        )).order_by("-next_check_date").exclude(
-            pk__in=[device.pk for device in self.storage.data]
+        )).order_by(F("next_check_date").desc(nulls_last=True), "-pk").exclude(
+            pk__in=self.storage.device_ids
         )
 
         exchange_device = kip_devices.last()
@@ -160,9 +167,8 @@ class KipMechReportAdapter:
         монтажный адрес - точное место на стативе станции"""
 
         current_mounting_address = device.mounting_address
-        devices = current_mounting_address.device_set
 
-        if devices.count() > 2:
+        if PlaceOccupancy.of(current_mounting_address.pk).count > 2:
             raise ValueError(f"К адресу {current_mounting_address} относится"
                              "больше двух приборов, "
                              "проверьте данное место "
@@ -173,25 +179,79 @@ class KipMechReportAdapter:
             mounting_address=device.mounting_address,
             device_type=device.device_type,
             status=Device.send,
-        )[0]
+        ).order_by("pk")[0]
 
         return exchange_device
 
+    @serialized_write()
     def swap_devices(self, device: Device, exchange_device: Device):
-        self.storage.data.append(exchange_device)
+        Device.objects.lock(device.pk, exchange_device.pk)
+        self.storage.add(exchange_device.pk)
         self._copy_fields(device, exchange_device)
-        self._send_to_stock(device.id)
+        self._send_to_stock(device.id, device.version)
 
+    @serialized_write()
     def install_device(self, device: Device):
+        Device.objects.lock(device.pk)
         device.stock = None
         device.status = device.get_status()
         device.save(update_fields=[
             "status",
             "stock",
         ])
-        self.storage.data.append(device)
+        self.storage.add(device.pk)
+
+
+def check_device_version(request, device: Device):
+    """Сверяет версию прибора, с которой была открыта страница"""
 
+    version = request.POST.get("version")
+    if version and version.isdigit() and int(version) != device.version:
+        raise DeviceVersionConflict(device)
 
+
+def version_conflict_response(view):
+    """Отвечает 409, если прибор успели изменить параллельно"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except DeviceVersionConflict as e:
+            return JsonResponse({"success": False,
+                                 "conflict": True,
+                                 "message": f"{e}"},
+                                status=409)
+    return wrapper
+
+
+def count_outcome(action: str):
+    """Считает результаты действия с прибором в метрике arm_device_actions:
+    success, rejected (отказ с сообщением), conflict (409) или error"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            outcome = "error"
+            try:
+                response = view(request, *args, **kwargs)
+                if response is not None:
+                    if response.status_code == 409:
+                        outcome = "conflict"
+                    elif isinstance(response, JsonResponse):
+                        outcome = "success" if json.loads(response.content).get("success") else "rejected"
+                    elif response.status_code < 400:
+                        outcome = "success"
+                return response
+            finally:
+                DEVICE_ACTIONS.labels(action, outcome).inc()
+        return wrapper
+    return decorator
+
+
+@count_outcome("update_device")
+@version_conflict_response
+@retry_on_locked
 def update_device(request, device_id):
     if request.method == "POST":
         if request.user.groups.filter(~Q(name="электромеханики")):
@@ -201,7 +261,7 @@ def update_device(request, device_id):
             re.search(r"(?<=mechanicreport/)(\d+)(?=/change)",
                       request.META.get("HTTP_REFERER")).group()
         )
-        current_storage: DataStorage = DataStorage.find_or_create(mechanic_report_id)
+        current_storage = SwapSession.find_or_create(mechanic_report_id)
 
         try:
             kip_report_id = int(request.POST.get("kip_report_id"))
@@ -216,6 +276,7 @@ def update_device(request, device_id):
                                      "message": f"Отчета КИП N {kip_report_id} не существует"})
             else:
                 device = Device.objects.get(pk=device_id)
+                check_device_version(request, device)
                 if device.status == Device.send:
                     adapter.install_device(device)
                     message = f"{device} установлен на {device.mounting_address}"
@@ -235,7 +296,7 @@ def update_device(request, device_id):
                             return JsonResponse({"success": False,
                                                  "message": "Нет приборов для замены"})
 
-                    elif device.mounting_address.number == "остальное":
+                    elif get_topology().has_other_places_number(device.mounting_address_id):
                         exchange_device = adapter.find_other_places_exchange_device(device)
 
                         if exchange_device:
@@ -276,114 +337,31 @@ def create_comment(request, mech_report_id):
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@version_conflict_response
+@retry_on_locked
 def create_mech_reports(request, kip_report_id):
-    print("Пришло с запроса - kip_report_id=", kip_report_id)
-    stations = {}
+    logger.debug("create_mech_reports kip_report_id=%s preview=%s", kip_report_id, bool(request.GET.get("preview")))
 
-    other_places = Place.objects.filter(
-        Q(rack__number="релейная") | Q(rack__number="тоннель") | Q(rack__number="поле"),
-        number="остальное",
-    )
+    if request.GET.get("preview"):
+        try:
+            kip_report = KipReport.objects.get(id=kip_report_id)
+        except KipReport.DoesNotExist:
+            return JsonResponse({"success": False,
+                                 "message": f"Отчета КИП N {kip_report_id} не существует"})
+        return JsonResponse({"success": True,
+                             "stations": MechReportPlanner(kip_report).preview()})
 
     if request.method == "POST":
         messages.add_message(request, messages.WARNING, "Hello world.")
         kip_report = KipReport.objects.get(id=kip_report_id)
-        kip_report_devices = kip_report.devices.through.objects.filter(kip_report=kip_report)
-        added_devices = []
-
-        for instance in kip_report_devices:
-
-            instance.device.status = Device.send
-            instance.device.who_checked = instance.who_checked
-            instance.device.who_prepared = instance.who_prepared
-            instance.device.current_check_date = instance.check_date
-            instance.device.next_check_date = instance.device.get_next_check_date()
-            instance.device.save()
-
-            if instance.device.avz:
-                station_avz_devices = instance.device.avz.device_set.order_by(
-                    "-next_check_date"
-                ).filter(
-                    ~Q(status__in=[Device.send, Device.in_progress]),
-                    device_type=instance.device.device_type
-                ).exclude(pk__in=[device.pk for device in kip_report.devices.all()] +
-                                 [device.pk for device in added_devices])
-
-                if station_avz_devices:
-                    mech_device = station_avz_devices.last()
-                    added_devices.append(mech_device)
-                    stations.setdefault(instance.device.station.pk, []).append(mech_device)
-                else:
-                    added_devices.append(instance.device)
-                    stations.setdefault(instance.device.station.pk, []).append(instance.device)
-
-                instance.device.status = Device.send
-                instance.device.save()
-                continue
-
-            other_device_on_place = [device for device in Device.objects.filter(
-                ~Q(pk=instance.device.pk),
-                station=instance.device.station,
-                mounting_address=instance.device.mounting_address,
-                device_type=instance.device.device_type,
-            )]
-
-            if instance.device.mounting_address in other_places:
-                print(f"{instance.device} найден в релейная-остальное станции {instance.station}")
-                for current_place in other_places:
-                    if instance.device.mounting_address == current_place:
-                        print(f"Найдено совпадение по адресу в {current_place}")
-
-                        this_place_other_devices = [device for device in Device.objects.filter(
-                            ~Q(status=Device.send) & Q(status=Device.ready) & Q(status=Device.overdue),
-                            ~Q(pk=instance.device.pk),
-                            station=instance.device.station,
-                            avz=instance.device.avz,
-                            device_type=instance.device.device_type,
-                            mounting_address=current_place,
-                        ) if device not in added_devices]
-
-                        print(f"Найдены приборы по фильтру {this_place_other_devices}")
-
-                        if this_place_other_devices:
-                            this_place_other_device = this_place_other_devices[0]
-                            print(f"Добавили в отчет прибор {this_place_other_device}")
-                            added_devices.append(this_place_other_device)
-                            stations.setdefault(
-                                this_place_other_device.station.pk, []
-                            ).append(this_place_other_device)
-                            break
-                else:
-                    print(f"Приборов по фильтру нет, поэтому добавили {instance.device}")
-                    added_devices.append(instance.device)
-                    stations.setdefault(
-                        instance.device.station.pk, []
-                    ).append(instance.device)
-
-            elif len(other_device_on_place) == 1:
-                mech_device = list(other_device_on_place)[0]
-                added_devices.append(mech_device)
-                stations.setdefault(mech_device.station.pk, []).append(mech_device)
-            else:
-                added_devices.append(instance.device)
-                stations.setdefault(instance.device.station.pk, []).append(instance.device)
-
-        for station, devices in stations.items():
-            if devices:
-                MechanicReport.objects.create(
-                    title=f"КИП N {kip_report_id} ({Station.objects.get(pk=station).__str__()})",
-                    user=request.user,
-                    station=Station.objects.get(pk=station),
-                    explanation=f"Отправленный ящик из отчета КИП №{kip_report_id}. "
-                                f"Сформированно автоматически"
-                ).devices.set(Device.objects.filter(pk__in=[device.pk for device in devices]))
-        print((stations))
-        kip_report.editable = False
-        kip_report.save()
+        MechReportPlanner(kip_report).execute(user=request.user)
 
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@count_outcome("mark_defect_device")
+@version_conflict_response
+@retry_on_locked
 def mark_defect_device(request, device_id):
     if request.method == "POST":
         if request.user.groups.filter(~Q(name="электромеханики")):
@@ -394,7 +372,7 @@ def mark_defect_device(request, device_id):
             re.search(r"(?<=mechanicreport/)(\d+)(?=/change)",
                       request.META.get("HTTP_REFERER")).group()
         )
-        current_storage: DataStorage = DataStorage.find_or_create(mechanic_report_id)
+        current_storage = SwapSession.find_or_create(mechanic_report_id)
 
         try:
             kip_report_id = int(request.POST.get("kip_report_id"))
@@ -409,8 +387,9 @@ def mark_defect_device(request, device_id):
                                      "message": f"Отчета КИП N {kip_report_id} не существует"})
             else:
                 device = Device.objects.get(pk=device_id)
+                check_device_version(request, device)
                 if device.status == Device.send:
-                    adapter._send_to_stock(device.id)
+                    adapter._send_to_stock(device.id, device.version)
                 else:
                     if device.avz:
                         exchange_device = adapter.find_avz_exchange_device(device)
@@ -426,7 +405,7 @@ def mark_defect_device(request, device_id):
                                                  "message": "Нет приборов, "
                                                             "у которых можно отметить дефект"})
 
-                    elif device.mounting_address.number == "остальное":
+                    elif get_topology().has_other_places_number(device.mounting_address_id):
                         exchange_device = adapter.find_other_places_exchange_device(device)
 
                         if exchange_device:
@@ -452,3 +431,41 @@ def mark_defect_device(request, device_id):
                                                  "message": f"Прибор {exchange_device} "
                                                             f"отправлен обратно на склад"})
     return JsonResponse({"success": True})
+
+
+@staff_member_required
+def download_export(request, job_id):
+    jobs = ExportJob.objects.filter(status=ExportJob.done)
+    if not request.user.is_superuser:
+        jobs = jobs.filter(user=request.user)
+    try:
+        job = jobs.get(pk=job_id)
+    except ExportJob.DoesNotExist:
+        raise Http404("Выгрузка не найдена или еще не готова")
+
+    path = job_path(job)
+    if not path.is_file():
+        raise Http404("Файл выгрузки удален, запросите выгрузку повторно")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=job.file_name)
+
+
+@staff_member_required
+def download_profile(request, profile_id):
+    try:
+        profile = RequestProfile.objects.get(pk=profile_id)
+    except RequestProfile.DoesNotExist:
+        raise Http404("Профиль не найден")
+
+    path = profile_path(profile)
+    if not profile.file_name or not path.is_file():
+        raise Http404("Файл профиля удален")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=profile.file_name)
+
+
+def metrics(request):
+    """Метрики в формате Prometheus, доступны с адресов METRICS_ALLOWED_IPS
+    и сотрудникам"""
+
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 
@@ -48,10 +49,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ARM.middleware.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ARM.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -80,13 +83,62 @@ WSGI_APPLICATION = 'ARM_SHN.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Рабочий профиль SQLite: WAL позволяет читать во время записи,
+# busy_timeout заставляет писателей ждать, а не падать с
+# "database is locked". Подключения переиспользуются CONN_MAX_AGE секунд
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('ARM_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('ARM_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': int(os.environ.get('ARM_SQLITE_TIMEOUT', 20)),
+        },
+    }
+}
+
+# PostgreSQL включается переменной ARM_DB_ENGINE=postgresql. Постоянные
+# подключения держатся CONN_MAX_AGE секунд; при работе через пул
+# PgBouncer в режиме transaction нужно ARM_PG_BOUNCER=1, чтобы Django
+# не открывал серверные курсоры для iterator()
+if os.environ.get('ARM_DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('ARM_DB_NAME', 'arm'),
+        'USER': os.environ.get('ARM_DB_USER', 'arm'),
+        'PASSWORD': os.environ.get('ARM_DB_PASSWORD', ''),
+        'HOST': os.environ.get('ARM_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('ARM_DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('ARM_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('ARM_PG_BOUNCER') == '1',
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('ARM_DB_CONNECT_TIMEOUT', 5)),
+        },
     }
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('ARM_SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': 'normal',
+    'busy_timeout': int(os.environ.get('ARM_SQLITE_TIMEOUT', 20)) * 1000,
+    'temp_store': 'memory',
+    'cache_size': -20_000,
+}
+
+# Старая база MySQL для переноса приборов (manage.py import_legacy)
+LEGACY_DB = {
+    'host': os.environ.get('ARM_LEGACY_DB_HOST', 'localhost'),
+    'port': int(os.environ.get('ARM_LEGACY_DB_PORT', 3306)),
+    'user': os.environ.get('ARM_LEGACY_DB_USER', 'test_user'),
+    'passwd': os.environ.get('ARM_LEGACY_DB_PASSWORD', '1234'),
+    'db': os.environ.get('ARM_LEGACY_DB_NAME', 'test_bd'),
 }
 
+# Повторы транзакций, упавших с "database is locked" (ARM.db.retry_on_locked)
+DB_RETRY_ATTEMPTS = 5
+DB_RETRY_DELAY = 0.05
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -134,6 +186,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CRON_CLASSES = [
     'ARM.cron.UpdateDeviceStatuses',
+    'ARM.cron.ReconcileDeviceStatuses',
+    'ARM.cron.PurgeRequestQueryLogs',
+    'ARM.cron.RebuildReplacementCalendar',
 ]
 
 ADMIN_INTERFACE_THEME = 'dark'
@@ -143,3 +198,84 @@ SILENCED_SYSTEM_CHECKS = ["security.W019"]
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 15_000
 
 APPEND_SLASH = True
+
+# Сессии замен приборов по отчетам механиков (ARM.models.SwapSession)
+SWAP_SESSION_TTL = 12 * 60 * 60
+SWAP_SESSION_MAX = 1_000
+
+# Выгрузки в Excel: больше EXPORT_INLINE_LIMIT строк выгружаются в фоне
+# командой export_worker, одинаковые запросы в течение EXPORT_CACHE_SECONDS
+# получают уже готовый файл, файлы хранятся EXPORT_KEEP_SECONDS. Выгрузки,
+# выполняющиеся дольше EXPORT_STALE_SECONDS, воркер при запуске считает прерванными
+EXPORT_ROOT = BASE_DIR / "exports"
+EXPORT_INLINE_LIMIT = 5_000
+EXPORT_CACHE_SECONDS = 10 * 60
+EXPORT_KEEP_SECONDS = 24 * 60 * 60
+EXPORT_STALE_SECONDS = 60 * 60
+
+# Кэш стативов и мест (ARM.topology): версия в базе проверяется
+# не чаще одного раза в TOPOLOGY_CHECK_SECONDS
+TOPOLOGY_CHECK_SECONDS = 5
+
+# Статистика запросов к базе (ARM.middleware.QueryStatsMiddleware).
+# Бюджет - наибольшее допустимое число запросов на одну страницу, его
+# проверяют тесты (ARM.querystats.QueryBudgetMixin), а превышение в работе
+# пишется в лог и в раздел "Статистика запросов". Кроме того, сохраняются
+# запросы не меньше QUERY_LOG_MIN_QUERIES обращений к базе или дольше
+# QUERY_LOG_MIN_MS миллисекунд; записи хранятся QUERY_LOG_KEEP_DAYS дней
+QUERY_BUDGETS = {
+    'admin:ARM_device_changelist': 25,
+    'admin:ARM_mechanicreport_changelist': 15,
+    'admin:ARM_mechanicreport_change': 20,
+    'admin:ARM_kipreport_change': 25,
+    'update_device': 50,
+    'mark_defect_device': 35,
+    'create_mech_reports': 25,
+}
+QUERY_LOG_MIN_QUERIES = 50
+QUERY_LOG_MIN_MS = 1_000
+QUERY_LOG_SLOWEST = 5
+QUERY_LOG_KEEP_DAYS = 14
+
+# Профилирование отдельного запроса (ARM.middleware.ProfilerMiddleware):
+# сотрудник добавляет к адресу ?_profile или заголовок X-ARM-Profile: 1.
+# Архивы с профилем процессора, хронологией SQL и памятью пишутся в
+# PROFILE_ROOT, хранятся последние PROFILE_KEEP_COUNT не дольше
+# PROFILE_KEEP_DAYS дней. ARM_PROFILE_ENABLED=0 отключает профилирование
+PROFILE_ENABLED = os.environ.get('ARM_PROFILE_ENABLED', '1') == '1'
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_ARM_PROFILE'
+PROFILE_ROOT = BASE_DIR / "profiles"
+PROFILE_KEEP_COUNT = 50
+PROFILE_KEEP_DAYS = 7
+PROFILE_TRACEBACK_FRAMES = 1
+
+# Метрики Prometheus (ARM.metrics) на /arm/metrics/: без входа доступны
+# только с этих адресов, сотрудникам - с любых
+METRICS_ALLOWED_IPS = tuple(
+    address.strip() for address in os.environ.get('ARM_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+)
+
+# ARM_LOG_LEVEL=DEBUG включает подробный журнал действий в ARM
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'ARM': {
+            'handlers': ['console'],
+            'level': os.environ.get('ARM_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'ARM.queries': {
+            'handlers': ['console'],
+            'level': os.environ.get('ARM_QUERY_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
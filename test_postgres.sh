@@ -0,0 +1,39 @@
+#!/usr/bin/env bash
+# Прогон тестов на PostgreSQL. Если ARM_DB_HOST не задан, поднимает
+# временный кластер через pg_ctl (или контейнер postgres:15 через docker)
+# на порту ARM_DB_PORT (по умолчанию 55432) и останавливает его после тестов.
+#
+#   ./test_postgres.sh                 # все тесты
+#   ./test_postgres.sh ARM.tests.SwapTests
+set -euo pipefail
+
+cd "$(dirname "$0")"
+
+export ARM_DB_ENGINE=postgresql
+export ARM_DB_NAME="${ARM_DB_NAME:-arm}"
+export ARM_DB_USER="${ARM_DB_USER:-arm}"
+export ARM_DB_PASSWORD="${ARM_DB_PASSWORD:-arm}"
+export ARM_DB_PORT="${ARM_DB_PORT:-55432}"
+
+cleanup() { :; }
+
+if [ -z "${ARM_DB_HOST:-}" ]; then
+    export ARM_DB_HOST=127.0.0.1
+
+    if command -v pg_ctl >/dev/null; then
+        PGDATA="$(mktemp -d)"
+        initdb -D "$PGDATA" -U "$ARM_DB_USER" --auth=trust >/dev/null
+        pg_ctl -D "$PGDATA" -o "-p $ARM_DB_PORT -k $PGDATA" -l "$PGDATA/log" -w start >/dev/null
+        cleanup() { pg_ctl -D "$PGDATA" -m fast stop >/dev/null; rm -rf "$PGDATA"; }
+    else
+        CONTAINER="arm-test-postgres-$$"
+        docker run -d --rm --name "$CONTAINER" -p "$ARM_DB_PORT:5432" \
+            -e POSTGRES_USER="$ARM_DB_USER" -e POSTGRES_PASSWORD="$ARM_DB_PASSWORD" \
+            -e POSTGRES_DB="$ARM_DB_NAME" postgres:15 >/dev/null
+        cleanup() { docker stop "$CONTAINER" >/dev/null; }
+        until docker exec "$CONTAINER" pg_isready -U "$ARM_DB_USER" >/dev/null 2>&1; do sleep 1; done
+    fi
+fi
+trap cleanup EXIT
+
+python manage.py test --noinput "$@"